@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import numpy as np
+
+from Bio import AlignIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.Align import MultipleSeqAlignment
+
+
+class AlignmentMatrix(object):
+    # multiple alignment stored as uint8 numpy matrix(rows - sequences, columns - alignment columns),
+    # all column statistics and filters are whole-array operations over this matrix
+
+    def __init__(self, matrix=None, ids=None, descriptions=None):
+        self.matrix = matrix if matrix is not None else np.zeros((0, 0), dtype=np.uint8)
+        self.ids = list(ids) if ids is not None else []
+        # descriptions are None for alignments created from scratch(i.e. extracted sites)
+        self.descriptions = list(descriptions) if descriptions is not None else None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def get_alignment_length(self):
+        return self.matrix.shape[1]
+
+    @staticmethod
+    def _matrix_from_strings(sequence_list):
+        if not sequence_list:
+            return np.zeros((0, 0), dtype=np.uint8)
+        alignment_length = len(sequence_list[0])
+        for index in range(1, len(sequence_list)):
+            if len(sequence_list[index]) != alignment_length:
+                raise ValueError("Sequences in alignment have different lengths: %i(first) and %i(%i-th)"
+                                 % (alignment_length, len(sequence_list[index]), index + 1))
+        return np.frombuffer("".join(sequence_list), dtype=np.uint8).reshape(len(sequence_list),
+                                                                             alignment_length).copy()
+
+    @classmethod
+    def from_alignment(cls, alignment):
+        # alignment - MultipleSeqAlignment or list of SeqRecords
+        return cls(cls._matrix_from_strings([str(record.seq) for record in alignment]),
+                   ids=[record.id for record in alignment],
+                   descriptions=[record.description for record in alignment])
+
+    @classmethod
+    def read(cls, alignment_file, format="fasta"):
+        # fasta is parsed directly to strings, other formats are parsed by AlignIO
+        if format != "fasta":
+            return cls.from_alignment(AlignIO.read(alignment_file, format=format))
+
+        ids = []
+        descriptions = []
+        sequence_list = []
+        with open(alignment_file, "r") as in_fd:
+            sequence_parts = None
+            for line in in_fd:
+                if line[0] == ">":
+                    if sequence_parts is not None:
+                        sequence_list.append("".join(sequence_parts))
+                    description = line[1:].strip()
+                    ids.append(description.split()[0] if description else "")
+                    descriptions.append(description)
+                    sequence_parts = []
+                elif sequence_parts is not None:
+                    sequence_parts.append(line.strip().replace(" ", ""))
+            if sequence_parts is not None:
+                sequence_list.append("".join(sequence_parts))
+
+        return cls(cls._matrix_from_strings(sequence_list), ids=ids, descriptions=descriptions)
+
+    def get_sequence(self, index):
+        return self.matrix[index].tostring()
+
+    def to_alignment(self):
+        record_list = []
+        for index in range(0, len(self)):
+            if self.descriptions is None:
+                record = SeqRecord(seq=Seq(self.get_sequence(index)), id=self.ids[index])
+            else:
+                record = SeqRecord(seq=Seq(self.get_sequence(index)), id=self.ids[index], name=self.ids[index],
+                                   description=self.descriptions[index])
+            record_list.append(record)
+        return MultipleSeqAlignment(record_list)
+
+    def write(self, output_file, format="fasta", line_width=60):
+        if format != "fasta":
+            AlignIO.write([self.to_alignment()], output_file, format=format)
+            return
+
+        with open(output_file, "w") as out_fd:
+            for index in range(0, len(self)):
+                if self.descriptions is None:
+                    title = "%s <unknown description>" % self.ids[index]
+                elif self.descriptions[index] and (self.descriptions[index].split(None, 1)[0] == self.ids[index]):
+                    title = self.descriptions[index]
+                elif self.descriptions[index]:
+                    title = "%s %s" % (self.ids[index], self.descriptions[index])
+                else:
+                    title = self.ids[index]
+                out_fd.write(">%s\n" % title)
+                sequence = self.get_sequence(index)
+                for start in range(0, len(sequence), line_width):
+                    out_fd.write("%s\n" % sequence[start:start + line_width])
+
+    def get_columns(self, column_selector):
+        # column_selector - slice, boolean mask or array of column indexes
+        return AlignmentMatrix(self.matrix[:, column_selector], ids=self.ids, descriptions=self.descriptions)
+
+    def get_symbol_mask(self, symbol="-"):
+        return self.matrix == ord(symbol)
+
+    def count_symbol_per_column(self, symbol="-"):
+        return np.count_nonzero(self.get_symbol_mask(symbol), axis=0) if len(self) > 0 \
+            else np.zeros(self.get_alignment_length(), dtype=np.int64)
+
+    def count_symbol_per_sequence(self, symbol="-"):
+        return np.count_nonzero(self.get_symbol_mask(symbol), axis=1)
+
+    def get_position_presence_matrix(self, gap_symbol="-"):
+        # for gap positions - minus number of gaps in column, for other positions - number of non-gaps in column
+        gap_mask = self.get_symbol_mask(gap_symbol)
+        gap_counts = np.count_nonzero(gap_mask, axis=0)
+        return np.where(gap_mask, -gap_counts, len(self) - gap_counts).astype(int)
+
+    def count_unique_positions_per_sequence(self, gap_symbol="-"):
+        # position is unique for sequence if only this sequence has(or has not) gap in this column
+        gap_mask = self.get_symbol_mask(gap_symbol)
+        gap_counts = np.count_nonzero(gap_mask, axis=0)
+        unique_mask = np.where(gap_mask, gap_counts == 1, gap_counts == len(self) - 1)
+        return np.count_nonzero(unique_mask, axis=1)
+
+    def get_column_mask_by_gaps(self, maximum_number_of_gaps_in_column, gap_symbol="-"):
+        return self.count_symbol_per_column(gap_symbol) <= maximum_number_of_gaps_in_column
+
+    def get_constant_column_mask(self):
+        return (self.matrix == self.matrix[0]).all(axis=0) if len(self) > 0 \
+            else np.ones(self.get_alignment_length(), dtype=bool)
+
+    def get_degenerate_site_columns(self, degenerate_codon_set):
+        # returns indexes of third positions of codons with first two positions identical in all sequences
+        # and forming codon from degenerate_codon_set(i.e. "GCN")
+        if self.get_alignment_length() % 3 > 0:
+            raise ValueError("Length of alignment is not divisible by 3")
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        constant_mask = self.get_constant_column_mask().reshape(-1, 3)
+        first_row = self.matrix[0].reshape(-1, 3)
+
+        degenerate_prefix_table = np.zeros((256, 256), dtype=bool)
+        for codon in degenerate_codon_set:
+            if (len(codon) == 3) and (codon[2] == "N"):
+                degenerate_prefix_table[ord(codon[0]), ord(codon[1])] = True
+
+        codon_mask = constant_mask[:, 0] & constant_mask[:, 1] & \
+                     degenerate_prefix_table[first_row[:, 0], first_row[:, 1]]
+        return np.flatnonzero(codon_mask) * 3 + 2
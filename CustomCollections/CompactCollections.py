@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+import os
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+
+class IdIndex(object):
+    # table of string ids with integer codes, collections sharing the same IdIndex store only codes
+    # and do set operations on integer arrays.
+    # Bulk of ids is stored as sorted numpy array of fixed-width strings(code of id is its position in array,
+    # lookup is binary search), so there is no python object per id.
+    # Ids added after building are stored in list and dictionary and get codes following the array.
+
+    def __init__(self, ids=None, prefix=None, mmap_mode=None):
+        self.sorted_ids = np.zeros(0, dtype="S1")
+        self.extra_ids = []
+        self.extra_codes = {}
+        if prefix:
+            self.load(prefix, mmap_mode=mmap_mode)
+        elif ids is not None:
+            self.add_tokens(np.asarray(list(ids), dtype=str))
+
+    def __len__(self):
+        return len(self.sorted_ids) + len(self.extra_ids)
+
+    def __contains__(self, entry_id):
+        return self.get_code(entry_id, add=False) >= 0
+
+    def add_tokens(self, token_array):
+        # returns codes of strings from numpy array, if index is empty it is built from token_array
+        if len(self) == 0:
+            self.sorted_ids, codes = np.unique(token_array, return_inverse=True)
+            return codes.astype(np.int32)
+        return self.get_codes(token_array)
+
+    def get_code(self, entry_id, add=True):
+        # returns -1 for absent id if add is not set
+        position = np.searchsorted(self.sorted_ids, entry_id)
+        if (position < len(self.sorted_ids)) and (self.sorted_ids[position] == entry_id):
+            return int(position)
+        if entry_id in self.extra_codes:
+            return self.extra_codes[entry_id]
+        if not add:
+            return -1
+        code = len(self)
+        self.extra_codes[entry_id] = code
+        self.extra_ids.append(entry_id)
+        return code
+
+    def get_codes(self, id_list, add=True):
+        values = np.asarray(id_list, dtype=str)
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int32)
+        if len(self.sorted_ids) > 0:
+            positions = np.minimum(np.searchsorted(self.sorted_ids, values), len(self.sorted_ids) - 1)
+            found = self.sorted_ids[positions] == values
+            codes = np.where(found, positions, -1).astype(np.int32)
+        else:
+            found = np.zeros(len(values), dtype=bool)
+            codes = np.full(len(values), -1, dtype=np.int32)
+        for index in np.flatnonzero(~found):
+            codes[index] = self.get_code(str(values[index]), add=add)
+        return codes
+
+    def get_id(self, code):
+        return self.sorted_ids[code] if code < len(self.sorted_ids) else self.extra_ids[code - len(self.sorted_ids)]
+
+    def get_ids(self, codes):
+        codes = np.asarray(codes)
+        if (len(codes) == 0) or (codes.max() < len(self.sorted_ids)):
+            return self.sorted_ids[codes].tolist()
+        return [self.get_id(code) for code in codes]
+
+    def save(self, prefix):
+        # sorted ids are saved to <prefix>.ids.npy(could be memory-mapped), extra ids to <prefix>.extra_ids
+        np.save("%s.ids.npy" % prefix, self.sorted_ids)
+        with open("%s.extra_ids" % prefix, "w") as out_fd:
+            for entry_id in self.extra_ids:
+                out_fd.write("%s\n" % entry_id)
+
+    def load(self, prefix, mmap_mode=None):
+        self.sorted_ids = np.load("%s.ids.npy" % prefix, mmap_mode=mmap_mode)
+        self.extra_ids = []
+        self.extra_codes = {}
+        if os.path.exists("%s.extra_ids" % prefix):
+            with open("%s.extra_ids" % prefix, "r") as in_fd:
+                for line in in_fd:
+                    self.get_code(line.rstrip("\n"))
+        return self
+
+
+class CompactIdSet(object):
+    # set of ids stored as sorted array of unique integer codes from IdIndex
+    # iteration order is order of codes(i.e. lexicographical for ids read in bulk), not order of addition
+
+    def __init__(self, idset=None, id_index=None, filename=None, header=False, column_number=None,
+                 column_separator="\t", comments_prefix=None, id_in_column_separator=None, codes=None):
+        self.id_index = id_index if id_index is not None else IdIndex()
+        self.header = None
+        self.codes = np.unique(np.asarray(codes, dtype=np.int32)) if codes is not None else np.zeros(0, dtype=np.int32)
+        if filename:
+            self.read(filename, header=header, column_number=column_number, column_separator=column_separator,
+                      comments_prefix=comments_prefix, id_in_column_separator=id_in_column_separator)
+        if idset:
+            self.update(idset)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for code in self.codes:
+            yield self.id_index.get_id(code)
+
+    def __contains__(self, entry_id):
+        code = self.id_index.get_code(entry_id, add=False)
+        if code < 0:
+            return False
+        position = np.searchsorted(self.codes, code)
+        return (position < len(self.codes)) and (self.codes[position] == code)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def __eq__(self, other):
+        if isinstance(other, CompactIdSet) and (other.id_index is self.id_index):
+            return np.array_equal(self.codes, other.codes)
+        return set(self) == set(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def add(self, entry_id):
+        self.update([entry_id])
+
+    def update(self, id_iterable):
+        self.codes = np.union1d(self.codes, self._get_other_codes(id_iterable))
+
+    def _get_other_codes(self, other):
+        # codes of other set in self.id_index, ids absent in index are added to it
+        if isinstance(other, CompactIdSet) and (other.id_index is self.id_index):
+            return other.codes
+        return np.unique(self.id_index.get_codes(list(other)))
+
+    def _new(self, codes):
+        return CompactIdSet(id_index=self.id_index, codes=codes)
+
+    def __and__(self, other):
+        return self._new(np.intersect1d(self.codes, self._get_other_codes(other), assume_unique=True))
+
+    def __or__(self, other):
+        return self._new(np.union1d(self.codes, self._get_other_codes(other)))
+
+    def __sub__(self, other):
+        return self._new(np.setdiff1d(self.codes, self._get_other_codes(other), assume_unique=True))
+
+    def __xor__(self, other):
+        return self._new(np.setxor1d(self.codes, self._get_other_codes(other), assume_unique=True))
+
+    intersection = __and__
+    union = __or__
+    difference = __sub__
+    symmetric_difference = __xor__
+
+    def issubset(self, other):
+        return len(self - other) == 0
+
+    def read(self, filename, header=False, close_after_if_file_object=False, column_number=None, column_separator="\t",
+             comments_prefix=None, id_in_column_separator=None):
+        # reads ids from file with one id per line
+        in_fd = filename if isinstance(filename, file) else open(filename, "r")
+        if comments_prefix:
+            com_pref_len = len(comments_prefix)
+        if header:
+            self.header = in_fd.readline().strip()
+        token_list = []
+        for line in in_fd:
+            if comments_prefix:
+                if line[: com_pref_len] == comments_prefix:
+                    continue
+            ids = line.strip().split(column_separator)[column_number] if column_number is not None else line.strip()
+            if id_in_column_separator:
+                token_list.extend(ids.split(id_in_column_separator))
+            else:
+                token_list.append(ids)
+
+        if (not isinstance(filename, file)) or close_after_if_file_object:
+            in_fd.close()
+        if token_list:
+            self.codes = np.union1d(self.codes, self.id_index.add_tokens(np.array(token_list, dtype=str)))
+        return self
+
+    def write(self, filename, header=False, close_after_if_file_object=False, sort=True):
+        out_fd = filename if isinstance(filename, file) else open(filename, "w")
+        if header:
+            if header is True and self.header:
+                out_fd.write(self.header + "\n")
+        for entry in sorted(self) if sort else self:
+            out_fd.write(entry + "\n")
+
+        if (not isinstance(filename, file)) or close_after_if_file_object:
+            out_fd.close()
+
+
+class CompactSynDict(object):
+    # analog of SynDict with split values(key -> list of synonyms) for large tables
+    # keys and values are stored as integer codes from IdIndex:
+    #   self.keys_codes - codes of keys in order of reading
+    #   self.offsets - values of i-th key are self.values_codes[self.offsets[i]:self.offsets[i+1]]
+    # arrays could be saved to disk and loaded as memory-mapped(see save and load)
+
+    # number of lines converted to numpy arrays at once during reading
+    chunk_size = 100000
+
+    def __init__(self, filename=None, id_index=None, header=False, separator="\t", allow_repeats_of_key=False,
+                 values_separator=",", key_index=0, value_index=1, close_after_if_file_object=False,
+                 comments_prefix=None):
+        self.id_index = id_index if id_index is not None else IdIndex()
+        self.header = None
+        self._set_arrays(np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        if filename:
+            self.read(filename, header=header, separator=separator, allow_repeats_of_key=allow_repeats_of_key,
+                      values_separator=values_separator, key_index=key_index, value_index=value_index,
+                      close_after_if_file_object=close_after_if_file_object, comments_prefix=comments_prefix)
+
+    def _set_arrays(self, keys_codes, offsets, values_codes):
+        self.keys_codes = keys_codes
+        self.offsets = offsets
+        self.values_codes = values_codes
+        # keys are found by binary search in sorted codes
+        self.key_order = np.argsort(self.keys_codes, kind="mergesort")
+        self.sorted_keys_codes = self.keys_codes[self.key_order]
+
+    def _get_row(self, key):
+        code = self.id_index.get_code(key, add=False)
+        if code < 0:
+            return -1
+        position = np.searchsorted(self.sorted_keys_codes, code)
+        if (position < len(self.sorted_keys_codes)) and (self.sorted_keys_codes[position] == code):
+            return self.key_order[position]
+        return -1
+
+    def __len__(self):
+        return len(self.keys_codes)
+
+    def __iter__(self):
+        for code in self.keys_codes:
+            yield self.id_index.get_id(code)
+
+    def __contains__(self, key):
+        return self._get_row(key) >= 0
+
+    def keys(self):
+        return self.id_index.get_ids(self.keys_codes)
+
+    def get_codes(self, key):
+        # returns array of codes of values
+        row = self._get_row(key)
+        if row < 0:
+            raise KeyError(key)
+        return self.values_codes[self.offsets[row]:self.offsets[row + 1]]
+
+    def __getitem__(self, key):
+        return self.id_index.get_ids(self.get_codes(key))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def iteritems(self):
+        for row, code in enumerate(self.keys_codes):
+            yield self.id_index.get_id(code), \
+                  self.id_index.get_ids(self.values_codes[self.offsets[row]:self.offsets[row + 1]])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [value for key, value in self.iteritems()]
+
+    def key_set(self):
+        return CompactIdSet(id_index=self.id_index, codes=self.keys_codes)
+
+    def value_set(self, key_list=None):
+        # returns CompactIdSet of values of all keys or keys from key_list
+        if key_list is None:
+            return CompactIdSet(id_index=self.id_index, codes=self.values_codes)
+        rows = [row for row in map(self._get_row, key_list) if row >= 0]
+        if not rows:
+            return CompactIdSet(id_index=self.id_index)
+        return CompactIdSet(id_index=self.id_index,
+                            codes=np.concatenate([self.values_codes[self.offsets[row]:self.offsets[row + 1]]
+                                                  for row in rows]))
+
+    def count_synonyms(self):
+        count_dict = OrderedDict()
+        for key, count in zip(self.keys(), np.diff(self.offsets)):
+            count_dict[key] = int(count)
+        return count_dict
+
+    def count_all_synonyms(self):
+        return len(self.values_codes)
+
+    @classmethod
+    def _tokenize(cls, filename, header=False, separator="\t", values_separator=",", key_index=0, value_index=1,
+                  close_after_if_file_object=False, comments_prefix=None):
+        # returns header, numpy arrays of keys and values(as fixed-width strings) and array of numbers of values
+        # lines are converted to arrays by chunks, so there are no python objects per id except current chunk
+        in_fd = filename if isinstance(filename, file) else open(filename, "r")
+        if comments_prefix:
+            com_pref_len = len(comments_prefix)
+        header_line = in_fd.readline().strip() if header else None
+
+        key_chunks = []
+        value_chunks = []
+        counts = array("l")
+        key_list = []
+        value_list = []
+        for line in in_fd:
+            if comments_prefix:
+                if line[: com_pref_len] == comments_prefix:
+                    continue
+            tmp = line.strip().split(separator) if separator else line.strip().split()
+            key_list.append(tmp[key_index])
+            values = tmp[value_index].split(values_separator)
+            value_list.extend(values)
+            counts.append(len(values))
+            if len(key_list) == cls.chunk_size:
+                key_chunks.append(np.array(key_list, dtype=str))
+                value_chunks.append(np.array(value_list, dtype=str))
+                key_list = []
+                value_list = []
+        key_chunks.append(np.array(key_list, dtype=str))
+        value_chunks.append(np.array(value_list, dtype=str))
+
+        if (not isinstance(filename, file)) or close_after_if_file_object:
+            in_fd.close()
+
+        return header_line, np.concatenate(key_chunks), np.concatenate(value_chunks), \
+               np.frombuffer(counts, dtype=np.int64) if counts else np.zeros(0, dtype=np.int64)
+
+    def _add_codes(self, keys_codes, counts, values_codes, allow_repeats_of_key=False):
+        offsets = np.zeros(len(self.keys_codes) + len(keys_codes) + 1, dtype=np.int64)
+        offsets[:len(self.offsets)] = self.offsets
+        offsets[len(self.offsets):] = self.offsets[-1] + np.cumsum(counts)
+        keys_codes = np.concatenate([self.keys_codes, keys_codes]).astype(np.int32)
+        values_codes = np.concatenate([self.values_codes, values_codes]).astype(np.int32)
+
+        unique_codes, first_rows, row_ranks = np.unique(keys_codes, return_index=True, return_inverse=True)
+        if len(unique_codes) < len(keys_codes):
+            if not allow_repeats_of_key:
+                raise ValueError("Error while reading to CompactSynDict: key is repeated")
+            keys_codes, offsets, values_codes = self._merge_repeated_keys(keys_codes, offsets, values_codes,
+                                                                          first_rows, row_ranks)
+        self._set_arrays(keys_codes, offsets, values_codes)
+
+    def read(self, filename, header=False, separator="\t", allow_repeats_of_key=False,
+             values_separator=",", key_index=0, value_index=1, close_after_if_file_object=False,
+             comments_prefix=None):
+        # reads synonyms from file, values are always splited
+        self.header, key_array, value_array, counts = self._tokenize(filename, header=header, separator=separator,
+                                                                     values_separator=values_separator,
+                                                                     key_index=key_index, value_index=value_index,
+                                                                     close_after_if_file_object=close_after_if_file_object,
+                                                                     comments_prefix=comments_prefix)
+        codes = self.id_index.add_tokens(np.concatenate([key_array, value_array]))
+        self._add_codes(codes[:len(key_array)], counts, codes[len(key_array):],
+                        allow_repeats_of_key=allow_repeats_of_key)
+        return self
+
+    @classmethod
+    def read_files(cls, file_dict, id_index=None, header=False, separator="\t", allow_repeats_of_key=False,
+                   values_separator=",", key_index=0, value_index=1, comments_prefix=None):
+        # reads several files(dict label: filename) to dictionaries sharing one IdIndex,
+        # ids from all files are tokenized first, so shared index is built at once and stays compact
+        id_index = id_index if id_index is not None else IdIndex()
+        token_dict = OrderedDict()
+        for label in file_dict:
+            token_dict[label] = cls._tokenize(file_dict[label], header=header, separator=separator,
+                                              values_separator=values_separator, key_index=key_index,
+                                              value_index=value_index, comments_prefix=comments_prefix)
+
+        all_codes = id_index.add_tokens(np.concatenate([array_ for label in token_dict
+                                                        for array_ in token_dict[label][1:3]]))
+        synonym_dict_dict = OrderedDict()
+        start = 0
+        for label in token_dict:
+            header_line, key_array, value_array, counts = token_dict[label]
+            synonym_dict_dict[label] = cls(id_index=id_index)
+            synonym_dict_dict[label].header = header_line
+            keys_end = start + len(key_array)
+            values_end = keys_end + len(value_array)
+            synonym_dict_dict[label]._add_codes(all_codes[start:keys_end], counts, all_codes[keys_end:values_end],
+                                                allow_repeats_of_key=allow_repeats_of_key)
+            start = values_end
+        return synonym_dict_dict
+
+    @staticmethod
+    def _merge_repeated_keys(keys_codes, offsets, values_codes, first_rows, row_ranks):
+        # values of repeated keys are concatenated, keys are kept in order of first appearance
+        order_of_unique = np.argsort(first_rows, kind="mergesort")
+        new_rank_of_unique = np.empty_like(order_of_unique)
+        new_rank_of_unique[order_of_unique] = np.arange(len(order_of_unique))
+        row_new_ranks = new_rank_of_unique[row_ranks]
+
+        value_new_ranks = np.repeat(row_new_ranks, np.diff(offsets))
+        value_order = np.argsort(value_new_ranks, kind="mergesort")
+        new_offsets = np.zeros(len(order_of_unique) + 1, dtype=np.int64)
+        new_offsets[1:] = np.cumsum(np.bincount(value_new_ranks, minlength=len(order_of_unique)))
+
+        return keys_codes[first_rows[order_of_unique]], new_offsets, values_codes[value_order]
+
+    def write(self, filename, header=False, separator="\t", splited_values=True, values_separator=",",
+              close_after_if_file_object=False):
+        out_fd = filename if isinstance(filename, file) else open(filename, "w")
+        if header:
+            if header is True and self.header:
+                out_fd.write(self.header + "\n")
+
+        for key, value in self.iteritems():
+            out_fd.write("%s%s%s\n" % (key, separator, values_separator.join(value)))
+        if (not isinstance(filename, file)) or close_after_if_file_object:
+            out_fd.close()
+
+    def save(self, prefix, save_index=True):
+        # saves arrays to <prefix>.keys.npy, <prefix>.offsets.npy, <prefix>.values.npy and index(see IdIndex.save)
+        # if IdIndex is shared by several dictionaries it could be saved once and save_index set to False for rest
+        np.save("%s.keys.npy" % prefix, self.keys_codes)
+        np.save("%s.offsets.npy" % prefix, self.offsets)
+        np.save("%s.values.npy" % prefix, self.values_codes)
+        if save_index:
+            self.id_index.save(prefix)
+
+    @classmethod
+    def load(cls, prefix, id_index=None, mmap_mode="r"):
+        # loads dictionary saved by save, arrays are memory-mapped if mmap_mode is set
+        # id_index must be the index used for saving(it is loaded from files with prefix if not set)
+        synonym_dict = cls(id_index=id_index if id_index is not None else IdIndex(prefix=prefix, mmap_mode=mmap_mode))
+        synonym_dict._set_arrays(np.load("%s.keys.npy" % prefix, mmap_mode=mmap_mode),
+                                 np.load("%s.offsets.npy" % prefix, mmap_mode=mmap_mode),
+                                 np.load("%s.values.npy" % prefix, mmap_mode=mmap_mode))
+        return synonym_dict
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CoverageRLE(OrderedDict):
+    # run-length encoded per-base coverage, keys are scaffold ids, values are tuples (ends, values) of numpy arrays:
+    # i-th run covers zero-based positions [ends[i-1], ends[i]) (first run starts from 0), ends[-1] is scaffold length.
+    # bedGraph produced by bedtools genomecov -bg/-bga is already run-length encoded, so it is read directly
+    # without expansion to per-base coverage.
+
+    stats_header = "#Scaffold\tLength\tMean_coverage\tMedian_coverage\tMin_coverage\tMax_coverage\tCoveraged_positions\tZero_coverage_position_number\tZero_coveraged_region_number\tLeading_zero_covarage_len\tTrailing_zero_covarage_len\tZero_coverage_region_coordinates\tMean_coverage(without_zerocoveraged_ends)\tMedian_coverage(without_zerocoveraged_ends)\tLength_without_zero_coverage_ends\n"
+
+    def __init__(self, bedgraph=None, genome_file=None, value_type=int):
+        OrderedDict.__init__(self)
+        if bedgraph:
+            self.read_bedgraph(bedgraph, genome_file=genome_file, value_type=value_type)
+
+    @staticmethod
+    def read_genome_file(genome_file):
+        # reads file with scaffold lengths(as used by bedtools -g)
+        length_dict = OrderedDict()
+        with open(genome_file, "r") as in_fd:
+            for line in in_fd:
+                if line == "\n" or line[0] == "#":
+                    continue
+                tmp = line.strip().split("\t")
+                length_dict[tmp[0]] = int(tmp[1])
+        return length_dict
+
+    @staticmethod
+    def _fill_gaps(starts, ends, values, length):
+        # adds zero-coverage runs for positions absent in bedGraph(bedtools genomecov -bg omits them)
+        if len(starts) == 0:
+            return np.array([length], dtype=np.int64), np.zeros(1, dtype=values.dtype)
+        gaps = np.empty(len(starts), dtype=bool)
+        gaps[0] = starts[0] > 0
+        gaps[1:] = starts[1:] > ends[:-1]
+        tail = length > ends[-1]
+        if (not gaps.any()) and (not tail):
+            return ends, values
+
+        positions = np.arange(len(starts)) + np.cumsum(gaps)
+        new_ends = np.empty(len(starts) + int(gaps.sum()) + int(tail), dtype=np.int64)
+        new_values = np.zeros(len(new_ends), dtype=values.dtype)
+        new_ends[positions] = ends
+        new_values[positions] = values
+        new_ends[positions[gaps] - 1] = starts[gaps]
+        if tail:
+            new_ends[-1] = length
+        return new_ends, new_values
+
+    def read_bedgraph(self, bedgraph, genome_file=None, value_type=int):
+        # bedgraph - file name or file object(i.e. stdout of bedtools)
+        # if genome_file is set scaffolds are ordered as in it and scaffolds absent in bedGraph get zero coverage,
+        # otherwise length of scaffold is end of its last interval
+        length_dict = self.read_genome_file(genome_file) if genome_file else None
+        value_code = "l" if value_type is int else "d"
+
+        interval_dict = OrderedDict()
+        in_fd = bedgraph if isinstance(bedgraph, file) else open(bedgraph, "r")
+        current_scaffold = None
+        for line in in_fd:
+            if (line[0] == "#") or (line[:5] == "track") or (line == "\n"):
+                continue
+            scaffold, start, end, value = line.split("\t")
+            if scaffold != current_scaffold:
+                if scaffold not in interval_dict:
+                    interval_dict[scaffold] = (array("l"), array("l"), array(value_code))
+                starts, ends, values = interval_dict[scaffold]
+                current_scaffold = scaffold
+            starts.append(int(start))
+            ends.append(int(end))
+            values.append(value_type(value))
+        if not isinstance(bedgraph, file):
+            in_fd.close()
+
+        for scaffold in (length_dict if length_dict else interval_dict):
+            if scaffold in interval_dict:
+                starts, ends, values = [np.frombuffer(column, dtype=np.int64 if column.typecode == "l" else np.float64)
+                                        if column else np.zeros(0, dtype=np.int64)
+                                        for column in interval_dict[scaffold]]
+            else:
+                starts, ends, values = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), \
+                                       np.zeros(0, dtype=np.int64 if value_type is int else np.float64)
+            length = length_dict[scaffold] if length_dict else ends[-1]
+            self[scaffold] = self._fill_gaps(starts, ends, values, length)
+        return self
+
+    def add_per_base_coverage(self, scaffold, coverage_array):
+        # converts per-base coverage to runs
+        coverage_array = np.asarray(coverage_array)
+        if len(coverage_array) == 0:
+            self[scaffold] = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=coverage_array.dtype))
+            return
+        ends = np.append(np.flatnonzero(coverage_array[1:] != coverage_array[:-1]) + 1, len(coverage_array))
+        self[scaffold] = (ends.astype(np.int64), coverage_array[ends - 1])
+
+    def get_length(self, scaffold):
+        ends = self[scaffold][0]
+        return int(ends[-1]) if len(ends) > 0 else 0
+
+    def get_per_base_coverage(self, scaffold):
+        ends, values = self[scaffold]
+        return np.repeat(values, np.diff(np.concatenate(([0], ends))))
+
+    @staticmethod
+    def weighted_median(values, weights):
+        # median of array where values[i] is repeated weights[i] times(as numpy.median for even length)
+        order = np.argsort(values, kind="mergesort")
+        cumulative_weights = np.cumsum(weights[order])
+        total = cumulative_weights[-1] if len(cumulative_weights) > 0 else 0
+        if total == 0:
+            return float("nan")
+        lower = values[order][np.searchsorted(cumulative_weights, (total - 1) // 2, side="right")]
+        upper = values[order][np.searchsorted(cumulative_weights, total // 2, side="right")]
+        return (lower + upper) / 2.0
+
+    def get_stats(self, scaffold):
+        # returns list of values for columns of self.stats_header
+        ends, values = self[scaffold]
+        length = self.get_length(scaffold)
+        starts = np.concatenate(([0], ends[:-1]))
+        run_lengths = ends - starts
+        nonempty = run_lengths > 0
+        ends, values, starts, run_lengths = ends[nonempty], values[nonempty], starts[nonempty], run_lengths[nonempty]
+
+        if length == 0:
+            nan = float("nan")
+            return [scaffold, 0, nan, nan, nan, nan, 0, 0, 0, 0, 0, ".", nan, nan, 0]
+
+        mean_coverage = float(np.sum(values * run_lengths)) / length
+        median_coverage = float(self.weighted_median(values, run_lengths))
+        min_coverage = float(np.min(values))
+        max_coverage = float(np.max(values))
+
+        zero_runs = values == 0
+        coveraged_position_number = int(np.sum(run_lengths[~zero_runs]))
+        zero_coverage_position_number = int(np.sum(run_lengths[zero_runs]))
+
+        if zero_coverage_position_number > 0:
+            # adjacent zero runs are merged to regions
+            zero_starts = starts[zero_runs]
+            zero_ends = ends[zero_runs]
+            region_first_runs = np.flatnonzero(np.concatenate(([True], zero_starts[1:] != zero_ends[:-1])))
+            region_starts = zero_starts[region_first_runs]
+            region_ends = zero_ends[np.append(region_first_runs[1:], len(zero_starts)) - 1]
+
+            if region_starts[0] == 0:
+                leading_zero_coverage_len = int(region_ends[0])
+                start_coverage_coordinate = int(region_ends[0])
+            else:
+                leading_zero_coverage_len = 0
+                start_coverage_coordinate = 0
+
+            if region_ends[-1] == length:
+                trailing_zero_coverage_len = int(region_ends[-1] - region_starts[-1])
+                end_coverage_coordinate = int(region_starts[-1])
+            else:
+                trailing_zero_coverage_len = 0
+                end_coverage_coordinate = length
+
+            zero_coveraged_region_number = len(region_starts)
+            zero_coverage_coordinates_list = ["%i-%i" % (start + 1, end) for start, end in zip(region_starts,
+                                                                                            region_ends)]
+        else:
+            leading_zero_coverage_len = 0
+            trailing_zero_coverage_len = 0
+            zero_coveraged_region_number = 0
+            start_coverage_coordinate = 0
+            end_coverage_coordinate = length
+            zero_coverage_coordinates_list = ["."]
+
+        length_without_zerocoveraged_ends = end_coverage_coordinate - start_coverage_coordinate
+        if length_without_zerocoveraged_ends > 0:
+            trimmed_lengths = np.clip(ends, start_coverage_coordinate, end_coverage_coordinate) - \
+                              np.clip(starts, start_coverage_coordinate, end_coverage_coordinate)
+            mean_coverage_without_zero_coverage_ends = float(np.sum(values * trimmed_lengths)) / \
+                                                       length_without_zerocoveraged_ends
+            median_coverage_without_zero_coverage_ends = float(self.weighted_median(values, trimmed_lengths))
+        else:
+            mean_coverage_without_zero_coverage_ends = float("nan")
+            median_coverage_without_zero_coverage_ends = float("nan")
+
+        return [scaffold, length, mean_coverage, median_coverage, min_coverage, max_coverage,
+                coveraged_position_number, zero_coverage_position_number, zero_coveraged_region_number,
+                leading_zero_coverage_len, trailing_zero_coverage_len, ",".join(zero_coverage_coordinates_list),
+                mean_coverage_without_zero_coverage_ends, median_coverage_without_zero_coverage_ends,
+                length_without_zerocoveraged_ends]
+
+    @staticmethod
+    def format_stats(stats):
+        # min and max coverage of empty scaffold are nan and can't be formatted as integers, they are written as nan
+        min_max = ["nan" if np.isnan(value) else "%i" % value for value in stats[4:6]]
+        return "%s\t%i\t%.2f\t%.2f\t%s\t%s\t%i\t%i\t%i\t%i\t%i\t%s\t%.2f\t%.2f\t%i\n" % tuple(list(stats[:4]) +
+                                                                                          min_max +
+                                                                                          list(stats[6:]))
+
+    def write_stats(self, output_file):
+        with open(output_file, "w") as out_fd:
+            out_fd.write(self.stats_header)
+            for scaffold in self:
+                out_fd.write(self.format_stats(self.get_stats(scaffold)))
+
+    def save(self, prefix):
+        # runs of all scaffolds are saved to <prefix>.ends.npy and <prefix>.values.npy,
+        # scaffold ids and numbers of runs to <prefix>.scaffolds
+        np.save("%s.ends.npy" % prefix, np.concatenate([self[scaffold][0] for scaffold in self])
+                if self else np.zeros(0, dtype=np.int64))
+        np.save("%s.values.npy" % prefix, np.concatenate([self[scaffold][1] for scaffold in self])
+                if self else np.zeros(0, dtype=np.int64))
+        with open("%s.scaffolds" % prefix, "w") as out_fd:
+            for scaffold in self:
+                out_fd.write("%s\t%i\n" % (scaffold, len(self[scaffold][0])))
+
+    @classmethod
+    def load(cls, prefix, mmap_mode="r"):
+        # loads coverage saved by save, arrays are memory-mapped if mmap_mode is set
+        coverage = cls()
+        ends = np.load("%s.ends.npy" % prefix, mmap_mode=mmap_mode)
+        values = np.load("%s.values.npy" % prefix, mmap_mode=mmap_mode)
+        start = 0
+        with open("%s.scaffolds" % prefix, "r") as in_fd:
+            for line in in_fd:
+                scaffold, number_of_runs = line.strip().split("\t")
+                end = start + int(number_of_runs)
+                coverage[scaffold] = (ends[start:end], values[start:end])
+                start = end
+        return coverage
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+import os
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+from scipy.signal import argrelextrema
+
+
+class InsertSizeHistogram(object):
+    # fixed-width integer histograms of insert sizes(TLEN) of concordant(proper pair flag is set), discordant and
+    # all pairs, filled from sam stream in one pass without storing of insert sizes.
+    # i-th bin counts insert sizes in [i * width_of_bin, (i + 1) * width_of_bin), last bin counts insert sizes
+    # exceeding max_insert_size.
+    # if selected_scaffolds is set, additional category "selected" counts pairs aligned to these scaffolds
+
+    # supplementary, not primary, unmapped and mate unmapped
+    default_filter_flags = 2048 + 256 + 4 + 8
+    proper_pair_flag = 2
+
+    def __init__(self, width_of_bin=1, max_insert_size=100000, selected_scaffolds=None):
+        self.width_of_bin = int(width_of_bin)
+        self.max_insert_size = int(max_insert_size)
+        self.number_of_bins = self.max_insert_size // self.width_of_bin + 1
+        self.selected_scaffolds = set(selected_scaffolds) if selected_scaffolds is not None else None
+        self.categories = ["concordant", "discordant", "all"] + (["selected"] if selected_scaffolds is not None
+                                                                 else [])
+        self.counts = OrderedDict([(category, np.zeros(self.number_of_bins + 1, dtype=np.int64))
+                                   for category in self.categories])
+
+    def get_bin_indexes(self, insert_sizes):
+        return np.minimum(np.asarray(insert_sizes, dtype=np.int64) // self.width_of_bin, self.number_of_bins)
+
+    def add_array(self, insert_sizes, concordant_mask, selected_mask=None):
+        bin_indexes = self.get_bin_indexes(insert_sizes)
+        concordant_mask = np.asarray(concordant_mask, dtype=bool)
+        minlength = self.number_of_bins + 1
+        self.counts["all"] += np.bincount(bin_indexes, minlength=minlength)
+        self.counts["concordant"] += np.bincount(bin_indexes[concordant_mask], minlength=minlength)
+        self.counts["discordant"] += np.bincount(bin_indexes[~concordant_mask], minlength=minlength)
+        if (selected_mask is not None) and ("selected" in self.counts):
+            self.counts["selected"] += np.bincount(bin_indexes[np.asarray(selected_mask, dtype=bool)],
+                                                   minlength=minlength)
+
+    def read_sam_stream(self, sam_fd, max_pairs=None, filter_flags=None, chunk_size=100000):
+        # sam_fd - file object with sam records(i.e. stdout of samtools view or aligner), header lines are skipped
+        # each pair is counted once, by alignment with positive TLEN
+        # reading stops after max_pairs pairs were counted, returns number of counted pairs
+        filter_flags = self.default_filter_flags if filter_flags is None else filter_flags
+        pair_number = 0
+        insert_sizes = array("l")
+        concordant_list = array("b")
+        selected_list = array("b") if self.selected_scaffolds is not None else None
+        max_chunk_size = chunk_size if max_pairs is None else min(chunk_size, max_pairs)
+
+        for line in sam_fd:
+            if line[0] == "@":
+                continue
+            tmp = line.split("\t", 9)
+            insert_size = int(tmp[8])
+            if insert_size <= 0:
+                continue
+            flag = int(tmp[1])
+            if flag & filter_flags:
+                continue
+            insert_sizes.append(insert_size)
+            concordant_list.append(flag & self.proper_pair_flag)
+            if selected_list is not None:
+                selected_list.append(tmp[2] in self.selected_scaffolds)
+
+            if len(insert_sizes) == max_chunk_size:
+                self._add_chunk(insert_sizes, concordant_list, selected_list)
+                pair_number += len(insert_sizes)
+                if (max_pairs is not None) and (pair_number >= max_pairs):
+                    return pair_number
+                max_chunk_size = chunk_size if max_pairs is None else min(chunk_size, max_pairs - pair_number)
+                insert_sizes = array("l")
+                concordant_list = array("b")
+                selected_list = array("b") if selected_list is not None else None
+
+        self._add_chunk(insert_sizes, concordant_list, selected_list)
+        return pair_number + len(insert_sizes)
+
+    def _add_chunk(self, insert_sizes, concordant_list, selected_list):
+        if not insert_sizes:
+            return
+        self.add_array(np.frombuffer(insert_sizes, dtype=np.int64),
+                       np.frombuffer(concordant_list, dtype=np.int8).astype(bool),
+                       np.frombuffer(selected_list, dtype=np.int8).astype(bool) if selected_list is not None else None)
+
+    def get_bin_starts(self):
+        return np.arange(0, self.number_of_bins, dtype=np.int64) * self.width_of_bin
+
+    def get_counts(self, category, include_overflow=False):
+        return self.counts[category] if include_overflow else self.counts[category][:-1]
+
+    def get_total(self, category):
+        return int(np.sum(self.counts[category]))
+
+    def get_stats(self, category):
+        # returns (number of pairs, mean, median, standard deviation) of insert sizes in bin_starts,
+        # pairs from overflow bin are counted in number of pairs only
+        counts = self.get_counts(category)
+        number_of_pairs = self.get_total(category)
+        binned_pairs = int(np.sum(counts))
+        if binned_pairs == 0:
+            return number_of_pairs, float("nan"), float("nan"), float("nan")
+        bin_starts = self.get_bin_starts()
+        mean = float(np.sum(bin_starts * counts)) / binned_pairs
+        median = float(bin_starts[np.searchsorted(np.cumsum(counts), (binned_pairs + 1) // 2)])
+        std = np.sqrt(float(np.sum(counts * (bin_starts - mean) ** 2)) / binned_pairs)
+        return number_of_pairs, mean, median, std
+
+    def write(self, output_file):
+        # only nonempty bins are written, overflow bin is written as ">max_insert_size"
+        with open(output_file, "w") as out_fd:
+            out_fd.write("#width_of_bin\t%i\n" % self.width_of_bin)
+            out_fd.write("#max_insert_size\t%i\n" % self.max_insert_size)
+            out_fd.write("#bin_start\t%s\n" % "\t".join(self.categories))
+            counts = np.vstack([self.counts[category] for category in self.categories])
+            bin_starts = self.get_bin_starts()
+            for index in np.flatnonzero(counts[:, :-1].any(axis=0)):
+                out_fd.write("%i\t%s\n" % (bin_starts[index], "\t".join(map(str, counts[:, index]))))
+            if counts[:, -1].any():
+                out_fd.write(">%i\t%s\n" % (self.max_insert_size, "\t".join(map(str, counts[:, -1]))))
+
+    @classmethod
+    def read(cls, input_file):
+        with open(input_file, "r") as in_fd:
+            width_of_bin = int(in_fd.readline().strip().split("\t")[1])
+            max_insert_size = int(in_fd.readline().strip().split("\t")[1])
+            categories = in_fd.readline().strip().split("\t")[1:]
+            histogram = cls(width_of_bin=width_of_bin, max_insert_size=max_insert_size,
+                            selected_scaffolds=[] if "selected" in categories else None)
+            for line in in_fd:
+                tmp = line.strip().split("\t")
+                index = histogram.number_of_bins if tmp[0][0] == ">" else int(tmp[0]) // width_of_bin
+                for category, count in zip(categories, tmp[1:]):
+                    histogram.counts[category][index] = int(count)
+        return histogram
+
+
+class KmerHistogramCollection(object):
+    # k-mer histograms(jellyfish histo output, multiplicity and number of distinct k-mers) of many samples
+    # stored as one 2-D array(rows - samples, columns - multiplicities 1, 2, ...), all statistics
+    # are computed for all samples at once.
+    # multiplicities absent in histo file are counted as zero, so for histograms written by jellyfish histo
+    # with zero bins omitted statistics can differ from Jellyfish.extract_parameters_from_histo
+
+    stat_names = ["Number of distinct kmers",
+                  "Number of distinct kmers with errors",
+                  "Fraction of distinct kmers with errors",
+                  "Total number of kmers",
+                  "Total number of kmers with errors",
+                  "Fraction of kmers with errors",
+                  "Kmer multiplicity at first minimum",
+                  "Kmer multiplicity at first maximum",
+                  "Width of first peak",
+                  "Mean kmer multiplicity in first peak",
+                  "Standard deviation of kmer multiplicity in first peak",
+                  "Variance coefficient of kmer multiplicity in first peak",
+                  "Estimated genome size, bp",
+                  "Number of peaks in checked area"]
+
+    def __init__(self, sample_ids=None, counts=None, lengths=None):
+        self.sample_ids = list(sample_ids) if sample_ids is not None else []
+        self.counts = counts if counts is not None else np.zeros((0, 0), dtype=np.float64)
+        # number of bins in histogram of each sample, padded bins are ignored
+        self.lengths = lengths if lengths is not None else np.array([self.counts.shape[1]] * len(self.sample_ids),
+                                                                    dtype=np.int64)
+        self.bins = np.arange(1, self.counts.shape[1] + 1, dtype=np.float64)
+        self.stats = None
+
+    @staticmethod
+    def get_sample_id(histo_file):
+        # name of file without directory and extension, i.e. reads/sample_1.23.histo -> sample_1.23
+        return os.path.splitext(os.path.basename(histo_file))[0]
+
+    @classmethod
+    def get_histo_file_dict(cls, histo_files):
+        # returns OrderedDict sample id: histo file for list of histo files, dicts are returned as is
+        if isinstance(histo_files, dict):
+            return histo_files
+        histo_file_dict = OrderedDict()
+        for histo_file in histo_files:
+            sample_id = cls.get_sample_id(histo_file)
+            if sample_id in histo_file_dict:
+                raise ValueError("Sample id %s is the same for %s and %s, set sample ids explicitly"
+                                 % (sample_id, histo_file_dict[sample_id], histo_file))
+            histo_file_dict[sample_id] = histo_file
+        return histo_file_dict
+
+    @classmethod
+    def read(cls, histo_files):
+        # histo_files - dict sample id: histo file(OrderedDict to keep order of samples) or list of histo files,
+        # in last case sample ids are names of files without directory and extension
+        histo_files = cls.get_histo_file_dict(histo_files)
+        sample_ids = list(histo_files)
+        data_list = []
+        for sample_id in sample_ids:
+            with open(histo_files[sample_id], "r") as in_fd:
+                data_list.append(np.fromstring(in_fd.read(), sep=" ").reshape(-1, 2))
+
+        lengths = np.array([int(data[:, 0].max()) if len(data) > 0 else 0 for data in data_list], dtype=np.int64)
+        counts = np.zeros((len(sample_ids), lengths.max()), dtype=np.float64)
+        for index, data in enumerate(data_list):
+            counts[index, data[:, 0].astype(np.int64) - 1] = data[:, 1]
+
+        return cls(sample_ids=sample_ids, counts=counts, lengths=lengths)
+
+    def find_local_extrema(self, comparator, order=3, mode="wrap"):
+        # returns arrays of rows and columns of local extrema, found for each sample within its own length
+        if (self.lengths == self.counts.shape[1]).all():
+            return argrelextrema(self.counts, comparator, axis=1, order=order, mode=mode)
+        row_list = []
+        column_list = []
+        for row in range(0, len(self.sample_ids)):
+            columns = argrelextrema(self.counts[row, :self.lengths[row]], comparator, order=order, mode=mode)[0]
+            row_list.append(np.full(len(columns), row, dtype=np.int64))
+            column_list.append(columns)
+        return np.concatenate(row_list), np.concatenate(column_list)
+
+    def get_first_columns(self, rows, columns, mask=None):
+        # returns column of first extremum for each sample(-1 if sample has no extrema)
+        first_columns = np.full(len(self.sample_ids), -1, dtype=np.int64)
+        if mask is not None:
+            rows, columns = rows[mask], columns[mask]
+        unique_rows, first_indexes = np.unique(rows, return_index=True)
+        first_columns[unique_rows] = columns[first_indexes]
+        return first_columns
+
+    def calculate_stats(self, order=3, mode="wrap", check_peaks_coef=10):
+        """
+        Calculates statistics(see stat_names) for all samples in the same way as Jellyfish.draw_kmer_distribution.
+        k-mers with multiplicity below first local minimum are considered to contain errors, first peak is
+        first local maximum(except maximum at multiplicity 1), peaks are counted in range
+        [first peak, check_peaks_coef * first peak]. Statistics of samples without minimum or peak are nan.
+        """
+        number_of_samples = len(self.sample_ids)
+        columns = np.arange(0, self.counts.shape[1])
+        within_length = columns[np.newaxis, :] < self.lengths[:, np.newaxis]
+        weighted_counts = self.counts * self.bins
+
+        maximum_rows, maximum_columns = self.find_local_extrema(np.greater, order=order, mode=mode)
+        minimum_rows, minimum_columns = self.find_local_extrema(np.less, order=order, mode=mode)
+
+        first_minimum = self.get_first_columns(minimum_rows, minimum_columns)
+        first_peak = self.get_first_columns(maximum_rows, maximum_columns, mask=maximum_columns != 0)
+        valid = (first_minimum >= 0) & (first_peak >= 0)
+        first_minimum[~valid] = 0
+        first_peak[~valid] = 0
+
+        first_peak_coverage = self.bins[first_peak]
+        max_checked_coverage = check_peaks_coef * first_peak_coverage
+        peaks_in_checked_area = np.bincount(maximum_rows[(maximum_columns >= first_peak[maximum_rows]) &
+                                                         (self.bins[maximum_columns] <=
+                                                          max_checked_coverage[maximum_rows])],
+                                            minlength=number_of_samples)
+        first_checked_minimum = self.get_first_columns(minimum_rows, minimum_columns,
+                                                       mask=self.bins[minimum_columns] <=
+                                                       max_checked_coverage[minimum_rows])
+        valid &= first_checked_minimum >= 0
+        first_checked_minimum[~valid] = 0
+
+        error_mask = columns[np.newaxis, :] < first_minimum[:, np.newaxis]
+        number_of_distinct_kmers = self.counts.sum(axis=1)
+        number_of_distinct_kmers_with_errors = (self.counts * error_mask).sum(axis=1)
+        total_number_of_kmers = weighted_counts.sum(axis=1)
+        total_number_of_kmers_with_errors = (weighted_counts * error_mask).sum(axis=1)
+
+        # as in Jellyfish.extract_parameters_from_histo multiplicity of first minimum is used as index
+        genome_mask = columns[np.newaxis, :] >= self.bins[first_checked_minimum][:, np.newaxis].astype(np.int64)
+        estimated_genome_size = (weighted_counts * genome_mask).sum(axis=1) / first_peak_coverage
+
+        # right border of first peak - position after peak with count nearest to count at first minimum
+        row_indexes = np.arange(0, number_of_samples)
+        distances = np.abs(self.counts - self.counts[row_indexes, first_minimum][:, np.newaxis])
+        distances = np.where((columns[np.newaxis, :] >= first_peak[:, np.newaxis]) & within_length, distances, np.inf)
+        right_border = distances.argmin(axis=1)
+
+        peak_mask = (columns[np.newaxis, :] >= first_minimum[:, np.newaxis]) & \
+                    (columns[np.newaxis, :] <= right_border[:, np.newaxis])
+        peak_counts = self.counts * peak_mask
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peak_sizes = peak_counts.sum(axis=1)
+            peak_mean = (peak_counts * self.bins).sum(axis=1) / peak_sizes
+            peak_std = np.sqrt((peak_counts * (self.bins[np.newaxis, :] -
+                                               peak_mean[:, np.newaxis]) ** 2).sum(axis=1) / peak_sizes)
+            fraction_of_distinct_kmers_with_errors = number_of_distinct_kmers_with_errors / number_of_distinct_kmers
+            fraction_of_kmers_with_errors = total_number_of_kmers_with_errors / total_number_of_kmers
+            variance_coefficient = peak_std / peak_mean
+
+        self.stats = OrderedDict()
+        stat_values = [number_of_distinct_kmers,
+                       number_of_distinct_kmers_with_errors,
+                       fraction_of_distinct_kmers_with_errors,
+                       total_number_of_kmers,
+                       total_number_of_kmers_with_errors,
+                       fraction_of_kmers_with_errors,
+                       self.bins[first_checked_minimum],
+                       first_peak_coverage,
+                       (right_border - first_minimum + 1).astype(np.float64),
+                       peak_mean,
+                       peak_std,
+                       variance_coefficient,
+                       estimated_genome_size,
+                       peaks_in_checked_area.astype(np.float64)]
+        for stat_name, values in zip(self.stat_names, stat_values):
+            if stat_name not in ("Number of distinct kmers", "Total number of kmers"):
+                values = np.where(valid, values, np.nan)
+            self.stats[stat_name] = values
+        return self.stats
+
+    def write_stats(self, output_file):
+        # table with samples in rows
+        with open(output_file, "w") as out_fd:
+            out_fd.write("#sample\t%s\n" % "\t".join(self.stat_names))
+            for index, sample_id in enumerate(self.sample_ids):
+                out_fd.write("%s\t%s\n" % (sample_id, "\t".join(["%.3f" % self.stats[stat_name][index]
+                                                                 for stat_name in self.stat_names])))
+
+    def get_sample_report(self, sample_id):
+        # report in the same format as .histo.stats produced by Jellyfish.draw_kmer_distribution(readable by
+        # Parsers.KrATER.KrATERReport)
+        index = self.sample_ids.index(sample_id)
+        stats = dict([(stat_name, self.stats[stat_name][index]) for stat_name in self.stat_names])
+        report = ""
+        for stat_name, value_format in (("Number of distinct kmers", "%i"),
+                                        ("Number of distinct kmers with errors", "%i"),
+                                        ("Fraction of distinct kmers with errors", "%.3f"),
+                                        ("Total number of kmers", "%i"),
+                                        ("Total number of kmers with errors", "%i"),
+                                        ("Fraction of kmers with errors", "%.3f"),
+                                        ("Kmer multiplicity at first minimum", "%s"),
+                                        ("Kmer multiplicity at first maximum", "%s"),
+                                        ("Width of first peak", "%i"),
+                                        ("Mean kmer multiplicity in first peak", "%.2f"),
+                                        ("Standard deviation of kmer multiplicity in first peak", "%.2f"),
+                                        ("Variance coefficient of kmer multiplicity in first peak", "%.2f"),
+                                        ("Estimated genome size, bp", "%i")):
+            value = stats[stat_name]
+            if np.isnan(value):
+                report += "%s\t%s\n" % (stat_name, "None" if value_format == "%s" else "nan")
+            elif value_format == "%s":
+                report += "%s\t%s\n" % (stat_name, str(value))
+            elif value_format == "%i":
+                report += "%s\t%i\n" % (stat_name, value)
+            else:
+                report += ("%s\t" + value_format + "\n") % (stat_name, np.around(value, decimals=int(value_format[2])))
+        return report
+
+    def write_sample_reports(self, output_prefix):
+        # writes <output_prefix>.<sample_id>.histo.stats for each sample
+        for sample_id in self.sample_ids:
+            with open("%s.%s.histo.stats" % (output_prefix, sample_id), "w") as out_fd:
+                out_fd.write(self.get_sample_report(sample_id))
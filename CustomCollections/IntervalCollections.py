@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+import os
+import pickle
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
+
+class IntervalIndex(object):
+    # static index of intervals from one chromosome(region)
+    # intervals are zero-based and half-open as in FeatureLocation: [start, end)
+    # coordinate axis is split by all starts and ends into elementary segments and for each segment
+    # ids of intervals covering it are stored, so point query is a single binary search.
+    # Memory is proportional to the sum of interval depth over segments, which is small for annotations
+    # (gene -> transcript -> exon nesting), but could be large for many long mutually overlapping intervals.
+
+    def __init__(self, interval_list=None):
+        # interval_list: iterable of (start, end, interval_id)
+        self.breakpoints = []
+        self.segments = []
+        if interval_list:
+            self.build(interval_list)
+
+    def build(self, interval_list):
+        starts = {}
+        ends = {}
+        for start, end, interval_id in interval_list:
+            if end <= start:
+                continue
+            starts.setdefault(start, []).append(interval_id)
+            ends.setdefault(end, []).append(interval_id)
+
+        self.breakpoints = sorted(set(starts.keys()) | set(ends.keys()))
+        self.segments = []
+        active = set()
+        for breakpoint in self.breakpoints:
+            if breakpoint in ends:
+                active.difference_update(ends[breakpoint])
+            if breakpoint in starts:
+                active.update(starts[breakpoint])
+            self.segments.append(tuple(sorted(active)))
+
+    def __len__(self):
+        return len(self.breakpoints)
+
+    def point_query(self, position):
+        # returns tuple of ids of intervals containing position
+        segment_index = bisect_right(self.breakpoints, position) - 1
+        if segment_index < 0:
+            return ()
+        return self.segments[segment_index]
+
+    def point_queries(self, positions):
+        # vectorized variant of point_query for array of positions, returns list of tuples
+        if not self.breakpoints:
+            return [() for position in positions]
+        segment_indexes = np.searchsorted(np.array(self.breakpoints), positions, side="right") - 1
+        return [self.segments[index] if index >= 0 else () for index in segment_indexes]
+
+    def range_query(self, start, end):
+        # returns sorted list of ids of intervals overlapping [start, end)
+        first_segment = max(bisect_right(self.breakpoints, start) - 1, 0)
+        last_segment = bisect_left(self.breakpoints, end)
+        interval_ids = set()
+        for segment in self.segments[first_segment:last_segment]:
+            interval_ids.update(segment)
+        return sorted(interval_ids)
+
+    def contains(self, position):
+        return len(self.point_query(position)) > 0
+
+    def overlaps(self, start, end):
+        return len(self.range_query(start, end)) > 0
+
+
+class FeatureIndex(OrderedDict):
+    # dictionary-like index with chromosomes as keys and IntervalIndex as values
+    # ids of intervals are indexes in self.features[chrom], for each feature its parent index
+    # (-1 for top level features) is stored in self.parents[chrom]
+    # only top level features and their sub_features are indexed(as in location functions of Record classes)
+
+    def __init__(self, record_dict=None):
+        OrderedDict.__init__(self)
+        self.features = OrderedDict()
+        self.parents = OrderedDict()
+        if record_dict:
+            for chrom in record_dict:
+                self.add_seq_record(chrom, record_dict[chrom])
+
+    @staticmethod
+    def _get_parts(feature):
+        # CompoundLocation is split to parts
+        return feature.location.parts if hasattr(feature.location, "parts") else [feature.location]
+
+    def add_seq_record(self, chrom, seq_record):
+        features = []
+        parents = []
+        for feature in seq_record.features:
+            feature_index = len(features)
+            features.append(feature)
+            parents.append(-1)
+            for sub_feature in getattr(feature, "sub_features", []):
+                features.append(sub_feature)
+                parents.append(feature_index)
+
+        interval_list = []
+        for feature_index, feature in enumerate(features):
+            for part in self._get_parts(feature):
+                interval_list.append((int(part.start), int(part.end), feature_index))
+
+        self.features[chrom] = features
+        self.parents[chrom] = parents
+        self[chrom] = IntervalIndex(interval_list)
+
+    def get_features(self, chrom, position):
+        # returns ids of features containing zero-based position
+        if chrom not in self:
+            return ()
+        return self[chrom].point_query(position)
+
+    @classmethod
+    def from_regions(cls, region_collection):
+        # builds index from collection of records with chrom, start and end attributes(one-based, inclusive)
+        # such as CollectionGFF. Features are records themselves.
+        index = cls()
+        interval_dict = OrderedDict()
+        for region in region_collection:
+            if region.chrom not in index.features:
+                index.features[region.chrom] = []
+                index.parents[region.chrom] = []
+                interval_dict[region.chrom] = []
+            interval_dict[region.chrom].append((region.start - 1, region.end, len(index.features[region.chrom])))
+            index.features[region.chrom].append(region)
+            index.parents[region.chrom].append(-1)
+        for chrom in interval_dict:
+            index[chrom] = IntervalIndex(interval_dict[chrom])
+        return index
+
+    @staticmethod
+    def _get_file_key(annotation_file):
+        file_stat = os.stat(annotation_file)
+        return os.path.abspath(annotation_file), file_stat.st_size, file_stat.st_mtime
+
+    @classmethod
+    def from_file(cls, annotation_file, file_format="gff", cache_file=None, use_cache=True):
+        # builds index from GFF or GenBank file, index is cached on disk in cache_file
+        # (by default <annotation_file>.feature_index) and reused while annotation file is unchanged
+        cache = cache_file if cache_file else annotation_file + ".feature_index"
+        file_key = cls._get_file_key(annotation_file)
+        if use_cache and os.path.exists(cache):
+            with open(cache, "rb") as cache_fd:
+                try:
+                    cached_key, index = pickle.load(cache_fd)
+                except Exception:
+                    cached_key, index = None, None
+            if cached_key == file_key:
+                return index
+
+        record_dict = OrderedDict()
+        with open(annotation_file, "r") as in_fd:
+            if file_format == "gff":
+                from BCBio import GFF
+                records = GFF.parse(in_fd)
+            else:
+                from Bio import SeqIO
+                records = SeqIO.parse(in_fd, file_format)
+            for record in records:
+                record_dict[record.id] = record
+
+        index = cls(record_dict)
+        if use_cache:
+            with open(cache, "wb") as cache_fd:
+                pickle.dump((file_key, index), cache_fd, protocol=pickle.HIGHEST_PROTOCOL)
+        return index
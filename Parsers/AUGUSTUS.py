@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+
+
+class AUGUSTUSTranscript(object):
+    def __init__(self, transcript_id):
+        self.id = transcript_id
+        self.start_presence = False
+        self.stop_presence = False
+        self.protein = None
+        # hint support, all values are strings as in AUGUSTUS output
+        self.supported_fraction = None
+        self.cds_support = None
+        self.intron_support = None
+        self.five_utr_support = None
+        self.three_utr_support = None
+        self.incompatible_hint_groups = None
+
+    def has_evidence(self):
+        # evidence block is ended by number of incompatible hint groups
+        return self.incompatible_hint_groups is not None
+
+    def get_protein_length(self):
+        return len(self.protein) if self.protein is not None else 0
+
+    def evidence_str(self, gene_id):
+        return "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%i" % (gene_id, self.id, self.supported_fraction, self.cds_support,
+                                                       self.intron_support, self.five_utr_support,
+                                                       self.three_utr_support, self.incompatible_hint_groups,
+                                                       self.get_protein_length())
+
+
+class AUGUSTUSGene(object):
+    # gene block of AUGUSTUS output(from "# start gene" to "# end gene" lines) with parsed transcripts
+    def __init__(self, gene_id):
+        self.id = gene_id
+        self.lines = []
+        self.transcripts = OrderedDict()
+
+    def feature_lines(self, feature_type=None):
+        for line in self.lines:
+            if line[0] == "#":
+                continue
+            if (feature_type is None) or (line.split("\t", 3)[2] == feature_type):
+                yield line
+
+    @staticmethod
+    def select_longest_isoform(isoform_list, minimum_supported_fraction=0):
+        """
+        isoform_list - list of tuples (protein length, supported fraction, isoform), returns isoform with longest
+        protein(first of them if there are several) among isoforms with supported fraction not less than
+        minimum_supported_fraction, or None
+        """
+        longest_isoform = None
+        longest_length = None
+        for length, supported_fraction, isoform in isoform_list:
+            if float(supported_fraction) < minimum_supported_fraction:
+                continue
+            if (longest_length is None) or (length > longest_length):
+                longest_isoform = isoform
+                longest_length = length
+        return longest_isoform
+
+    def get_longest_transcript(self, minimum_supported_fraction=0):
+        # only transcripts with evidence and protein sequence are considered
+        return self.select_longest_isoform([(transcript.get_protein_length(), transcript.supported_fraction,
+                                             transcript) for transcript in self.transcripts.values()
+                                            if transcript.has_evidence() and (transcript.protein is not None)],
+                                           minimum_supported_fraction=minimum_supported_fraction)
+
+
+class AUGUSTUSOutput(object):
+    evidence_header = "#gene_id\ttranscript_id\tsupported_fraction\tcds_support\tintron_support\t" \
+                      "5'UTR_support\t3'UTR_support\tincompatible_hints_groups\tprotein_length\n"
+
+    # prefixes of lines of evidence block and corresponding attributes of transcript
+    evidence_line_prefixes = (("# % of transcript", "supported_fraction"),
+                              ("# CDS exons:", "cds_support"),
+                              ("# CDS introns:", "intron_support"),
+                              ("# 5'UTR exons", "five_utr_support"),
+                              ("# 3'UTR exons", "three_utr_support"),
+                              ("# incompatible hint groups:", "incompatible_hint_groups"))
+
+    @staticmethod
+    def record_generator(in_fd, outside_line_handler=None):
+        """
+        Single pass parser of AUGUSTUS gff output. Yields AUGUSTUSGene for each gene block,
+        so only one gene is kept in memory. Lines outside of gene blocks(comments, hints, etc) are skipped
+        or passed to outside_line_handler(line) in order of their appearance, i.e. before next gene is yielded.
+        """
+        gene = None
+        transcript = None
+        protein_parts = None
+
+        for line in in_fd:
+            if gene is None:
+                if line[:12] == "# start gene":
+                    gene = AUGUSTUSGene(line.strip().split()[-1])
+                    gene.lines.append(line)
+                    transcript = None
+                elif outside_line_handler is not None:
+                    outside_line_handler(line)
+                continue
+
+            gene.lines.append(line)
+            if protein_parts is not None:
+                # continuation of protein sequence
+                part = line.split()[-1]
+                if "]" in part:
+                    protein_parts.append(part.split("]")[0])
+                    transcript.protein = "".join(protein_parts)
+                    protein_parts = None
+                else:
+                    protein_parts.append(part)
+            elif line[0] == "#":
+                if line[:10] == "# end gene":
+                    yield gene
+                    gene = None
+                elif "# protein sequence" in line:
+                    protein = line.strip().split("[")[-1]
+                    if "]" in protein:
+                        transcript.protein = protein.split("]")[0]
+                    else:
+                        protein_parts = [protein]
+                elif transcript is not None:
+                    for prefix, attribute in AUGUSTUSOutput.evidence_line_prefixes:
+                        if line[:len(prefix)] == prefix:
+                            setattr(transcript, attribute, line.strip().split()[-1])
+                            break
+            elif "\ttranscript\t" in line:
+                transcript = AUGUSTUSTranscript(line.split("\t")[8].split(";")[0].split("=")[1])
+                gene.transcripts[transcript.id] = transcript
+            elif "\tstart_codon\t" in line:
+                transcript.start_presence = True
+            elif "\tstop_codon\t" in line:
+                transcript.stop_presence = True
+
+        if gene is not None:
+            raise ValueError("Gene %s is not finished at the end of AUGUSTUS output" % gene.id)
@@ -9,14 +9,19 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from CustomCollections.GeneralCollections import TwoLvlDict
+from CustomCollections.IntervalCollections import FeatureIndex
+from Parsers.Expression import compile_expression
 
 built_in_flags = {"DA": "desaminase-like",
                   "BR": "location in bad region (masked and so on)",
                   "IP": "indel presence"
                   }
 
+# for this expression check of location in bad regions is done using FeatureIndex instead of scan of all regions
+default_location_expression = "bad_region.start <= self.pos <= bad_region.end"
 
-class Record():
+
+class Record(object):
     def __init__(self, chrom, pos, description=None, flags=None):
         self.chrom = chrom
         self.pos = pos
@@ -35,6 +40,13 @@ class Record():
             return name
         return synonym_dict[name]
 
+    def _get_feature_index(self, record_dict):
+        # record_dict could be dictionary of SeqRecords or FeatureIndex, in first case index is built only for
+        # chromosome of record. Use FeatureIndex directly to annotate many records
+        if isinstance(record_dict, FeatureIndex):
+            return record_dict
+        return FeatureIndex({self.chrom: record_dict[self.chrom]})
+
     def get_location(self, record_dict, key="Loc", strand_key="strand", feature_type_black_list=[],
                     use_synonym=False, synonym_dict=None):
         # function is written for old variant (with sub_feature)s rather then new (with CompoundLocation)
@@ -50,36 +62,35 @@ class Record():
             # by default
             self.description[strand_key] = None
         #print(self.chrom, self.pos)
-        for feature in record_dict[self.chrom].features:
-            if (self.pos - 1) in feature:
-                self.description[key].add(self.get_synonym(feature.type, use_synonym=use_synonym,
-                                                           synonym_dict=synonym_dict))
-                if self.description[strand_key] is None:
-                    self.description[strand_key] = feature.strand
-                elif feature.strand != self.description[strand_key]:
-                    self.description[strand_key] = 0
-
-                #print(feature)
-            for sub_feature in feature.sub_features:
-                if (self.pos - 1) in sub_feature:
-                    self.description[key].add(self.get_synonym(sub_feature.type, use_synonym=use_synonym,
-                                                               synonym_dict=synonym_dict))
-                    if self.description[strand_key] is None:
-                        self.description[strand_key] = sub_feature.strand
-                    elif sub_feature.strand != self.description[strand_key]:
-                        self.description[strand_key] = 0
+        feature_index = self._get_feature_index(record_dict)
+        # both features and sub_features containing record are taken into account
+        for feature_id in feature_index.get_features(self.chrom, self.pos - 1):
+            feature = feature_index.features[self.chrom][feature_id]
+            self.description[key].add(self.get_synonym(feature.type, use_synonym=use_synonym,
+                                                       synonym_dict=synonym_dict))
+            if self.description[strand_key] is None:
+                self.description[strand_key] = feature.strand
+            elif feature.strand != self.description[strand_key]:
+                self.description[strand_key] = 0
 
         if not self.description[key]:
             # igc == intergenic
             self.description[key].add("igc")
 
-    def check_location(self, bad_region_collection_gff, expression="bad_region.start <= self.pos <= bad_region.end"):
+    def check_location(self, bad_region_collection_gff, expression=default_location_expression):
+        # bad_region_collection_gff could be FeatureIndex built by FeatureIndex.from_regions,
+        # in this case expression is ignored
         if not self.flags:
             self.flags = set()
+        if isinstance(bad_region_collection_gff, FeatureIndex):
+            if bad_region_collection_gff.get_features(self.chrom, self.pos - 1):
+                self.flags.add("BR")
+            return
+        in_bad_region = compile_expression(expression, arguments=("self", "bad_region"))
         for bad_region in bad_region_collection_gff:
             if self.chrom != bad_region.chrom:
                 continue
-            if eval(expression):
+            if in_bad_region(self, bad_region):
                 self.flags.add("BR")
 
 
@@ -180,21 +191,27 @@ class Collection(Iterable):
         return filtered_records, filtered_out_records
 
     def filter_records_by_expression(self, expression):
+        # expression is string with python expression using record (and self as collection) or function
+        # taking record and collection as arguments
         filtered_records = []
         filtered_out_records = []
+        predicate = compile_expression(expression, arguments=("record", "self"))
         for record in self.records:
             #print("a\na\na\na\na\na\na\na")
             #print(record.description["Power"])
-            if eval(expression):
+            if predicate(record, self):
                 filtered_records.append(record)
             else:
                 filtered_out_records.append(record)
 
         return filtered_records, filtered_out_records
 
-    def check_location(self, bad_region_collection_gff, expression="bad_region.start <= self.pos <= bad_region.end"):
+    def check_location(self, bad_region_collection_gff, expression=default_location_expression):
+        bad_regions = bad_region_collection_gff
+        if (expression == default_location_expression) and not isinstance(bad_regions, FeatureIndex):
+            bad_regions = FeatureIndex.from_regions(bad_region_collection_gff)
         for record in self:
-            record.check_location(bad_region_collection_gff, expression=expression)
+            record.check_location(bad_regions, expression=expression)
     """
     def filter_by_expression(self, expression):
         self_type = self.__class__.__name__
@@ -234,16 +251,17 @@ class Collection(Iterable):
                 out_fd.write(str(self.metadata) + "\n")
             if self.header:
                 out_fd.write(str(self.header) + "\n")
-            for record in self.records:
+            for record in self:
                 out_fd.write(str(record) + "\n")
 
     def get_location(self, record_dict, key="Loc", use_synonym=False, synonym_dict=None):
+        feature_index = record_dict if isinstance(record_dict, FeatureIndex) else FeatureIndex(record_dict)
         for record in self.records:
-            record.get_location(record_dict, key=key, use_synonym=use_synonym, synonym_dict=synonym_dict)
+            record.get_location(feature_index, key=key, use_synonym=use_synonym, synonym_dict=synonym_dict)
 
     def _split_regions(self):
         splited_dict = OrderedDict({})
-        for record in self.records:
+        for record in self:
             if record.chrom not in splited_dict:
                 splited_dict[record.chrom] = [record]
             else:
@@ -7,6 +7,7 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from matplotlib import colors
 from Parsers.Abstract import Record, Collection, Metadata, Header
+from Parsers.Expression import compile_expression
 from Parsers.VCF import CollectionVCF, MetadataVCF, HeaderVCF
 
 
@@ -143,8 +144,10 @@ class RecordCCF(Record, Iterable):
             record_to_remove_dict = dict([(flag, set([])) for flag in flag_list])
             mismatch_count_dict = dict([(flag, 0) for flag in flag_list])
             index = 0
+            predicates = [compile_expression(expression, arguments=("record", "self"))
+                          for expression in expression_list]
             for record in self:
-                expressions = [eval(expression) for expression in expression_list] \
+                expressions = [predicate(record, self) for predicate in predicates] \
                     if expression_list else [True for flag in flag_list]
                 for flag, expression, min_size in zip(flag_list, expressions, min_cluster):
                     #if self.size < min_size:
@@ -206,18 +209,17 @@ class RecordCCF(Record, Iterable):
             self.features = []
         if key not in self.description:
             self.description[key] = set([])
+        feature_index = self._get_feature_index(record_dict)
         for variant in self:
             if key in variant.description:
                 self.description[key] |= set(variant.description[key])
-            for feature in record_dict[self.chrom].features:
-                if (variant.pos - 1) in feature:
+            for feature_id in feature_index.get_features(self.chrom, variant.pos - 1):
+                feature = feature_index.features[self.chrom][feature_id]
+                if feature_index.parents[self.chrom][feature_id] < 0:
+                    # only top level features are saved
                     self.features.append(feature)
-                    self.description[key].add(self.get_synonym(feature.type, use_synonym=use_synonym,
-                                                               synonym_dict=synonym_dict))
-                for sub_feature in feature.sub_features:
-                    if (variant.pos - 1) in sub_feature:
-                        self.description[key].add(self.get_synonym(sub_feature.type, use_synonym=use_synonym,
-                                                                   synonym_dict=synonym_dict))
+                self.description[key].add(self.get_synonym(feature.type, use_synonym=use_synonym,
+                                                           synonym_dict=synonym_dict))
 
     def subclustering(self,
                       method="inconsistent",
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+import sys
+import ast
+
+import numpy as np
+
+# cache of compiled expressions, keys are tuples (expression, argument names, id of namespace),
+# values are tuples (namespace, function), namespace is kept to prevent reuse of its id
+compiled_expressions = {}
+
+
+def compile_expression(expression, arguments=("record",), namespace=None):
+    # compiles string expression(for example "record.size >= 3") to python function taking arguments,
+    # so expression is parsed only once instead of eval for each record
+    # callable objects are returned as is, so functions could be used everywhere instead of strings
+    # namespace - dict of global names available in expression, by default globals of module of caller are used
+    # (as it was with eval), so names like ref_alt_variants from Parsers.VCF could be used in expressions
+    if callable(expression):
+        return expression
+    if namespace is None:
+        namespace = sys._getframe(1).f_globals
+    key = (expression, tuple(arguments), id(namespace))
+    if key not in compiled_expressions:
+        stripped_expression = expression.strip()
+        # check that string is a single expression(raises SyntaxError otherwise)
+        ast.parse(stripped_expression, mode="eval")
+        code = compile("lambda %s: (%s)" % (", ".join(arguments), stripped_expression), "<expression>", "eval")
+        compiled_expressions[key] = (namespace, eval(code, namespace))
+    return compiled_expressions[key][1]
+
+
+def compile_mask(expression, numeric_columns, categorical_columns, length_columns, argument="record"):
+    # translates expression to numpy boolean mask over columns, returns None if expression contains
+    # something except supported constructions:
+    #   comparisons (including chained) of numeric columns and numbers, i.e. "record.pos >= 1000",
+    #   == and != comparisons of categorical columns and strings, i.e. "record.chrom == 'chr1'",
+    #   len() of length columns, i.e. "len(record.ref) == 1",
+    #   and, or, not
+    # numeric_columns - dict attribute: array
+    # categorical_columns - dict attribute: (array of codes, list of values) or
+    #                       (array of codes, list of values, False) if only part of values have own codes,
+    #                       comparisons with other values are not vectorized then
+    # length_columns - dict attribute: array of lengths
+    if callable(expression):
+        return None
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError:
+        return None
+
+    def get_attribute(node):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == argument:
+            return node.attr
+        return None
+
+    def get_constant(node):
+        if isinstance(node, ast.Num):
+            return node.n
+        if isinstance(node, ast.Str):
+            return node.s
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Num):
+            return -node.operand.n
+        return None
+
+    def translate_operand(node):
+        # returns (kind, value), kind is "numeric", "categorical" or "constant"
+        attribute = get_attribute(node)
+        if attribute in numeric_columns:
+            return "numeric", numeric_columns[attribute]
+        if attribute in categorical_columns:
+            return "categorical", categorical_columns[attribute]
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "len" \
+                and len(node.args) == 1 and not node.keywords:
+            attribute = get_attribute(node.args[0])
+            if attribute in length_columns:
+                return "numeric", length_columns[attribute]
+            return None
+        constant = get_constant(node)
+        if constant is not None:
+            return "constant", constant
+        return None
+
+    operators = {ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less,
+                 ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal}
+
+    def compare(left, operator, right):
+        if type(operator) not in operators:
+            return None
+        kinds = (left[0], right[0])
+        if "categorical" in kinds:
+            if not isinstance(operator, (ast.Eq, ast.NotEq)):
+                return None
+            column = left[1] if left[0] == "categorical" else right[1]
+            codes, values = column[:2]
+            constant = right if left[0] == "categorical" else left
+            if constant[0] != "constant":
+                return None
+            if constant[1] in values:
+                code = values.index(constant[1])
+            elif len(column) > 2 and not column[2]:
+                return None
+            else:
+                code = -1
+            return operators[type(operator)](codes, code)
+        if kinds == ("constant", "constant"):
+            return None
+        if any(kind == "constant" and not isinstance(value, (int, float)) for kind, value in (left, right)):
+            return None
+        return operators[type(operator)](left[1], right[1])
+
+    def translate(node):
+        if isinstance(node, ast.BoolOp):
+            masks = [translate(value) for value in node.values]
+            if any(mask is None for mask in masks):
+                return None
+            return np.logical_and.reduce(masks) if isinstance(node.op, ast.And) else np.logical_or.reduce(masks)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            mask = translate(node.operand)
+            return None if mask is None else np.logical_not(mask)
+        if isinstance(node, ast.Compare):
+            operands = [translate_operand(node.left)] + [translate_operand(comparator)
+                                                         for comparator in node.comparators]
+            if any(operand is None for operand in operands):
+                return None
+            masks = [compare(operands[i], node.ops[i], operands[i + 1]) for i in range(0, len(node.ops))]
+            if any(mask is None for mask in masks):
+                return None
+            return np.logical_and.reduce(masks)
+        return None
+
+    return translate(tree.body)
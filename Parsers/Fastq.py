@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import numpy as np
+
+
+class FastqBlockReader(object):
+    """
+    Reads fastq file(4 lines per record) by blocks of whole records. Block is returned as string together with
+    positions of its newlines found by numpy, so records could be sliced out of block without splitting to lines.
+    in_fd - any file-like object with read method(i.e. MergedInputStream for compressed files)
+    """
+    def __init__(self, in_fd, block_size=16777216):
+        self.in_fd = in_fd
+        self.block_size = block_size
+        self.buffer = ""
+        self.newlines = np.zeros(0, dtype=np.int64)
+        self.eof = False
+
+    def _fill_buffer(self):
+        data = self.in_fd.read(self.block_size)
+        if not data:
+            self.eof = True
+            # last line without newline
+            if self.buffer and (self.buffer[-1] != "\n"):
+                data = "\n"
+            else:
+                return
+        self.newlines = np.concatenate((self.newlines,
+                                        np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) +
+                                        len(self.buffer)))
+        self.buffer += data
+
+    def read_block(self, number_of_records=None):
+        """
+        Returns tuple (block, positions of newlines in block). If number_of_records is not set block contains
+        all whole records from next block_size bytes, otherwise - exactly number_of_records records or less
+        at the end of file. Empty block means end of file.
+        """
+        while not self.eof:
+            available_records = len(self.newlines) // 4
+            if number_of_records is None:
+                if available_records > 0:
+                    break
+            elif available_records >= number_of_records:
+                break
+            self._fill_buffer()
+
+        records_in_block = len(self.newlines) // 4
+        if number_of_records is not None:
+            records_in_block = min(records_in_block, number_of_records)
+        if (records_in_block == 0) and self.eof and self.buffer:
+            raise ValueError("Truncated fastq record at the end of file: %s" % self.buffer[:100])
+
+        block_end = self.newlines[4 * records_in_block - 1] + 1 if records_in_block > 0 else 0
+        block = self.buffer[:block_end]
+        newlines = self.newlines[:4 * records_in_block]
+
+        self.buffer = self.buffer[block_end:]
+        self.newlines = self.newlines[4 * records_in_block:] - block_end
+        return block, newlines
+
+    @staticmethod
+    def get_record_starts(newlines):
+        # returns array of starts of records in block with length of block appended
+        return np.concatenate(([0], newlines[3::4] + 1))
+
+    @staticmethod
+    def get_read_name_fields(block, newlines, field_index, separator=":"):
+        """
+        Returns tuple of arrays (starts, ends) of field_index-th field(zero-based, separated by separator) of
+        read names in block. Field is ended by next separator or by end of name line(as in split of whole line).
+        """
+        if len(newlines) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        name_starts = FastqBlockReader.get_record_starts(newlines)[:-1]
+        name_ends = newlines[0::4]
+        block_array = np.frombuffer(block, dtype=np.uint8)
+        # sentinels after end of block for names with less separators than necessary
+        separators = np.concatenate((np.flatnonzero(block_array == ord(separator)),
+                                     [len(block)] * (field_index + 1)))
+        first_separator_index = np.searchsorted(separators, name_starts)
+
+        field_starts = separators[first_separator_index + field_index - 1] + 1 if field_index > 0 \
+            else name_starts + 1
+        if np.any(field_starts > name_ends):
+            bad_record = np.flatnonzero(field_starts > name_ends)[0]
+            raise ValueError("Read name contains less than %i fields: %s" % (field_index + 1,
+                                                                             block[name_starts[bad_record]:
+                                                                                   name_ends[bad_record]]))
+        field_ends = np.minimum(separators[first_separator_index + field_index], name_ends)
+        return field_starts, field_ends
+
+    @staticmethod
+    def encode_numeric_fields(block, field_starts, field_ends):
+        """
+        Returns int64 array with codes of numeric fields(value * 16 + length, so "01101" and "1101" are different)
+        or None if some of fields contain non-digit symbols or are too long.
+        """
+        lengths = field_ends - field_starts
+        if len(lengths) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if (lengths.max() > 15) or (lengths.min() == 0):
+            return None
+        block_array = np.frombuffer(block, dtype=np.uint8)
+        codes = np.zeros(len(lengths), dtype=np.int64)
+        for position in range(0, lengths.max()):
+            present = position < lengths
+            digits = block_array[field_starts + np.minimum(position, lengths - 1)].astype(np.int64) - 48
+            if np.any(present & ((digits < 0) | (digits > 9))):
+                return None
+            codes = np.where(present, codes * 10 + digits, codes)
+        return codes * 16 + lengths
+
+    @staticmethod
+    def encode_numeric_string(string):
+        # the same encoding as in encode_numeric_fields for single string, None for non-numeric strings
+        if (not string.isdigit()) or (len(string) > 15):
+            return None
+        return int(string) * 16 + len(string)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import re
+import heapq
+
+
+class CigarLengthCache(dict):
+    # cache of reference lengths(M, D, N, = and X operations) of cigar strings,
+    # number of distinct cigar strings is small for most of read sets
+    cigar_operation_reg_exp = re.compile("(\d+)([MIDNSHP=X])")
+    reference_operations = set("MDN=X")
+
+    def __init__(self, max_size=1000000):
+        dict.__init__(self)
+        self.max_size = max_size
+
+    def get_reference_length(self, cigar_string):
+        if cigar_string not in self:
+            if len(self) >= self.max_size:
+                self.clear()
+            self[cigar_string] = sum([int(length) for length, operation
+                                      in self.cigar_operation_reg_exp.findall(cigar_string)
+                                      if operation in self.reference_operations])
+        return self[cigar_string]
+
+
+class StartClusterDetector(object):
+    """
+    Detects clusters of alignments with the same 5' end(alignment start for forward strand and
+    alignment end for reverse strand) in coordinate-sorted sam stream.
+    Only starts which can still gain alignments are kept in memory: start is flushed as soon as position of
+    sweep passes it, all starts are flushed on change of scaffold.
+    Histogram of cluster sizes is accumulated for all clusters.
+    """
+    def __init__(self, min_cluster_size=5):
+        self.min_cluster_size = min_cluster_size
+        self.cigar_cache = CigarLengthCache()
+        # size of cluster: number of clusters
+        self.size_histogram = {}
+
+    def cluster_generator(self, sam_line_iterator):
+        # yields tuples (scaffold, strand, start, list of sam lines) for all starts in order of flushing,
+        # header lines and unmapped reads are skipped
+        start_dict = {}
+        start_heap = []
+        current_scaffold = None
+        previous_position = 0
+        # scaffolds already passed by sweep, their reappearance means that input is not sorted
+        finished_scaffolds = set()
+
+        for line in sam_line_iterator:
+            if line[0] == "@":
+                continue
+            tmp = line.split("\t", 6)
+            flag = int(tmp[1])
+            if (flag & 4) or (tmp[2] == "*"):
+                continue
+            scaffold = tmp[2]
+            position = int(tmp[3])
+
+            if scaffold != current_scaffold:
+                if scaffold in finished_scaffolds:
+                    raise ValueError("Input is not coordinate-sorted: alignments to %s appear again after %s"
+                                     % (scaffold, current_scaffold))
+                while start_heap:
+                    key = heapq.heappop(start_heap)
+                    yield current_scaffold, key[1], key[0], start_dict.pop(key)
+                if current_scaffold is not None:
+                    finished_scaffolds.add(current_scaffold)
+                current_scaffold = scaffold
+                previous_position = 0
+            elif position < previous_position:
+                raise ValueError("Input is not coordinate-sorted: %s:%i after %s:%i" % (scaffold, position,
+                                                                                        scaffold, previous_position))
+            previous_position = position
+
+            # no alignment starting from current position or further can end before current position
+            while start_heap and (start_heap[0][0] < position):
+                key = heapq.heappop(start_heap)
+                yield current_scaffold, key[1], key[0], start_dict.pop(key)
+
+            # keys are (start, strand), so heap is ordered by start
+            if flag & 16:
+                key = (position + self.cigar_cache.get_reference_length(tmp[5]) - 1, -1)
+            else:
+                key = (position, 1)
+            if key in start_dict:
+                start_dict[key].append(line)
+            else:
+                start_dict[key] = [line]
+                heapq.heappush(start_heap, key)
+
+        while start_heap:
+            key = heapq.heappop(start_heap)
+            yield current_scaffold, key[1], key[0], start_dict.pop(key)
+
+    def filter(self, in_fd, out_fd, cluster_fd=None):
+        # writes header and alignments from clusters not smaller than min_cluster_size to out_fd
+        # (unmapped reads are not written), and coordinates and sizes of these clusters to cluster_fd if it is set
+        def line_generator():
+            for line in in_fd:
+                if line[0] == "@":
+                    out_fd.write(line)
+                    continue
+                yield line
+
+        if cluster_fd:
+            cluster_fd.write("#scaffold\tstrand\tstart\tcoverage\n")
+        for scaffold, strand, start, line_list in self.cluster_generator(line_generator()):
+            size = len(line_list)
+            self.size_histogram[size] = self.size_histogram.get(size, 0) + 1
+            if size >= self.min_cluster_size:
+                out_fd.write("".join(line_list))
+                if cluster_fd:
+                    cluster_fd.write("%s\t%i\t%i\t%i\n" % (scaffold, strand, start, size))
+
+    def write_size_histogram(self, output_file):
+        with open(output_file, "w") as out_fd:
+            out_fd.write("#cluster_size\tnumber_of_clusters\n")
+            for size in sorted(self.size_histogram):
+                out_fd.write("%i\t%i\n" % (size, self.size_histogram[size]))
@@ -18,7 +18,10 @@ from Bio.SeqFeature import SeqFeature, FeatureLocation
 
 
 #from General import check_path
-from Parsers.Abstract import Record, Collection, Metadata, Header
+from Parsers.Abstract import Record, Collection, Metadata, Header, default_location_expression
+from CustomCollections.IntervalCollections import FeatureIndex
+from Parsers.Expression import compile_expression, compile_mask
+from Routines import MathRoutines
 
 #TODO: refactor whole file
 ref_alt_variants = {"desaminases": [("C", ["T"]), ("G", ["A"])]
@@ -26,8 +29,13 @@ ref_alt_variants = {"desaminases": [("C", ["T"]), ("G", ["A"])]
 
 
 class RecordVCF(Record):
+    # converters for INFO and FORMAT values, types not listed here are kept as strings
+    type_converters = {"Integer": int,
+                       "Float": float}
+
     def __init__(self, chrom, pos, id, ref, alt_list, qual, filter_list, info_dict, samples_list,
-                 description={}, flags=None):
+                 description={}, flags=None, info_string=None, format_string=None, samples_strings=None,
+                 metadata=None):
         self.chrom = chrom                              #str
         self.pos = pos                                  #int
         self.id = id                                    #str
@@ -40,27 +48,96 @@ class RecordVCF(Record):
                                                         #values are lists
         self.description = description
         self.flags = flags
+        # raw strings are used for lazy parsing: if info_dict or samples_list is None
+        # corresponding column will be parsed only on first access using metadata
+        self.info_string = info_string                  #str or None
+        self.format_string = format_string              #str or None
+        self.samples_strings = samples_strings          #list of str or None
+        self.metadata = metadata                        #MetadataVCF or None
         #TODO: add data check
 
+    @property
+    def info_dict(self):
+        if self._info_dict is None:
+            self._info_dict = self.parse_info_string(self.info_string, self.metadata) if self.info_string else {}
+        return self._info_dict
+
+    @info_dict.setter
+    def info_dict(self, value):
+        self._info_dict = value
+
+    @property
+    def samples_list(self):
+        if self._samples_list is None:
+            self._samples_list = self.parse_samples_strings(self.format_string, self.samples_strings, self.metadata) \
+                if self.samples_strings else []
+        return self._samples_list
+
+    @samples_list.setter
+    def samples_list(self, value):
+        self._samples_list = value
+
+    @staticmethod
+    def parse_info_string(info_string, metadata):
+        info_dict = {}
+        for entry in info_string.split(";"):
+            key, value = CollectionVCF._split_by_equal_sign(entry)
+            value_type = metadata["INFO"][key]["Type"]
+            if value_type == "Flag":
+                info_dict[key] = []
+            elif value_type in RecordVCF.type_converters:
+                info_dict[key] = list(map(RecordVCF.type_converters[value_type], value.split(",")))
+            else:
+                info_dict[key] = value.split(",")
+        return info_dict
+
+    @staticmethod
+    def parse_samples_strings(format_string, samples_strings, metadata):
+        format_list = format_string.split(":")
+        converters = [RecordVCF.type_converters.get(metadata["FORMAT"][key]["Type"]) for key in format_list]
+        samples_list = []
+        for sample_string in samples_strings:
+            sample_dict = OrderedDict({})
+            if sample_string == "./.":
+                sample_dict["GT"] = ["./."]
+            else:
+                for key, converter, value_list in zip(format_list, converters, sample_string.split(":")):
+                    sample_dict[key] = list(map(converter, value_list.split(","))) if converter \
+                        else value_list.split(",")
+            samples_list.append(sample_dict)
+        return samples_list
+
     def __str__(self):
         alt_string = ",".join(self.alt_list)
         filter_string = ";".join(self.filter_list)
-        key_string_list = []
-        for key in sorted(list(self.info_dict.keys())):
-            if self.info_dict[key]:
-                key_string_list.append(key + "=" + ",". join(map(lambda x: str(x), self.info_dict[key])))
-            else:
-                key_string_list.append(key)
-
-        info_string = ";".join(key_string_list)
-        for sample in self.samples_list:
-            if len(sample.keys()) > 1:
-                format_string = ":".join(sample.keys())
-                break
+        if self._info_dict is None:
+            # INFO column was not touched, so raw string could be written as is
+            info_string = self.info_string
+        else:
+            key_string_list = []
+            for key in sorted(list(self.info_dict.keys())):
+                if self.info_dict[key]:
+                    key_string_list.append(key + "=" + ",". join(map(lambda x: str(x), self.info_dict[key])))
+                else:
+                    key_string_list.append(key)
+
+            info_string = ";".join(key_string_list)
+
+        column_list = [self.chrom, self.pos, self.id, self.ref, alt_string, self.qual, filter_string, info_string]
+        if self._samples_list is None:
+            # FORMAT and samples columns are absent in sites-only vcf
+            if self.samples_strings:
+                column_list += [self.format_string, "\t".join(self.samples_strings)]
+        elif self.samples_list:
+            format_string = ":".join(self.samples_list[0].keys())
+            for sample in self.samples_list:
+                if len(sample.keys()) > 1:
+                    format_string = ":".join(sample.keys())
+                    break
 
-        samples_string = "\t".join([":".join([",".join(map(lambda x: str(x), sample[key])) for key in sample.keys()]) for sample in self.samples_list])
-        return '\t'.join(map(lambda x: str(x), [self.chrom, self.pos, self.id, self.ref, alt_string,
-                                                self.qual, filter_string, info_string, format_string, samples_string]))
+            samples_string = "\t".join([":".join([",".join(map(lambda x: str(x), sample[key])) for key in sample.keys()]) for sample in self.samples_list])
+            column_list += [format_string, samples_string]
+        return '\t'.join(map(lambda x: str(x), column_list))
 
     def check_indel(self):
         #checks if record is indel
@@ -91,7 +168,7 @@ class RecordVCF(Record):
         return "%s\tvariant_call\tvariant\t%i\t%i\t.\t.\t.\t%s" % (self.chrom, self.start, self.end, attributes_string)
 
     def set_filter(self, expression, filter_name):
-        if eval(expression):
+        if compile_expression(expression, arguments=("self",))(self):
             self.filter_list.append(filter_name)
             self.filter_list.sort()
 
@@ -126,37 +203,30 @@ class RecordVCF(Record):
                 self.info_dict[flag_key] = []
 
         #print(self.chrom, self.pos)
-        for feature in record_dict[self.chrom].features:
-
+        feature_index = self._get_feature_index(record_dict)
+        features = feature_index.features.get(self.chrom, [])
+        parents = feature_index.parents.get(self.chrom, [])
+        feature_ids = feature_index.get_features(self.chrom, self.pos - 1)
+        for feature_id in feature_ids:
+            feature = features[feature_id]
             if feature.type in feature_type_black_list:
                 continue
-
-            if (self.pos - 1) in feature:
+            parent_id = parents[feature_id]
+            if parent_id < 0:
                 if feature.type == "gene" or feature.type == "ncRNA":
                     #print(feature.qualifiers)
                     self.info_dict[genes_key].append(feature.qualifiers["Name"][0])
                     self.info_dict[genes_strand_key].append(strands[feature.strand])
-
-                self.info_dict[key].add(self.get_synonym(feature.type, use_synonym=use_synonym,
-                                                           synonym_dict=synonym_dict))
-                if self.info_dict[strand_key][0] == "N":
-                    self.info_dict[strand_key][0] = strands[feature.strand]
-                elif strands[feature.strand] != self.info_dict[strand_key][0]:
-                    self.info_dict[strand_key][0] = "B"
-            else:
+            elif (parent_id not in feature_ids) or (features[parent_id].type in feature_type_black_list):
+                # sub_features are taken into account only if parent feature contains record and is not blacklisted
                 continue
 
-                #print(feature)
-            for sub_feature in feature.sub_features:
-                if sub_feature.type in feature_type_black_list:
-                    continue
-                if (self.pos - 1) in sub_feature:
-                    self.info_dict[key].add(self.get_synonym(sub_feature.type, use_synonym=use_synonym,
-                                                           synonym_dict=synonym_dict))
-                    if self.info_dict[strand_key][0] == "N":
-                        self.info_dict[strand_key][0] = strands[sub_feature.strand]
-                    elif strands[sub_feature.strand] != self.info_dict[strand_key][0]:
-                        self.info_dict[strand_key][0] = "B"
+            self.info_dict[key].add(self.get_synonym(feature.type, use_synonym=use_synonym,
+                                                     synonym_dict=synonym_dict))
+            if self.info_dict[strand_key][0] == "N":
+                self.info_dict[strand_key][0] = strands[feature.strand]
+            elif strands[feature.strand] != self.info_dict[strand_key][0]:
+                self.info_dict[strand_key][0] = "B"
 
         if not self.info_dict[genes_key]:
             self.info_dict.pop(genes_key)
@@ -237,13 +307,169 @@ class HeaderVCF(list, Header):
         return "#" + "\t".join(self)
 
 
+class ColumnsVCF(object):
+    # columnar storage of CollectionVCF data, each column is numpy array with one entry per record
+    # chrom_codes are indexes in chrom_list(order of first appearance of chromosome)
+    # ref_codes are indexes in ref_list, qual of records without quality is nan
+    # filter_masks are bitmasks, bit i is set if filter filter_list[i] is present in record
+    # genotypes (n_records x n_samples) are coded as: -1 - not called, 0 - homozygous reference,
+    # 1 - heterozygous, 2 - homozygous alternative; missing depths are set to -1
+    ref_list = ["A", "C", "G", "T", "INDEL"]
+    genotype_codes = {"not_called": -1, "homo_ref": 0, "hetero": 1, "homo_alt": 2}
+
+    def __init__(self, records, samples=None, parse_samples=False):
+        self.samples = samples
+        self.chrom_list = []
+        self.filter_list = []
+        self.has_samples = parse_samples
+
+        chrom_index_dict = {}
+        filter_index_dict = {}
+        ref_index_dict = dict([(ref, index) for index, ref in enumerate(self.ref_list)])
+        chrom_codes = []
+        positions = []
+        quals = []
+        ref_lengths = []
+        alt_lengths = []
+        ref_codes = []
+        filter_masks = []
+        genotypes = []
+        depths = []
+
+        for record in records:
+            if record.chrom not in chrom_index_dict:
+                chrom_index_dict[record.chrom] = len(self.chrom_list)
+                self.chrom_list.append(record.chrom)
+            chrom_codes.append(chrom_index_dict[record.chrom])
+            positions.append(record.pos)
+            quals.append(np.nan if record.qual == "." else record.qual)
+            ref_lengths.append(len(record.ref))
+            alt_lengths.append(max(map(len, record.alt_list)))
+            ref_codes.append(ref_index_dict.get(record.ref, 4))
+
+            mask = 0
+            for filter_name in record.filter_list:
+                if filter_name not in filter_index_dict:
+                    if len(self.filter_list) == 64:
+                        raise ValueError("More than 64 different filters are present in collection")
+                    filter_index_dict[filter_name] = len(self.filter_list)
+                    self.filter_list.append(filter_name)
+                mask |= 1 << filter_index_dict[filter_name]
+            filter_masks.append(mask)
+
+            if parse_samples:
+                record_genotypes = []
+                record_depths = []
+                for sample_dict in record.samples_list:
+                    record_genotypes.append(self.get_genotype_code(sample_dict["GT"][0]))
+                    depth = sample_dict["DP"][0] if "DP" in sample_dict else -1
+                    record_depths.append(depth if isinstance(depth, int) else -1)
+                genotypes.append(record_genotypes)
+                depths.append(record_depths)
+
+        self.chrom_codes = np.array(chrom_codes, dtype=np.int32)
+        self.positions = np.array(positions, dtype=np.int64)
+        self.quals = np.array(quals, dtype=np.float64)
+        self.ref_lengths = np.array(ref_lengths, dtype=np.int32)
+        self.alt_lengths = np.array(alt_lengths, dtype=np.int32)
+        self.ref_codes = np.array(ref_codes, dtype=np.int8)
+        self.filter_masks = np.array(filter_masks, dtype=np.uint64)
+        if parse_samples:
+            n_samples = len(genotypes[0]) if genotypes else (len(samples) if samples else 0)
+            self.genotypes = np.array(genotypes, dtype=np.int8).reshape(len(genotypes), n_samples)
+            self.depths = np.array(depths, dtype=np.int32).reshape(len(depths), n_samples)
+        else:
+            self.genotypes = None
+            self.depths = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    @staticmethod
+    def get_genotype_code(genotype):
+        alleles = genotype.replace("|", "/").split("/")
+        if "." in alleles:
+            return -1
+        if alleles.count(alleles[0]) != len(alleles):
+            return 1
+        return 0 if alleles[0] == "0" else 2
+
+    def get_filter_mask(self, filter_names, mode="one"):
+        # returns boolean array, possible modes:
+        # all - record must have all filters from filter_names
+        # one - record must have at least one filter from filter_names
+        bits = 0
+        for filter_name in filter_names:
+            if filter_name not in self.filter_list:
+                if mode == "all":
+                    return np.zeros(len(self), dtype=bool)
+                continue
+            bits |= 1 << self.filter_list.index(filter_name)
+        bits = np.uint64(bits)
+        if mode == "all":
+            return (self.filter_masks & bits) == bits
+        return (self.filter_masks & bits) != 0
+
+    def get_mask(self, expression):
+        # returns boolean array for expression calculated on columns or None if expression can't be vectorized
+        # qualities are used only if all records have them as "." can't be compared with numbers
+        numeric_columns = {"pos": self.positions}
+        if not np.any(np.isnan(self.quals)):
+            numeric_columns["qual"] = self.quals
+        return compile_mask(expression, numeric_columns,
+                            {"chrom": (self.chrom_codes, self.chrom_list),
+                             # only single nucleotide references have own codes
+                             "ref": (self.ref_codes, self.ref_list[:4], False)},
+                            {"ref": self.ref_lengths})
+
+    def get_chrom_indexes(self, black_list=[], white_list=[]):
+        # returns OrderedDict with chromosomes as keys and arrays of record indexes as values
+        # order of records inside each chromosome is preserved
+        order = np.argsort(self.chrom_codes, kind="mergesort")
+        counts = np.bincount(self.chrom_codes, minlength=len(self.chrom_list))
+        borders = np.concatenate(([0], np.cumsum(counts)))
+        chrom_index_dict = OrderedDict()
+        for code, chrom in enumerate(self.chrom_list):
+            if black_list and (chrom in black_list):
+                continue
+            if white_list and (chrom not in white_list):
+                continue
+            chrom_index_dict[chrom] = order[borders[code]:borders[code + 1]]
+        return chrom_index_dict
+
+    def split_by_chrom(self, array, black_list=[], white_list=[]):
+        # splits per record array (any of columns or derived from them) by chromosomes
+        return OrderedDict([(chrom, array[indexes])
+                            for chrom, indexes in self.get_chrom_indexes(black_list=black_list,
+                                                                         white_list=white_list).items()])
+
+    def get_distances(self):
+        # returns array of distances to previous variant on same chromosome, zero for first variant on chromosome
+        distances = np.zeros(len(self), dtype=np.int64)
+        for chrom, indexes in self.get_chrom_indexes().items():
+            if len(indexes) > 1:
+                distances[indexes[1:]] = np.diff(self.positions[indexes])
+        return distances
+
+
 class CollectionVCF(Collection):
 
-    def __init__(self, metadata=None, record_list=None, header=None, vcf_file=None, samples=None, from_file=True, external_metadata=None):
+    def __init__(self, metadata=None, record_list=None, header=None, vcf_file=None, samples=None, from_file=True,
+                 external_metadata=None, streaming=False, record_filter=None):
+        # if streaming is True records are not stored in memory: each iteration over collection rereads vcf_file,
+        # yields records one by one and skips records for which record_filter (function taking record as argument)
+        # returns False. Modifications of records in streaming collection are not saved between iterations,
+        # so methods modifying records in place(set_filter, add_info, check_location, etc) raise ValueError.
         self.linkage_dict = None
+        self.columns = None
+        self.columns_record_list = None
+        self.vcf_file = vcf_file
+        self.external_metadata = external_metadata
+        self.streaming = streaming
+        self.record_filter = record_filter
         if from_file:
             self.metadata = MetadataVCF()
-            self.records = []
+            self.records = None if streaming else []
             with open(vcf_file, "r") as fd:
                 for line in fd:
                     if line[:2] != "##":
@@ -252,15 +478,73 @@ class CollectionVCF(Collection):
                         break
                     #print(line)
                     self.metadata.add_metadata(line)
-                for line in fd:
-                    self.records.append(self.add_record(line, external_metadata=external_metadata))
+                if not streaming:
+                    for line in fd:
+                        self.records.append(self.add_record(line, external_metadata=external_metadata))
         else:
             self.metadata = metadata
             self.records = [] if record_list is None else record_list
             self.header = header
             self.samples = samples
 
+    def __iter__(self):
+        if not self.streaming:
+            for record in self.records:
+                yield record
+            return
+
+        with open(self.vcf_file, "r") as fd:
+            for line in fd:
+                if line[0] == "#":
+                    continue
+                record = self.add_record(line, external_metadata=self.external_metadata)
+                if (self.record_filter is None) or self.record_filter(record):
+                    yield record
+
+    def __len__(self):
+        if self.streaming:
+            return sum(1 for record in self)
+        return len(self.records)
+
+    def get_columns(self, parse_samples=False):
+        # columnar storage is built on first request and reused until invalidate_columns() is called(all methods
+        # modifying records call it) or until list of records is replaced or changes its length
+        if (self.columns is None) or (parse_samples and not self.columns.has_samples) or \
+                ((not self.streaming) and ((self.columns_record_list is not self.records) or
+                                           (len(self.columns) != len(self.records)))):
+            self.columns = ColumnsVCF(self, samples=self.samples, parse_samples=parse_samples)
+            self.columns_record_list = self.records
+        return self.columns
+
+    def invalidate_columns(self):
+        # must be called after modification of records in place(i.e. record.set_filter(...) or change of
+        # record.pos or record.qual), otherwise get_columns() returns outdated columns
+        self.columns = None
+        self.columns_record_list = None
+
+    def pop(self, index=None):
+        self.invalidate_columns()
+        return Collection.pop(self, index=index)
+
+    def _check_not_streaming(self, method_name):
+        if self.streaming:
+            raise ValueError("%s modifies records in place and can't be used with streaming CollectionVCF. "
+                             "Read collection with streaming=False" % method_name)
+
+    def _get_substream(self, record_filter):
+        # returns streaming collection reading same file and applying record_filter after filter of this collection
+        if self.record_filter is None:
+            combined_filter = record_filter
+        else:
+            combined_filter = lambda record: self.record_filter(record) and record_filter(record)
+        substream = CollectionVCF(metadata=self.metadata, header=self.header, samples=self.samples, from_file=False,
+                                  vcf_file=self.vcf_file, external_metadata=self.external_metadata,
+                                  streaming=True, record_filter=combined_filter)
+        substream.records = None
+        return substream
+
     def add_record(self, line, external_metadata=None):
+        # INFO and samples columns are stored as raw strings and parsed on first access
         line_list = line.strip().split("\t")
         #CHROM	POS	ID	REF	ALT	QUAL	FILTER	INFO	FORMAT	Sample_1
         position = int(line_list[1])
@@ -270,57 +554,12 @@ class CollectionVCF(Collection):
         alt_list = line_list[4].split(",")
         filter_list = line_list[6].split(",")          #list, entries are strings
 
-        info_tuple_list = [self._split_by_equal_sign(entry) for entry in line_list[7].split(";")]
-        info_dict = {}
-        for entry in info_tuple_list:
-            if self.metadata:
-                if self.metadata["INFO"][entry[0]]["Type"] == "Flag":
-                    info_dict[entry[0]] = []
-                elif self.metadata["INFO"][entry[0]]["Type"] == "Integer":
-                    info_dict[entry[0]] = list(map(lambda x: int(x), entry[1].split(",")))
-                elif self.metadata["INFO"][entry[0]]["Type"] == "Float":
-                    info_dict[entry[0]] = list(map(lambda x: float(x), entry[1].split(",")))
-                else:
-                    info_dict[entry[0]] = entry[1].split(",")
-            else:
-                if external_metadata["INFO"][entry[0]]["Type"] == "Flag":
-                    info_dict[entry[0]] = []
-                elif external_metadata["INFO"][entry[0]]["Type"] == "Integer":
-                    info_dict[entry[0]] = list(map(lambda x: int(x), entry[1].split(",")))
-                elif external_metadata["INFO"][entry[0]]["Type"] == "Float":
-                    info_dict[entry[0]] = list(map(lambda x: float(x), entry[1].split(",")))
-                else:
-                    info_dict[entry[0]] = entry[1].split(",")
-        samples_list = []
-
-        for sample_string in line_list[9:]:
-            #print (sample_string)
-            sample_dict = OrderedDict({})
-            if sample_string == "./.":
-                sample_dict["GT"] = ["./."]
-            else:
-                for key, value_list in zip(line_list[8].split(":"), sample_string.split(":")):
-                    #print (key, value_list)
-                    if self.metadata:
-                        if self.metadata["FORMAT"][key]["Type"] == "Integer":
-                            sample_dict[key] = list(map(lambda x: int(x), value_list.split(",")))
-                        elif self.metadata["FORMAT"][key]["Type"] == "Float":
-                            sample_dict[key] = list(map(lambda x: float(x), value_list.split(",")))
-                        else:
-                            sample_dict[key] = value_list.split(",")
-                    else:
-                        if external_metadata["FORMAT"][key]["Type"] == "Integer":
-                            sample_dict[key] = list(map(lambda x: int(x), value_list.split(",")))
-                        elif external_metadata["FORMAT"][key]["Type"] == "Float":
-                            sample_dict[key] = list(map(lambda x: float(x), value_list.split(",")))
-                        else:
-                            sample_dict[key] = value_list.split(",")
-            #print(sample_dict)
-            samples_list.append(sample_dict)
-        #print(samples_list)
         return RecordVCF(line_list[0], position, line_list[2], line_list[3],
-                                      alt_list, quality, filter_list,
-                                      info_dict, samples_list)
+                         alt_list, quality, filter_list, None, None,
+                         info_string=line_list[7],
+                         format_string=line_list[8] if len(line_list) > 8 else None,
+                         samples_strings=line_list[9:],
+                         metadata=self.metadata if self.metadata else external_metadata)
 
     @staticmethod
     def _split_by_equal_sign(string):
@@ -350,16 +589,24 @@ class CollectionVCF(Collection):
         index_list.append(len(string))
         return [string[index_list[j] + 1: index_list[j + 1]] for j in range(0, len(index_list) - 1)]
 
+    @staticmethod
+    def _is_heterozygous(record):
+        for sample_dict in record.samples_list:
+            zyg = sample_dict["GT"][0].split("/")
+            if zyg[0] != zyg[1]:
+                return True
+        return False
+
     def split_by_zygoty(self):
         #splits sites by zygoty, site counts as heterozygote if even in one sample it it hetorozygote
+        if self.streaming:
+            return self._get_substream(lambda record: not self._is_heterozygous(record)), \
+                   self._get_substream(self._is_heterozygous)
         homo_sites = []
         hetero_sites = []
         for site in self.records:
-            for sample_dict in site.samples_list:
-                zyg = sample_dict["GT"][0].split("/")
-                if zyg[0] != zyg[1]:
-                    hetero_sites.append(site)
-                    break
+            if self._is_heterozygous(site):
+                hetero_sites.append(site)
             else:
                 homo_sites.append(site)
         homozygotes = CollectionVCF(metadata=self.metadata, record_list=homo_sites,
@@ -370,21 +617,11 @@ class CollectionVCF(Collection):
 
     def record_coordinates(self, black_list=[], white_list=[]):
         #return dictionary, where keys are chromosomes and values numpy arrays of SNV coordinates
-        sequence_varcoord_dict = {}
-        for record in self.records:
-            if black_list and (record.chrom in black_list):
-                continue
-            if white_list and (record.chrom not in white_list):
-                continue
-            if record.chrom not in sequence_varcoord_dict:
-                sequence_varcoord_dict[record.chrom] = [record.pos]
-            else:
-                sequence_varcoord_dict[record.chrom].append(record.pos)
-        for chrom in sequence_varcoord_dict:
-            sequence_varcoord_dict[chrom] = np.array(sequence_varcoord_dict[chrom])
-        return sequence_varcoord_dict
+        columns = self.get_columns()
+        return columns.split_by_chrom(columns.positions, black_list=black_list, white_list=white_list)
 
     def check_by_ref_and_alt(self, ref_alt_list, flag):
+        self._check_not_streaming("check_by_ref_and_alt")
         for record in self:
             record.check_ref_alt_list(ref_alt_list, flag)
 
@@ -401,6 +638,9 @@ class CollectionVCF(Collection):
 
     def split_by_ref_and_alt(self, ref_alt_list):
         # structure of ref_alt_list:  [[ref1,[alt1.1, alt1.M1]], ..., [refN,[altN.1, ..., altN.MN]]]
+        if self.streaming:
+            return self._get_substream(lambda record: (record.ref, record.alt_list) in ref_alt_list), \
+                   self._get_substream(lambda record: (record.ref, record.alt_list) not in ref_alt_list)
         found_records = []
         filtered_out_records = []
         for record in self.records:
@@ -426,13 +666,20 @@ class CollectionVCF(Collection):
         return splited_dict
 
     def set_filter(self, expression, filter_name):
+        self._check_not_streaming("set_filter")
+        self.invalidate_columns()
+        predicate = compile_expression(expression, arguments=("record", "self"))
         for record in self:
-            if eval(expression):
+            if predicate(record, self):
                 if "PASS" in record.filter_list or "." in record.filter_list:
                     record.filter_list = [filter_name]
                 else:
                     record.filter_list.append(filter_name)
 
+    def check_location(self, bad_region_collection_gff, expression=default_location_expression):
+        self._check_not_streaming("check_location")
+        Collection.check_location(self, bad_region_collection_gff, expression=expression)
+
     def split_by_regions(self):
         #TODO: check
         regions_dict = self._split_regions()
@@ -455,11 +702,8 @@ class CollectionVCF(Collection):
                           header=self.header, from_file=False).write(prefix + "_" + region + ".vcf")
 
     def get_positions(self):
-        regions_dict = self._split_regions()
-        positions_dict = {}
-        for region in regions_dict:
-            positions_dict[region] = np.array([record.pos for record in regions_dict[region]])
-        return positions_dict
+        columns = self.get_columns()
+        return columns.split_by_chrom(columns.positions)
 
     def rainfall_plot(self, plot_name, base_colors=[], single_fig=True, dpi=300, figsize=(40, 40), facecolor="#D6D6D6",
                       ref_genome=None, masked_regions=None, min_gap_length=10, draw_gaps=False, suptitle=None):
@@ -475,10 +719,12 @@ class CollectionVCF(Collection):
             reference_colors = base_colors
 
 
-        regions_dict = self._split_regions()
-        num_of_regions = len(regions_dict)
-        positions_dict = {}
-        distances_dict = {}
+        columns = self.get_columns()
+        positions_dict = columns.split_by_chrom(columns.positions)
+        #distance to previous variant, 0 for first variant in region
+        distances_dict = columns.split_by_chrom(columns.get_distances())
+        ref_codes_dict = columns.split_by_chrom(columns.ref_codes)
+        num_of_regions = len(positions_dict)
         region_reference_dict = {}
         os.system("mkdir -p %s" % plot_dir)
         if single_fig:
@@ -486,18 +732,12 @@ class CollectionVCF(Collection):
             fig.suptitle(suptitle if suptitle else "Rainfall plot", fontsize=40, fontweight='bold', y=0.94)
             sub_plot_dict = OrderedDict({})
         index = 1
-        for region in regions_dict:
-            positions_dict[region] = np.array([record.pos for record in regions_dict[region]])
-            #np.ediff1d return differences between consecutive elements in array, then 0 is added to the beginning
-            distances_dict[region] = np.insert(np.ediff1d(positions_dict[region]), 0, 0)
-            region_reference_dict[region] = OrderedDict({"A": [[], []],
-                                                         "C": [[], []],
-                                                         "G": [[], []],
-                                                         "T": [[], []],
-                                                         "INDEL": [[], []]})
-            for i in range(0, len(regions_dict[region])):
-                region_reference_dict[region][self._reference(regions_dict[region][i])][0].append(positions_dict[region][i])
-                region_reference_dict[region][self._reference(regions_dict[region][i])][1].append(distances_dict[region][i])
+        for region in positions_dict:
+            region_reference_dict[region] = OrderedDict({})
+            for ref_code, reference in enumerate(ColumnsVCF.ref_list):
+                ref_mask = ref_codes_dict[region] == ref_code
+                region_reference_dict[region][reference] = [positions_dict[region][ref_mask],
+                                                            distances_dict[region][ref_mask]]
             if single_fig:
                 if not sub_plot_dict:
                     sub_plot_dict[region] = plt.subplot(num_of_regions, 1, index, axisbg=facecolor)
@@ -558,11 +798,16 @@ class CollectionVCF(Collection):
                                 dendrogramm_color_threshold=1000,
                                 draw_dendrogramm=True,
                                 write_inconsistent=True,
-                                write_correlation=True):
+                                write_correlation=True,
+                                correlation_size_limit=20000):
         # IMPORTANT! Use only for one-sample vcf
         # http://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.linkage.html#scipy.cluster.hierarchy.linkage
+        # for 'single', 'complete' and 'average' methods linkage is calculated by fast one-dimensional algorithm
+        # without distance matrix. Cophenetic correlation still requires distance matrix, so it is calculated
+        # only for regions with number of variants not higher than correlation_size_limit (nan is written for others)
         region_dict = self._split_regions()
-        positions_dict = OrderedDict({})
+        columns = self.get_columns()
+        positions_dict = columns.split_by_chrom(columns.positions.reshape(-1, 1))
         correlation_dict = OrderedDict({})
         linkage_dict = OrderedDict({})
         inconsistent_dict = OrderedDict({})
@@ -570,8 +815,6 @@ class CollectionVCF(Collection):
         if draw_dendrogramm or write_correlation or write_inconsistent:
             os.system("mkdir -p %s" % clustering_dir)
         for region in region_dict:
-            positions_dict[region] = np.array([[record.pos] for record in region_dict[region]])
-
             # allowed methods(used to calculate distance between clusters):
             # 'complete'    -   Farthest Point Algorithm
             # 'single'      -   Nearest Point Algorithm
@@ -582,9 +825,18 @@ class CollectionVCF(Collection):
             # 'median'      -   WPGMC algorithm
             # 'ward'        -   incremental algorithm
 
-            distance_matrix = pdist(positions_dict[region])
-            #print(distance_matrix)
-            linkage_dict[region] = linkage(distance_matrix, method=method)
+            distance_matrix = None
+            if method in ("single", "complete", "average"):
+                linkage_dict[region] = MathRoutines.linkage_1d(positions_dict[region], method=method)
+            else:
+                distance_matrix = pdist(positions_dict[region])
+                linkage_dict[region] = linkage(distance_matrix, method=method)
+
+            if len(positions_dict[region]) < 2:
+                # region with single variant, nothing to cluster
+                correlation_dict[region] = np.nan
+                continue
+
             if draw_dendrogramm:
                 plt.figure(1, dpi=150, figsize=(50, 20))
                 dendrogram(linkage_dict[region],
@@ -599,7 +851,12 @@ class CollectionVCF(Collection):
 
             # http://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.cophenet.html#scipy.cluster.hierarchy.cophenet
             # calculates cophenetic correlation coefficient to estimate accuracy of clustering
-            correlation_dict[region] = cophenet(linkage_dict[region], distance_matrix)[0]
+            if len(positions_dict[region]) <= correlation_size_limit:
+                if distance_matrix is None:
+                    distance_matrix = pdist(positions_dict[region])
+                correlation_dict[region] = cophenet(linkage_dict[region], distance_matrix)[0]
+            else:
+                correlation_dict[region] = np.nan
 
             # http://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.inconsistent.html#scipy.cluster.hierarchy.inconsistent
             # calculates inconsistent coeff
@@ -623,6 +880,18 @@ class CollectionVCF(Collection):
 
         return region_dict, linkage_dict
 
+    @staticmethod
+    def _get_flat_clusters(linkage_matrix, threshold, criterion="inconsistent", inconsistent_matrix=None):
+        # http://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.fcluster.html#scipy.cluster.hierarchy.fcluster
+        # inconsistent_matrix could be precalculated to avoid recalculation for each threshold
+        if len(linkage_matrix) == 0:
+            # linkage of single variant
+            return np.ones(1, dtype=np.int32)
+        if criterion == "inconsistent":
+            return fcluster(linkage_matrix, threshold, criterion=criterion,
+                            R=inconsistent(linkage_matrix) if inconsistent_matrix is None else inconsistent_matrix)
+        return fcluster(linkage_matrix, threshold, criterion=criterion)
+
     def get_clusters(self,
                      extracting_method="inconsistent",
                      threshold=0.8,
@@ -640,6 +909,7 @@ class CollectionVCF(Collection):
         from Parsers.CCF import RecordCCF, CollectionCCF, MetadataCCF, HeaderCCF
         if self.linkage_dict:
             linkage_dict = self.linkage_dict
+            region_dict = self._split_regions()
         else:
             region_dict, linkage_dict = self.hierarchical_clustering(method=cluster_distance,
                                                                      dendrogramm_max_y=dendrogramm_max_y,
@@ -657,7 +927,7 @@ class CollectionVCF(Collection):
 
         clusters = OrderedDict()
         for region in linkage_dict:
-            clusters[region] = fcluster(linkage_dict[region], threshold, criterion=extracting_method)
+            clusters[region] = self._get_flat_clusters(linkage_dict[region], threshold, criterion=extracting_method)
 
         if return_collection:
             for region in region_dict:
@@ -734,27 +1004,19 @@ class CollectionVCF(Collection):
             n_multiclusters = []
             n_five_plus_clusters = []
             coef_threshold_list = np.linspace(*thresholds)  # best variant 0.5, 1.5, 21
+            # inconsistency coefficients don't depend on threshold, so they are calculated once per region
+            inconsistent_matrix = inconsistent(linkage_dict[region]) \
+                if (extracting_method == "inconsistent") and len(linkage_dict[region]) > 0 else None
             for i in coef_threshold_list:
-                clusters = fcluster(linkage_dict[region], i, criterion=extracting_method)
+                clusters = self._get_flat_clusters(linkage_dict[region], i, criterion=extracting_method,
+                                                   inconsistent_matrix=inconsistent_matrix)
                 n_clusters_list.append(max(clusters))
 
-                # counting clusters with 2+ and 3+ clusters
-                ua, uind = np.unique(clusters, return_inverse=True)
-                counted = np.bincount(uind)
-                #j = 0
-                nonsingleton = 0
-                multicluster = 0  # 3+
-                five_plus_clusters = 0 # 5+
-                for k in counted:
-                    if k > 1:
-                        nonsingleton += 1
-                    if k > 2:
-                        multicluster += 1
-                    if k > 4:
-                        five_plus_clusters += 1
-                n_nonsingleton_clusters.append(nonsingleton)
-                n_multiclusters.append(multicluster)
-                n_five_plus_clusters.append(five_plus_clusters)
+                # counting clusters with 2+, 3+ and 5+ variants
+                counted = np.bincount(clusters)
+                n_nonsingleton_clusters.append(np.count_nonzero(counted > 1))
+                n_multiclusters.append(np.count_nonzero(counted > 2))
+                n_five_plus_clusters.append(np.count_nonzero(counted > 4))
             sub_plot_dict[region] = plt.subplot(side, side, index, axisbg="#D6D6D6")
             #ax = plt.gca()
             #ax.set_xticks(np.arange(0.5, 2.2, 0.1))
@@ -777,16 +1039,29 @@ class CollectionVCF(Collection):
         plt.close()
 
     def filter_by_expression(self, expression):
-        filtered_records, filtered_out_records = self.filter_records_by_expression(expression)
+        predicate = compile_expression(expression, arguments=("record", "self"))
+        if self.streaming:
+            return self._get_substream(lambda record: predicate(record, self)), \
+                   self._get_substream(lambda record: not predicate(record, self))
+        # simple expressions on positions, qualities, chromosomes and references are calculated on columns
+        mask = None if callable(expression) else self.get_columns().get_mask(expression)
+        if mask is not None:
+            filtered_records = [record for record, passed in zip(self.records, mask) if passed]
+            filtered_out_records = [record for record, passed in zip(self.records, mask) if not passed]
+        else:
+            filtered_records, filtered_out_records = self.filter_records_by_expression(predicate)
         return CollectionVCF(metadata=self.metadata, record_list=filtered_records,
                                header=self.header, samples=self.samples, from_file=False), \
                CollectionVCF(metadata=self.metadata, record_list=filtered_out_records,
                                header=self.header, samples=self.samples, from_file=False)
 
     def add_info(self, metadata_line, expression, info_name, info_value=None):
+        self._check_not_streaming("add_info")
+        self.invalidate_columns()
         self.metadata.add_metadata(metadata_line)
+        predicate = compile_expression(expression, arguments=("record", "self"))
         for record in self:
-            if eval(expression):
+            if predicate(record, self):
                 value = info_value if isinstance(info_value, list) else [] if info_value is None else [info_value]
                 if info_name in record.info_dict:
                     record.info_dict[info_name] += value
@@ -835,13 +1110,15 @@ class CollectionVCF(Collection):
     def find_location(self, record_dict, key="Ftype", strand_key="Fstrand", genes_key="Genes", genes_strand_key="Gstrand",
                       feature_type_black_list=[],
                       use_synonym=False, synonym_dict=None, add_intergenic_label=True):
-
+        self._check_not_streaming("find_location")
         self.metadata.add_metadata("##INFO=<ID=%s,Number=.,Type=String,Description=\"Types of features\">" % key)
         self.metadata.add_metadata("##INFO=<ID=%s,Number=1,Type=String,Description=\"Strand of features\">" % strand_key)
         self.metadata.add_metadata("##INFO=<ID=%s,Number=.,Type=String,Description=\"Names of genes\">" % genes_key)
         self.metadata.add_metadata("##INFO=<ID=%s,Number=.,Type=String,Description=\"Strands of genes\">" % genes_strand_key)
+        # record_dict could be dictionary of SeqRecords or FeatureIndex(for example loaded by FeatureIndex.from_file)
+        feature_index = record_dict if isinstance(record_dict, FeatureIndex) else FeatureIndex(record_dict)
         for record in self:
-            record.find_location(record_dict, key=key, strand_key=strand_key,
+            record.find_location(feature_index, key=key, strand_key=strand_key,
                                  genes_key=genes_key, genes_strand_key=genes_strand_key,
                                  feature_type_black_list=feature_type_black_list,
                                  use_synonym=use_synonym, synonym_dict=synonym_dict,
@@ -850,14 +1127,20 @@ class CollectionVCF(Collection):
     def count_strandness(self, prefix):
         count_dict = OrderedDict({})
 
-        hor_coord_dict = {"C": 0, "G": 1}
         ver_coord_dict = {"N": 0, "P": 1, "M": 2, "B": 3}
-        for record in self:
-            if record.chrom not in count_dict:
-                count_dict[record.chrom] = np.zeros((2, 4), dtype=int)
-            count_dict[record.chrom][hor_coord_dict[record.ref]][ver_coord_dict[record.info_dict["Fstrand"][0]]] += 1
-
-        count_dict["all"] = sum(count_dict.values())
+        columns = self.get_columns()
+        # C -> 0, G -> 1
+        hor_coords = columns.ref_codes.astype(np.int64) - ColumnsVCF.ref_list.index("C")
+        if np.any((hor_coords != 0) & (hor_coords != 1)):
+            raise ValueError("Strandness could be counted only for variants with C or G as reference")
+        ver_coords = np.array([ver_coord_dict[record.info_dict["Fstrand"][0]] for record in self], dtype=np.int64)
+        n_chrom = len(columns.chrom_list)
+        counts = np.bincount(columns.chrom_codes.astype(np.int64) * 8 + hor_coords * 4 + ver_coords,
+                             minlength=n_chrom * 8).reshape(n_chrom, 2, 4)
+        for chrom_code, chrom in enumerate(columns.chrom_list):
+            count_dict[chrom] = counts[chrom_code]
+
+        count_dict["all"] = counts.sum(axis=0)
 
         for chromosome in count_dict:
             with open("%s_%s.t" % (prefix, chromosome), "w") as out_fd:
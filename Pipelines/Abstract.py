@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-#import os
+import os
 #import shutil
 #from collections import OrderedDict
 #from Tools.Filter import Cookiecutter, Trimmomatic, FaCut
@@ -16,3 +16,26 @@ from Routines.Fastq import FastQRoutines
 class Pipeline(Tool, MatplotlibRoutines, FastQRoutines):
     def __init__(self):
         Tool.__init__(self, cmd="")
+
+    @staticmethod
+    def check_stage_completion(marker_file, input_files, output_files):
+        # stage is complete if its marker file(created after successful finish of stage) and all output files exist
+        # and are not older than any of input files
+        checked_files = [marker_file] + list(output_files)
+        for filename in checked_files:
+            if not os.path.exists(filename):
+                return False
+        if not input_files:
+            return True
+        return min([os.path.getmtime(filename) for filename in checked_files]) >= \
+            max([os.path.getmtime(filename) for filename in input_files])
+
+    @staticmethod
+    def remove_stage_marker(marker_file):
+        if os.path.exists(marker_file):
+            os.remove(marker_file)
+
+    @staticmethod
+    def mark_stage_as_complete(marker_file):
+        with open(marker_file, "w"):
+            pass
@@ -3,7 +3,10 @@
 import os
 import shutil
 
+from functools import partial
+from itertools import izip
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 from Pipelines.Abstract import Pipeline
 
@@ -39,6 +42,226 @@ class FilteringPipeline(Pipeline):
         return (merged_raw_dir, filtered_dir, coockie_filtered_dir, coockie_trimmomatic_filtered_dir,
                 coockie_trimmomatic_quality_filtered_dir, final_filtered_dir, filtering_stat_dir)
 
+    @staticmethod
+    def replace_link(source, destination):
+        # hard link, existing destination(i.e. from previous run) is replaced
+        if os.path.lexists(destination):
+            os.remove(destination)
+        os.link(source, destination)
+
+    @staticmethod
+    def close_named_pipes(pipe_list, writer_list):
+        # opening of named pipes for reading releases writers blocked on opening of pipe
+        # (if tool failed before opening its input). Read ends are closed only after all writers opened pipes
+        # or finished, otherwise writer opening pipe later would block forever. After closing writers fail on
+        # next write(EPIPE)
+        fd_list = [os.open(pipe, os.O_RDONLY | os.O_NONBLOCK) for pipe in pipe_list if os.path.exists(pipe)]
+        try:
+            for writer in writer_list:
+                # waiting is done by short intervals because Event.wait without timeout
+                # could not be interrupted by Ctrl+C in python 2
+                while writer.is_alive() and not writer.output_opened.wait(1):
+                    pass
+        finally:
+            for fd in fd_list:
+                os.close(fd)
+
+    def run_filtering_stage(self, sample, stage_name, marker_file, stage_function, merging_function=None,
+                            named_pipes=()):
+        """
+        Runs stage_function(calling a tool and returning JobResult) and creates marker_file if tool finished
+        successfully, raises RuntimeError otherwise.
+        merging_function - function starting threads(StreamCopier or other threads with Popen-like wait and
+                           output_opened event) which fill named_pipes read by tool
+        """
+        self.remove_stage_marker(marker_file)
+        merging_processes = merging_function() if merging_function else []
+        try:
+            result = stage_function()
+        finally:
+            if merging_processes:
+                self.close_named_pipes(named_pipes, merging_processes)
+                for process in merging_processes:
+                    process.wait()
+
+        if result.status != "done":
+            raise RuntimeError("%s failed for sample %s(return code %s):\n\t%s" % (stage_name, sample,
+                                                                                    str(result.return_code),
+                                                                                    result.command))
+        for process in merging_processes:
+            if process.returncode != 0:
+                raise RuntimeError("Merging of raw reads failed for sample %s(return code %i)" % (sample,
+                                                                                                 process.returncode))
+        self.mark_stage_as_complete(marker_file)
+
+    def filter_sample(self, sample, samples_directory, directories, adapter_fragment_file, trimmomatic_adapter_file,
+                      mismatch_number=2, pe_reads_score=30, se_read_score=10,
+                      min_adapter_len=1, sliding_window_size=None,
+                      average_quality_threshold=15,
+                      leading_base_quality_threshold=None, trailing_base_quality_threshold=None,
+                      crop_length=None, head_crop_length=None, min_len=50,
+                      base_quality="phred33", read_name_type="illumina", skip_coockiecutter=False,
+                      resume=True, use_named_pipes=False):
+        """
+        Filters reads of single sample, returns OrderedDict with filtering statistics.
+        If resume is set stages completed in previous runs(see Pipeline.check_stage_completion) are skipped.
+        If use_named_pipes is set raw reads are merged to named pipes read directly by first filtering tool,
+        so merged reads are not written to disk.
+        """
+        merged_raw_dir, filtered_dir, coockie_filtered_dir, \
+            coockie_trimmomatic_filtered_dir, coockie_trimmomatic_quality_filtered_dir, \
+            final_filtered_dir, filtering_stat_dir = directories
+
+        print "Handling sample %s" % sample
+        sample_statistics = OrderedDict()
+        raw_files = self.make_lists_forward_and_reverse_files("%s/%s/" % (samples_directory, sample))
+        raw_files = raw_files[1] + raw_files[2]
+
+        merged_raw_sample_dir = "%s/%s/" % (merged_raw_dir, sample)
+        merged_forward_reads = "%s/%s_1.fq" % (merged_raw_sample_dir, sample)
+        merged_reverse_reads = "%s/%s_2.fq" % (merged_raw_sample_dir, sample)
+
+        coockie_filtered_sample_dir = "%s/%s/" % (coockie_filtered_dir, sample)
+        coockie_stats = "%s/%s.coockiecutter.stats" % (coockie_filtered_sample_dir, sample)
+
+        coockie_trimmomatic_filtered_sample_dir = "%s/%s/" % (coockie_trimmomatic_filtered_dir, sample)
+
+        coockie_trimmomatic_quality_filtered_sample_dir = "%s/%s/" % (coockie_trimmomatic_quality_filtered_dir, sample)
+        final_filtered_sample_dir = "%s/%s/" % (final_filtered_dir, sample)
+        filtering_stat_sample_dir = "%s/%s" % (filtering_stat_dir, sample)
+
+        if use_named_pipes:
+            # merging is started by first filtering stage, so completion of this stage is checked against raw reads
+            merging_function = partial(self.combine_fastq_files, samples_directory, sample, merged_raw_sample_dir,
+                                       use_links_if_merge_not_necessary=True, use_named_pipes=True)
+            merged_reads_source_files = raw_files
+        else:
+            merging_function = None
+            merged_reads_source_files = [merged_forward_reads, merged_reverse_reads]
+            merge_marker = "%s/%s.merge.done" % (merged_raw_sample_dir, sample)
+            if not (resume and self.check_stage_completion(merge_marker, raw_files, merged_reads_source_files)):
+                self.remove_stage_marker(merge_marker)
+                self.combine_fastq_files(samples_directory, sample, merged_raw_sample_dir,
+                                         use_links_if_merge_not_necessary=True)
+                self.mark_stage_as_complete(merge_marker)
+
+        if not skip_coockiecutter:
+            coockie_filtered_paired_forward_reads = "%s/%s_1.ok.fastq" % (coockie_filtered_sample_dir, sample)
+            coockie_filtered_paired_reverse_reads = "%s/%s_2.ok.fastq" % (coockie_filtered_sample_dir, sample)
+            coockie_marker = "%s/%s.coockiecutter.done" % (coockie_filtered_sample_dir, sample)
+
+            if not (resume and self.check_stage_completion(coockie_marker,
+                                                           merged_reads_source_files + [adapter_fragment_file],
+                                                           [coockie_stats, coockie_filtered_paired_forward_reads,
+                                                            coockie_filtered_paired_reverse_reads])):
+                self.run_filtering_stage(sample, "Coockiecutter", coockie_marker,
+                                         partial(Cookiecutter.rm_reads, adapter_fragment_file, merged_forward_reads,
+                                                 coockie_stats, right_reads=merged_reverse_reads,
+                                                 out_dir=coockie_filtered_sample_dir, use_dust_filter=False,
+                                                 dust_cutoff=None, dust_window_size=None, use_N_filter=False,
+                                                 read_length_cutoff=None, polyGC_length_cutoff=None),
+                                         merging_function=merging_function,
+                                         named_pipes=(merged_forward_reads, merged_reverse_reads))
+            else:
+                print "Coockiecutter was already finished for sample %s. Skipping..." % sample
+
+            coockiecutter_report = CoockiecutterReport(coockie_stats)
+
+            sample_statistics["raw_pairs"] = coockiecutter_report.input_pairs
+            sample_statistics["pairs_after_coockiecutter"] = coockiecutter_report.retained_pairs
+            sample_statistics["pairs_after_coockiecutter,%"] = float("%.2f" % (float(coockiecutter_report.retained_pairs)/float(coockiecutter_report.input_pairs)*100))
+
+            shutil.copy(coockie_stats, filtering_stat_sample_dir)
+
+        # se reads produced by Coockiecutter are ignored now!!
+
+        trimmomatic_output_prefix = "%s/%s" % (coockie_trimmomatic_filtered_sample_dir, sample)
+        trimmomatic_log = "%s.trimmomatic.log" % trimmomatic_output_prefix
+        trimmomatic_marker = "%s.trimmomatic.done" % trimmomatic_output_prefix
+
+        coockie_trimmomatic_filtered_paired_forward_reads = "%s/%s_1.pe.fq" % (coockie_trimmomatic_filtered_sample_dir, sample)
+        coockie_trimmomatic_filtered_paired_reverse_reads = "%s/%s_2.pe.fq" % (coockie_trimmomatic_filtered_sample_dir, sample)
+
+        trimmomatic_forward_reads = merged_forward_reads if skip_coockiecutter else coockie_filtered_paired_forward_reads
+        trimmomatic_reverse_reads = merged_reverse_reads if skip_coockiecutter else coockie_filtered_paired_reverse_reads
+        trimmomatic_input_files = merged_reads_source_files if skip_coockiecutter else [trimmomatic_forward_reads,
+                                                                                         trimmomatic_reverse_reads]
+        if not (resume and self.check_stage_completion(trimmomatic_marker,
+                                                       trimmomatic_input_files + ([trimmomatic_adapter_file]
+                                                                                  if trimmomatic_adapter_file else []),
+                                                       [trimmomatic_log,
+                                                        coockie_trimmomatic_filtered_paired_forward_reads,
+                                                        coockie_trimmomatic_filtered_paired_reverse_reads])):
+            self.run_filtering_stage(sample, "Trimmomatic", trimmomatic_marker,
+                                     partial(Trimmomatic.filter, trimmomatic_forward_reads,
+                                             trimmomatic_output_prefix, output_extension="fq",
+                                             right_reads=trimmomatic_reverse_reads,
+                                             adapters_file=trimmomatic_adapter_file,
+                                             mismatch_number=mismatch_number, pe_reads_score=pe_reads_score,
+                                             se_read_score=se_read_score,
+                                             min_adapter_len=min_adapter_len, sliding_window_size=sliding_window_size,
+                                             average_quality_threshold=average_quality_threshold,
+                                             leading_base_quality_threshold=leading_base_quality_threshold,
+                                             trailing_base_quality_threshold=trailing_base_quality_threshold,
+                                             crop_length=crop_length, head_crop_length=head_crop_length,
+                                             min_length=min_len, logfile=trimmomatic_log,
+                                             base_quality=base_quality),
+                                     merging_function=merging_function if skip_coockiecutter else None,
+                                     named_pipes=(merged_forward_reads, merged_reverse_reads))
+        else:
+            print "Trimmomatic was already finished for sample %s. Skipping..." % sample
+
+        trimmomatic_report = TrimmomaticReport(trimmomatic_log)
+        if skip_coockiecutter:
+            sample_statistics["raw_pairs"] = trimmomatic_report.stats["input"]
+        sample_statistics["pairs_after_trimmomatic"] = trimmomatic_report.stats["both_surviving"]
+        sample_statistics["pairs_after_trimmomatic,%"] = trimmomatic_report.stats["both_surviving,%"]
+
+        shutil.copy(trimmomatic_log, filtering_stat_sample_dir)
+
+        final_forward_reads = "%s/%s.final_1.fastq" % (final_filtered_sample_dir, sample)
+        final_reverse_reads = "%s/%s.final_2.fastq" % (final_filtered_sample_dir, sample)
+
+        if sliding_window_size is None:
+            facut_output_prefix = "%s/%s" % (coockie_trimmomatic_quality_filtered_sample_dir, sample)
+            facut_stat_file = "%s.facut.stat" % facut_output_prefix
+            facut_marker = "%s.facut.done" % facut_output_prefix
+            facut_filtered_forward_reads = "%s_1.pe.fq" % facut_output_prefix
+            facut_filtered_reverse_reads = "%s_2.pe.fq" % facut_output_prefix
+
+            if not (resume and self.check_stage_completion(facut_marker,
+                                                           [coockie_trimmomatic_filtered_paired_forward_reads,
+                                                            coockie_trimmomatic_filtered_paired_reverse_reads],
+                                                           [facut_stat_file, facut_filtered_forward_reads,
+                                                            facut_filtered_reverse_reads])):
+                self.run_filtering_stage(sample, "FaCut", facut_marker,
+                                         partial(FaCut.filter_by_mean_quality, average_quality_threshold,
+                                                 coockie_trimmomatic_filtered_paired_forward_reads,
+                                                 coockie_trimmomatic_filtered_paired_reverse_reads,
+                                                 facut_output_prefix, quality_type=base_quality,
+                                                 stat_file=facut_stat_file, name_type=read_name_type))
+            else:
+                print "FaCut was already finished for sample %s. Skipping..." % sample
+
+            facut_report = FaCutReport(facut_stat_file)
+
+            sample_statistics["pairs_after_facut"] = facut_report.retained_pairs
+            sample_statistics["pairs_after_facut,%"] = float("%.2f" % (float(facut_report.retained_pairs) / float(facut_report.input_pairs) * 100))
+            sample_statistics["retained_pairs_in_worst_tile,%"] = facut_report.minimum_retained_pairs_in_tiles_fraction * 100
+
+            sample_statistics["pairs_survived_after_filtration,%"] = float("%.2f" % (float(facut_report.retained_pairs) / sample_statistics["raw_pairs"] * 100))
+
+            shutil.copy(facut_stat_file, filtering_stat_sample_dir)
+            self.replace_link(facut_filtered_forward_reads, final_forward_reads)
+            self.replace_link(facut_filtered_reverse_reads, final_reverse_reads)
+
+        else:
+            self.replace_link(coockie_trimmomatic_filtered_paired_forward_reads, final_forward_reads)
+            self.replace_link(coockie_trimmomatic_filtered_paired_reverse_reads, final_reverse_reads)
+            sample_statistics["pairs_survived_after_filtration,%"] = float("%.2f" % (float(trimmomatic_report.stats["both_surviving"]) / sample_statistics["raw_pairs"] * 100))
+
+        return sample_statistics
+
     def filter(self, samples_directory, output_directory, adapter_fragment_file, trimmomatic_adapter_file,
                general_stat_file,
                samples_to_handle=None, threads=4, trimmomatic_dir="", coockiecutter_dir="", facut_dir="",
@@ -47,131 +270,69 @@ class FilteringPipeline(Pipeline):
                average_quality_threshold=15,
                leading_base_quality_threshold=None, trailing_base_quality_threshold=None,
                crop_length=None, head_crop_length=None, min_len=50,
-               base_quality="phred33", read_name_type="illumina", remove_intermediate_files=False, skip_coockiecutter=False):
-
+               base_quality="phred33", read_name_type="illumina", remove_intermediate_files=False, skip_coockiecutter=False,
+               samples_in_parallel=1, max_memory=None, trimmomatic_memory=None, resume=True, use_named_pipes=False):
+        """
+        threads - total number of threads, they are divided between samples handled in parallel
+                  (each Trimmomatic run gets threads / samples_in_parallel threads)
+        samples_in_parallel - number of samples handled simultaneously
+        max_memory, trimmomatic_memory - total memory and memory for single Trimmomatic run(in gigabytes),
+                                         if both are set number of simultaneously handled samples is limited
+                                         by max_memory / trimmomatic_memory
+        resume - skip stages finished in previous runs
+        use_named_pipes - don't write merged raw reads to disk, stream them to first filtering tool
+        """
         Cookiecutter.path = coockiecutter_dir
         Trimmomatic.jar_path = trimmomatic_dir
-        Trimmomatic.threads = threads
         FaCut.path = facut_dir
 
-        """
-        merged_raw_dir = "%s/merged/" % output_directory
-        filtered_dir = "%s/filtered/" % output_directory
-        coockie_filtered_dir = "%s/coockiecutter/" % filtered_dir
-        coockie_trimmomatic_filtered_dir = "%s/coockiecutter_trimmomatic/" % filtered_dir
-        coockie_trimmomatic_quality_filtered_dir = "%s/coockiecutter_trimmomatic_quality/" % filtered_dir
-        final_filtered_dir = "%s/final/" % filtered_dir
-        filtering_stat_dir = "%s/filtered_stat/" % output_directory
-        """
         sample_list = samples_to_handle if samples_to_handle else self.get_sample_list(samples_directory)
+        directories = self.prepare_filtering_directories(output_directory, sample_list)
         merged_raw_dir, filtered_dir, coockie_filtered_dir, \
-        coockie_trimmomatic_filtered_dir, coockie_trimmomatic_quality_filtered_dir, \
-        final_filtered_dir, filtering_stat_dir = self.prepare_filtering_directories(output_directory, sample_list)
+            coockie_trimmomatic_filtered_dir, coockie_trimmomatic_quality_filtered_dir, \
+            final_filtered_dir, filtering_stat_dir = directories
+
+        samples_in_parallel = max(1, min(samples_in_parallel, threads, len(sample_list)))
+        if trimmomatic_memory:
+            Trimmomatic.max_memory = "%ig" % trimmomatic_memory
+            if max_memory:
+                samples_in_parallel = max(1, min(samples_in_parallel, int(max_memory // trimmomatic_memory)))
+        Trimmomatic.threads = max(1, threads // samples_in_parallel)
+        print "Handling %i samples, %i in parallel, %i threads per Trimmomatic run" % (len(sample_list),
+                                                                                      samples_in_parallel,
+                                                                                      Trimmomatic.threads)
+
+        filter_function = partial(self.filter_sample, samples_directory=samples_directory, directories=directories,
+                                  adapter_fragment_file=adapter_fragment_file,
+                                  trimmomatic_adapter_file=trimmomatic_adapter_file,
+                                  mismatch_number=mismatch_number, pe_reads_score=pe_reads_score,
+                                  se_read_score=se_read_score, min_adapter_len=min_adapter_len,
+                                  sliding_window_size=sliding_window_size,
+                                  average_quality_threshold=average_quality_threshold,
+                                  leading_base_quality_threshold=leading_base_quality_threshold,
+                                  trailing_base_quality_threshold=trailing_base_quality_threshold,
+                                  crop_length=crop_length, head_crop_length=head_crop_length, min_len=min_len,
+                                  base_quality=base_quality, read_name_type=read_name_type,
+                                  skip_coockiecutter=skip_coockiecutter, resume=resume,
+                                  use_named_pipes=use_named_pipes)
 
         filtering_statistics = TwoLvlDict()
-
-        for sample in sample_list:
-            print "Handling sample %s" % sample
-            filtering_statistics[sample] = OrderedDict()
-            merged_raw_sample_dir = "%s/%s/" % (merged_raw_dir, sample)
-            merged_forward_reads = "%s/%s_1.fq" % (merged_raw_sample_dir, sample)
-            merged_reverse_reads = "%s/%s_2.fq" % (merged_raw_sample_dir, sample)
-
-            coockie_filtered_sample_dir = "%s/%s/" % (coockie_filtered_dir, sample)
-            coockie_stats = "%s/%s.coockiecutter.stats" % (coockie_filtered_sample_dir, sample)
-
-            coockie_trimmomatic_filtered_sample_dir = "%s/%s/" % (coockie_trimmomatic_filtered_dir, sample)
-
-            coockie_trimmomatic_quality_filtered_sample_dir = "%s/%s/" % (coockie_trimmomatic_quality_filtered_dir, sample)
-            final_filtered_sample_dir = "%s/%s/" % (final_filtered_dir, sample)
-            filtering_stat_sample_dir = "%s/%s" % (filtering_stat_dir, sample)
-
-            #"""
-
-            self.combine_fastq_files(samples_directory, sample, merged_raw_sample_dir, use_links_if_merge_not_necessary=True)
-
-            if not skip_coockiecutter:
-                Cookiecutter.rm_reads(adapter_fragment_file, merged_forward_reads, coockie_stats,
-                                      right_reads=merged_reverse_reads,
-                                      out_dir=coockie_filtered_sample_dir, use_dust_filter=False,
-                                      dust_cutoff=None, dust_window_size=None, use_N_filter=False,
-                                      read_length_cutoff=None, polyGC_length_cutoff=None)
-                #"""
-                coockiecutter_report = CoockiecutterReport(coockie_stats)
-
-                filtering_statistics[sample]["raw_pairs"] = coockiecutter_report.input_pairs
-                filtering_statistics[sample]["pairs_after_coockiecutter"] = coockiecutter_report.retained_pairs
-                filtering_statistics[sample]["pairs_after_coockiecutter,%"] = float("%.2f" % (float(coockiecutter_report.retained_pairs)/float(coockiecutter_report.input_pairs)*100))
-
-                os.system("cp %s %s" % (coockie_stats, filtering_stat_sample_dir))
-
-                coockie_filtered_paired_forward_reads = "%s/%s_1.ok.fastq" % (coockie_filtered_sample_dir, sample)
-                coockie_filtered_paired_reverse_reads = "%s/%s_2.ok.fastq" % (coockie_filtered_sample_dir, sample)
-
-            # se reads produced by Coockiecutter are ignored now!!
-
-            #coockie_trimmomatic_filtered_sample_dir = "%s/%s/" % (coockie_trimmomatic_filtered_dir, sample)
-            trimmomatic_output_prefix = "%s/%s" % (coockie_trimmomatic_filtered_sample_dir, sample)
-            trimmomatic_log = "%s.trimmomatic.log" % trimmomatic_output_prefix
-            #"""
-            Trimmomatic.filter(merged_forward_reads if skip_coockiecutter else coockie_filtered_paired_forward_reads,
-                               trimmomatic_output_prefix, output_extension="fq",
-                               right_reads=merged_reverse_reads if skip_coockiecutter else coockie_filtered_paired_reverse_reads,
-                               adapters_file=trimmomatic_adapter_file,
-                               mismatch_number=mismatch_number, pe_reads_score=pe_reads_score,
-                               se_read_score=se_read_score,
-                               min_adapter_len=min_adapter_len, sliding_window_size=sliding_window_size,
-                               average_quality_threshold=average_quality_threshold,
-                               leading_base_quality_threshold=leading_base_quality_threshold,
-                               trailing_base_quality_threshold=trailing_base_quality_threshold,
-                               crop_length=crop_length, head_crop_length=head_crop_length, min_length=min_len,
-                               logfile=trimmomatic_log,
-                               base_quality=base_quality)
-            #"""
-            trimmomatic_report = TrimmomaticReport(trimmomatic_log)
-            if skip_coockiecutter:
-                filtering_statistics[sample]["raw_pairs"] = trimmomatic_report.stats["input"]
-            filtering_statistics[sample]["pairs_after_trimmomatic"] = trimmomatic_report.stats["both_surviving"]
-            filtering_statistics[sample]["pairs_after_trimmomatic,%"] = trimmomatic_report.stats["both_surviving,%"]
-
-            os.system("cp %s %s" % (trimmomatic_log, filtering_stat_sample_dir))
-
-            coockie_trimmomatic_filtered_paired_forward_reads = "%s/%s_1.pe.fq" % (coockie_trimmomatic_filtered_sample_dir, sample)
-            coockie_trimmomatic_filtered_paired_reverse_reads = "%s/%s_2.pe.fq" % (coockie_trimmomatic_filtered_sample_dir, sample)
-
-            final_forward_reads = "%s/%s.final_1.fastq" % (final_filtered_sample_dir, sample)
-            final_reverse_reads = "%s/%s.final_2.fastq" % (final_filtered_sample_dir, sample)
-
-            if sliding_window_size is None:
-                facut_output_prefix = "%s/%s" % (coockie_trimmomatic_quality_filtered_sample_dir, sample)
-                facut_stat_file = "%s.facut.stat" % facut_output_prefix
-                #"""
-                FaCut.filter_by_mean_quality(average_quality_threshold,
-                                             coockie_trimmomatic_filtered_paired_forward_reads,
-                                             coockie_trimmomatic_filtered_paired_reverse_reads,
-                                             facut_output_prefix, quality_type=base_quality,
-                                             stat_file=facut_stat_file, name_type=read_name_type)
-                #"""
-                facut_report = FaCutReport(facut_stat_file)
-
-                filtering_statistics[sample]["pairs_after_facut"] = facut_report.retained_pairs
-                filtering_statistics[sample]["pairs_after_facut,%"] = float("%.2f" % (float(facut_report.retained_pairs) / float(facut_report.input_pairs) * 100))
-                filtering_statistics[sample]["retained_pairs_in_worst_tile,%"] = facut_report.minimum_retained_pairs_in_tiles_fraction * 100
-
-                filtering_statistics[sample]["pairs_survived_after_filtration,%"] = float("%.2f" % (float(facut_report.retained_pairs) / filtering_statistics[sample]["raw_pairs"] * 100))
-
-                facut_filtered_forward_reads = "%s_1.pe.fq" % facut_output_prefix
-                facut_filtered_reverse_reads = "%s_2.pe.fq" % facut_output_prefix
-                os.system("cp %s %s" % (facut_stat_file, filtering_stat_sample_dir))
-                os.system("ln %s %s" % (facut_filtered_forward_reads, final_forward_reads))
-                os.system("ln %s %s" % (facut_filtered_reverse_reads, final_reverse_reads))
-
-            else:
-                os.system("ln %s %s" % (coockie_trimmomatic_filtered_paired_forward_reads, final_forward_reads))
-                os.system("ln %s %s" % (coockie_trimmomatic_filtered_paired_reverse_reads, final_reverse_reads))
-                filtering_statistics[sample]["pairs_survived_after_filtration,%"] = float("%.2f" % (float(trimmomatic_report.stats["both_surviving"]) / filtering_statistics[sample]["raw_pairs"] * 100))
-
-            print filtering_statistics.table_form()
+        # samples are handled by threads, as all work is done by external tools
+        thread_pool = ThreadPool(samples_in_parallel) if samples_in_parallel > 1 else None
+        statistics_iterator = thread_pool.imap(filter_function, sample_list) if thread_pool \
+            else (filter_function(sample) for sample in sample_list)
+        try:
+            for sample, sample_statistics in izip(sample_list, statistics_iterator):
+                filtering_statistics[sample] = sample_statistics
+                print filtering_statistics.table_form()
+        except:
+            # samples waiting in queue are not started, already running ones are finished
+            if thread_pool:
+                thread_pool.terminate()
+            raise
+        if thread_pool:
+            thread_pool.close()
+            thread_pool.join()
 
         if remove_intermediate_files:
             shutil.rmtree(coockie_filtered_dir)
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 import os
+import sys
+from subprocess import Popen, PIPE
 from Tools.Samtools import SamtoolsV1
+from CustomCollections.HistogramCollections import InsertSizeHistogram
 
 from Pipelines.Abstract import Pipeline
 
@@ -31,11 +34,10 @@ class ScaffoldingPipeline(Pipeline):
         self.make_region_bed_file_from_file(genome, region_bed_file, min_len=min_contig_len_threshold,
                                             parsing_mode=parsing_mode, input_format=genome_format)
 
-        output_filtered_len_file = "%s.filtered.len" % output_pref
-        output_all_len_file = "%s.all.len" % output_pref
+        output_histo_file = "%s.insert_size.histo" % output_pref
         output_sam = "%s.sam" % output_pref
         output_bam = "%s.bam" % output_pref
-        aligner_log = "%s.aligner.log"
+        aligner_log = "%s.aligner.log" % output_pref
         forward_reads = forward_files if isinstance(forward_files, str) else ",".join(forward_files)
         reverse_reads = reverse_files if isinstance(reverse_files, str) else ",".join(reverse_files)
 
@@ -59,8 +61,6 @@ class ScaffoldingPipeline(Pipeline):
         bwa_string = "bwa %s" % bwa_options
 
         tee_string = "tee %s" % output_sam
-        samtools_string = "samtools view -L %s -" % region_bed_file
-        awk_string = "awk -F'\\t' '{ if ($9 > 0) print $9}'"
 
         if aligner == "bowtie2":
             aligner_string = bowtie2_string
@@ -71,18 +71,32 @@ class ScaffoldingPipeline(Pipeline):
 
         aligner_string = "%s%s" % (self.check_path(aligner_binary_dir), aligner_string)
 
-        final_string = "%s | %s | %s | %s > %s" % (aligner_string, tee_string, samtools_string,
-                                                   awk_string, output_filtered_len_file)
-
-        full_len_string = "%s %s > %s" % (awk_string, output_sam, output_all_len_file)
-
-        self.execute(cmd=final_string)
-        self.execute(cmd=full_len_string)
-
-        self.draw_histogram_from_file(output_filtered_len_file, output_pref,
+        final_string = "%s | %s" % (aligner_string, tee_string)
+
+        # insert sizes of pairs from all contigs and from contigs longer than threshold("selected") are binned
+        # in one pass over aligner output. As in former samtools view -L | awk pipeline all alignments with
+        # positive TLEN are counted(no filtration by flags), and as regions in bed file are whole contigs
+        # check of contig name is equal to selection of alignments by regions
+        with open(region_bed_file, "r") as in_fd:
+            long_contig_set = set(line.split("\t")[0] for line in in_fd)
+        histogram = InsertSizeHistogram(width_of_bin=1,
+                                        max_insert_size=max(xlimit_for_histo, min_contig_len_threshold),
+                                        selected_scaffolds=long_contig_set)
+        # pipefail is set to get non-zero return code if aligner fails, not only tee
+        sys.stdout.write("Executing:\n\t%s\n" % final_string)
+        aligner_process = Popen("set -o pipefail; %s" % final_string, shell=True, stdout=PIPE, executable="/bin/bash")
+        histogram.read_sam_stream(aligner_process.stdout, filter_flags=0)
+        aligner_process.stdout.close()
+        return_code = aligner_process.wait()
+        if return_code != 0:
+            raise RuntimeError("Alignment failed with return code %i:\n\t%s" % (return_code, final_string))
+        histogram.write(output_histo_file)
+
+        self.draw_histogram_with_logscaled(histogram.get_bin_starts(), output_pref,
                             max_length=xlimit_for_histo if xlimit_for_histo else min_contig_len_threshold,
                             number_of_bins=number_of_bins, xlabel="Insert size",
-                            ylabel="Number of fragments", title="Insert size distribution", extensions=("png", "svg"))
+                            ylabel="Number of fragments", title="Insert size distribution", extensions=("png", "svg"),
+                            weights=histogram.get_counts("selected"))
 
         SamtoolsV1.convert_sam_and_index(output_sam, output_bam)
 
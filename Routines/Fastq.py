@@ -16,7 +16,8 @@ from Bio.SeqFeature import SeqFeature, FeatureLocation
 
 from CustomCollections.GeneralCollections import TwoLvlDict, SynDict, IdList, IdSet
 from Routines.Functions import output_dict
-from Routines.File import FileRoutines
+from Parsers.Fastq import FastqBlockReader
+from Routines.File import FileRoutines, MergedInputStream, StreamCopier
 
 
 class FastQRoutines(FileRoutines):
@@ -40,9 +41,36 @@ class FastQRoutines(FileRoutines):
     def parse_illumina_name(string):
         name_list = string[1:].split(" ")
 
-    def remove_tiles_from_fastq(self, forward_reads, black_list_forward_tiles_list,
-                                reverse_reads, black_list_reverse_tiles_list, output_prefix):
+    @staticmethod
+    def get_tile_bins(block, newlines, black_list_forward_tiles, black_list_reverse_tiles, tile_bin_cache):
+        """
+        Returns uint8 array with bins of reads in block: 2 * (tile in forward black list) +
+        (tile in reverse black list). Tile is taken from 5th field of illumina read name.
+        Tiles are compared as integer codes if all of them are numeric, otherwise as strings,
+        tile_bin_cache - dict(tile code or string -> bin) shared between blocks.
+        """
+        tile_starts, tile_ends = FastqBlockReader.get_read_name_fields(block, newlines, 4)
+        tile_keys = FastqBlockReader.encode_numeric_fields(block, tile_starts, tile_ends)
+        if tile_keys is None:
+            tile_keys = np.array([block[start:end] for start, end in zip(tile_starts, tile_ends)])
+
+        unique_keys, inverse = np.unique(tile_keys, return_inverse=True)
+        unique_bins = np.zeros(len(unique_keys), dtype=np.uint8)
+        for index, key in enumerate(unique_keys.tolist()):
+            if key not in tile_bin_cache:
+                tile_bin_cache[key] = 2 * (key in black_list_forward_tiles) + (key in black_list_reverse_tiles)
+            unique_bins[index] = tile_bin_cache[key]
+        return unique_bins[inverse]
 
+    def remove_tiles_from_fastq(self, forward_reads, black_list_forward_tiles_list,
+                                reverse_reads, black_list_reverse_tiles_list, output_prefix,
+                                block_size=16777216):
+        """
+        Splits paired reads by tiles of forward reads. Reads are handled by blocks of block_size bytes:
+        tiles of all reads in block are extracted by numpy, and reads are written by runs of consecutive reads
+        with the same bin(reads from the same tile go one after another in illumina fastq files).
+        Input files could be compressed, decompression is done in background threads.
+        """
         filtered_paired_forward_pe = "%s.ok.pe_1.fastq" % output_prefix
         filtered_forward_se = "%s.ok.forward.se.fastq" % output_prefix
         filtered_out_forward_se = "%s.bad.forward.fastq" % output_prefix
@@ -51,8 +79,17 @@ class FastQRoutines(FileRoutines):
         filtered_reverse_se = "%s.ok.reverse.se.fastq" % output_prefix
         filtered_out_reverse_se = "%s.bad.reverse.fastq" % output_prefix
 
-        forward_input_fd = self.metaopen(forward_reads, "r")
-        reverse_input_fd = self.metaopen(reverse_reads, "r")
+        # numeric tiles are stored both as strings and as codes, so lookup works for both types of keys
+        black_list_forward_tiles = set(black_list_forward_tiles_list)
+        black_list_reverse_tiles = set(black_list_reverse_tiles_list)
+        for tile_set in black_list_forward_tiles, black_list_reverse_tiles:
+            tile_set |= set([FastqBlockReader.encode_numeric_string(tile) for tile in tile_set]) - set([None])
+        tile_bin_cache = {}
+
+        forward_input_fd = MergedInputStream(forward_reads, threads=1)
+        reverse_input_fd = MergedInputStream(reverse_reads, threads=1)
+        forward_reader = FastqBlockReader(forward_input_fd, block_size=block_size)
+        reverse_reader = FastqBlockReader(reverse_input_fd, block_size=block_size)
 
         filtered_paired_forward_pe_fd = self.metaopen(filtered_paired_forward_pe, "w")
         filtered_forward_se_fd = self.metaopen(filtered_forward_se, "w")
@@ -62,67 +99,98 @@ class FastQRoutines(FileRoutines):
         filtered_reverse_se_fd = self.metaopen(filtered_reverse_se, "w")
         filtered_out_reverse_se_fd = self.metaopen(filtered_out_reverse_se, "w")
 
-        for line in forward_input_fd:
-            name_list = line.strip()[1:].split(":")
-            #instrument_id = name_list[0]
-            #run_id = name_list[1]
-            #flowcell_id = name_list[2]
-            #lane_id = name_list[3]
-            tile_id = name_list[4]
-
-            if (tile_id in black_list_forward_tiles_list) and (tile_id in black_list_reverse_tiles_list):
-                filtered_out_forward_se_fd.write(line)
-                for i in range(0, 3):
-                    filtered_out_forward_se_fd.write(forward_input_fd.next())
-                for i in range(0, 4):
-                    filtered_out_reverse_se_fd.write(reverse_input_fd.next())
-
-            elif (tile_id in black_list_forward_tiles_list) and (not(tile_id in black_list_reverse_tiles_list)):
-                filtered_out_forward_se_fd.write(line)
-                for i in range(0, 3):
-                    filtered_out_forward_se_fd.write(forward_input_fd.next())
-                for i in range(0, 4):
-                    filtered_reverse_se_fd.write(reverse_input_fd.next())
-
-            elif (not (tile_id in black_list_forward_tiles_list)) and (tile_id in black_list_reverse_tiles_list):
-                filtered_forward_se_fd.write(line)
-                for i in range(0, 3):
-                    filtered_forward_se_fd.write(forward_input_fd.next())
-                for i in range(0, 4):
-                    filtered_out_reverse_se_fd.write(reverse_input_fd.next())
-
-            else:
-                filtered_paired_forward_pe_fd.write(line)
-                for i in range(0, 3):
-                    filtered_paired_forward_pe_fd.write(forward_input_fd.next())
-                for i in range(0, 4):
-                    filtered_paired_reverse_pe_fd.write(reverse_input_fd.next())
-
-        filtered_paired_forward_pe_fd.close()
-        filtered_forward_se_fd.close()
-        filtered_out_forward_se_fd.close()
-
-        filtered_paired_reverse_pe_fd.close()
-        filtered_reverse_se_fd.close()
-        filtered_out_reverse_se_fd.close()
+        forward_fd_list = [filtered_paired_forward_pe_fd, filtered_forward_se_fd, filtered_out_forward_se_fd]
+        reverse_fd_list = [filtered_paired_reverse_pe_fd, filtered_reverse_se_fd, filtered_out_reverse_se_fd]
+        # indexes of output files for bins 0(good tile), 1(bad tile for reverse read),
+        # 2(bad tile for forward read) and 3(bad tile for both reads)
+        forward_output_indexes = [0, 1, 2, 2]
+        reverse_output_indexes = [0, 2, 1, 2]
+
+        try:
+            while True:
+                forward_block, forward_newlines = forward_reader.read_block()
+                number_of_records = len(forward_newlines) // 4
+                reverse_block, reverse_newlines = reverse_reader.read_block(number_of_records if number_of_records
+                                                                            else 1)
+                if number_of_records == 0:
+                    if reverse_block:
+                        raise ValueError("Reverse reads file contains more reads than forward one")
+                    break
+                if len(reverse_newlines) // 4 < number_of_records:
+                    raise ValueError("Reverse reads file contains less reads than forward one")
+
+                bins = self.get_tile_bins(forward_block, forward_newlines, black_list_forward_tiles,
+                                          black_list_reverse_tiles, tile_bin_cache)
+                run_borders = np.concatenate(([0], np.flatnonzero(bins[1:] != bins[:-1]) + 1, [number_of_records]))
+                forward_record_starts = FastqBlockReader.get_record_starts(forward_newlines)
+                reverse_record_starts = FastqBlockReader.get_record_starts(reverse_newlines)
+
+                forward_output_lists = [[], [], []]
+                reverse_output_lists = [[], [], []]
+                for run_start, run_end in zip(run_borders[:-1], run_borders[1:]):
+                    forward_output_lists[forward_output_indexes[bins[run_start]]].append(
+                        forward_block[forward_record_starts[run_start]:forward_record_starts[run_end]])
+                    reverse_output_lists[reverse_output_indexes[bins[run_start]]].append(
+                        reverse_block[reverse_record_starts[run_start]:reverse_record_starts[run_end]])
+
+                for fd_list, output_lists in (forward_fd_list, forward_output_lists), \
+                                             (reverse_fd_list, reverse_output_lists):
+                    for fd, output_list in zip(fd_list, output_lists):
+                        if output_list:
+                            fd.write("".join(output_list))
+        finally:
+            forward_input_fd.close()
+            reverse_input_fd.close()
+
+            filtered_paired_forward_pe_fd.close()
+            filtered_forward_se_fd.close()
+            filtered_out_forward_se_fd.close()
+
+            filtered_paired_reverse_pe_fd.close()
+            filtered_reverse_se_fd.close()
+            filtered_out_reverse_se_fd.close()
+
+    def get_merged_read_streams(self, samples_directory, sample, threads=2):
+        """
+        Returns tuple of MergedInputStreams for forward and reverse reads of sample, each presenting all lanes
+        (plain, gzip or bzip2 files in any combination) as single stream. Streams could be read directly by python
+        code or copied to files or named pipes for external tools.
+        threads - number of lane files decompressed simultaneously per stream
+        """
+        sample_dir = "%s/%s/" % (samples_directory, sample)
+        filetypes, forward_files, reverse_files = self.make_lists_forward_and_reverse_files(sample_dir)
+        return MergedInputStream(forward_files, threads=threads), MergedInputStream(reverse_files, threads=threads)
 
     def combine_fastq_files(self, samples_directory, sample, output_directory,
-                            use_links_if_merge_not_necessary=True):
+                            use_links_if_merge_not_necessary=True, use_named_pipes=False, threads=2):
+        # if use_named_pipes is set merged files are named pipes filled by background threads,
+        # list of these threads(StreamCopier) is returned, they should be waited after pipes are read by next tool
         sample_dir = "%s/%s/" % (samples_directory, sample)
         filetypes, forward_files, reverse_files = self.make_lists_forward_and_reverse_files(sample_dir)
-        if len(filetypes) == 1:
-            if ("fq.gz" in filetypes) or ("fastq.gz" in filetypes):
-                command = "zcat"
-            elif ("fq.bz2" in filetypes) or ("fastq.bz2" in filetypes):
-                command = "bzcat"
-            else:
-                command = "cat"
-
-            if use_links_if_merge_not_necessary and (len(forward_files) == 1) and (len(reverse_files) == 1):
-                os.system("ln -s %s %s/%s_1.fq" % (forward_files[0], output_directory, sample))
-                os.system("ln -s %s %s/%s_2.fq" % (reverse_files[0], output_directory, sample))
-            else:
-                os.system("%s %s > %s/%s_1.fq" % (command, " ".join(forward_files), output_directory, sample))
-                os.system("%s %s > %s/%s_2.fq" % (command, " ".join(reverse_files), output_directory, sample))
-        else:
-            raise IOError("Extracting from mix of archives in not implemented yet")
+
+        output_files = ["%s/%s_1.fq" % (output_directory, sample), "%s/%s_2.fq" % (output_directory, sample)]
+        # files or links from previous runs are replaced
+        for output_file in output_files:
+            if os.path.lexists(output_file):
+                os.remove(output_file)
+
+        if use_links_if_merge_not_necessary and (filetypes == set(["fq"])) and (len(forward_files) == 1) \
+                and (len(reverse_files) == 1):
+            os.symlink(forward_files[0], output_files[0])
+            os.symlink(reverse_files[0], output_files[1])
+            return []
+
+        copier_list = []
+        for file_list, output_file in zip((forward_files, reverse_files), output_files):
+            if use_named_pipes:
+                os.mkfifo(output_file)
+            copier_list.append(StreamCopier(MergedInputStream(file_list, threads=threads), output_file))
+        for copier in copier_list:
+            copier.start()
+        if use_named_pipes:
+            return copier_list
+
+        for copier in copier_list:
+            if copier.wait() != 0:
+                raise IOError("Merging of %s failed: %s" % (copier.output_file, str(copier.error)))
+        return []
@@ -5,6 +5,11 @@ import os
 import sys
 import bz2
 import gzip
+import zlib
+import Queue
+import shutil
+import tempfile
+import threading
 from collections import Iterable, OrderedDict
 
 from CustomCollections.GeneralCollections import IdSet,  IdList
@@ -351,6 +356,279 @@ class FileRoutines:
             for entry in out_fd_dict:
                 out_fd_dict[entry].close()
 
+
+class ShardMerger(object):
+    # merges output files of parallel run(shards) into single file incrementally:
+    # shard is appended as soon as it and all previous shards are finished, so order of shards is kept,
+    # and then removed(if remove_shards is set). line_function(if set) is applied to each line of shard.
+    # shard_finished could be called from different threads(for example as callback of JobBatch)
+    # if output_file is None shards are merged to temporary file written to stdout after the last shard,
+    # so merged output is not interleaved with messages about running commands
+
+    def __init__(self, shard_file_list, output_file, line_function=None, remove_shards=True):
+        self.shard_file_list = shard_file_list
+        self.output_file = output_file
+        self.line_function = line_function
+        self.remove_shards = remove_shards
+        self.finished = [False] * len(shard_file_list)
+        self.next_shard = 0
+        self.lock = threading.Lock()
+        self.to_stdout = output_file is None
+        if self.to_stdout:
+            tmp_fd, self.output_file = tempfile.mkstemp(suffix=".merged")
+            os.close(tmp_fd)
+        else:
+            # output file is truncated
+            open(self.output_file, "w").close()
+
+    def _append_shard(self, shard_file):
+        with open(shard_file, "r") as in_fd:
+            with open(self.output_file, "a") as out_fd:
+                if self.line_function:
+                    for line in in_fd:
+                        out_fd.write(self.line_function(line))
+                else:
+                    shutil.copyfileobj(in_fd, out_fd)
+        if self.remove_shards:
+            os.remove(shard_file)
+
+    def shard_finished(self, shard_index):
+        with self.lock:
+            self.finished[shard_index] = True
+            while (self.next_shard < len(self.shard_file_list)) and self.finished[self.next_shard]:
+                self._append_shard(self.shard_file_list[self.next_shard])
+                self.next_shard += 1
+            if self.to_stdout and self.is_complete():
+                with open(self.output_file, "r") as in_fd:
+                    shutil.copyfileobj(in_fd, sys.stdout)
+                sys.stdout.flush()
+                os.remove(self.output_file)
+
+    def is_complete(self):
+        return self.next_shard == len(self.shard_file_list)
+
+
+class MergedInputStream(object):
+    """
+    Read-only file-like object presenting list of plain, gzip and bzip2 files(type is detected by extension,
+    mix of types is allowed) as single stream in order of list. Multi-member gzip and multi-stream bzip2 files
+    are supported. Files are decompressed in background threads(up to threads files simultaneously, zlib and bz2
+    release GIL), each thread keeps no more than max_buffered_blocks decompressed blocks in memory.
+    """
+    def __init__(self, file_list, threads=2, block_size=1048576, max_buffered_blocks=16):
+        self.file_list = [file_list] if isinstance(file_list, str) else list(file_list)
+        self.block_size = block_size
+        self.block_queues = [Queue.Queue(max_buffered_blocks) for filename in self.file_list]
+        self.file_index_queue = Queue.Queue()
+        for index in range(0, len(self.file_list)):
+            self.file_index_queue.put(index)
+        self.stop_event = threading.Event()
+
+        self.current_file = 0
+        self.buffer = ""
+        self.position = 0
+        self.closed = False
+
+        self.workers = [threading.Thread(target=self._decompression_worker)
+                        for i in range(0, max(1, min(threads, len(self.file_list))))]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    @staticmethod
+    def _get_decompressor(filename):
+        if filename[-3:] == ".gz":
+            # 16 + MAX_WBITS - gzip header and trailer are expected
+            return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif filename[-4:] == ".bz2":
+            return bz2.BZ2Decompressor
+        return None
+
+    @staticmethod
+    def _is_stream_finished(decompressor):
+        # after end of stream zlib decompressor moves extra input to unused_data and bz2 raises EOFError,
+        # otherwise extra byte is consumed as part of stream
+        try:
+            decompressor.decompress("\x00")
+        except EOFError:
+            return True
+        except zlib.error:
+            return False
+        return len(decompressor.unused_data) > 0
+
+    def _put(self, index, item):
+        # waits for free space in queue, but stops as soon as stream is closed
+        while not self.stop_event.is_set():
+            try:
+                self.block_queues[index].put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _decompress_file(self, index):
+        decompressor_class = self._get_decompressor(self.file_list[index])
+        decompressor = decompressor_class() if decompressor_class else None
+        with open(self.file_list[index], "rb") as in_fd:
+            # empty compressed files are treated as empty
+            empty_file = True
+            while True:
+                data = in_fd.read(self.block_size)
+                if not data:
+                    if (decompressor is not None) and (not empty_file) \
+                            and (not self._is_stream_finished(decompressor)):
+                        raise IOError("Unexpected end of compressed file")
+                    return
+                if decompressor is None:
+                    if not self._put(index, data):
+                        return
+                    continue
+                empty_file = False
+                # each member of gzip or stream of bzip2 file is handled by new decompressor
+                while data:
+                    try:
+                        decompressed = decompressor.decompress(data)
+                    except EOFError:
+                        # bz2 stream ended exactly on block boundary
+                        decompressor = decompressor_class()
+                        continue
+                    if decompressed and not self._put(index, decompressed):
+                        return
+                    data = decompressor.unused_data
+                    if data:
+                        if not data.strip("\x00"):
+                            # zero padding after last member
+                            return
+                        decompressor = decompressor_class()
+
+    def _decompression_worker(self):
+        while not self.stop_event.is_set():
+            try:
+                index = self.file_index_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._decompress_file(index)
+                # None marks end of file
+                self._put(index, None)
+            except Exception as exception:
+                self._put(index, exception)
+
+    def _next_block(self):
+        # returns next decompressed block, empty string at end of stream
+        while self.current_file < len(self.file_list):
+            block = self.block_queues[self.current_file].get()
+            if block is None:
+                self.current_file += 1
+            elif isinstance(block, Exception):
+                raise IOError("Error while reading %s: %s" % (self.file_list[self.current_file], str(block)))
+            else:
+                return block
+        return ""
+
+    def read(self, size=-1):
+        parts = [self.buffer[self.position:]]
+        length = len(parts[0])
+        while (size < 0) or (length < size):
+            block = self._next_block()
+            if not block:
+                break
+            parts.append(block)
+            length += len(block)
+        data = "".join(parts)
+        if (size < 0) or (length <= size):
+            self.buffer, self.position = "", 0
+            return data
+        self.buffer, self.position = data, size
+        return data[:size]
+
+    def readline(self):
+        end = self.buffer.find("\n", self.position)
+        if end >= 0:
+            line = self.buffer[self.position:end + 1]
+            self.position = end + 1
+            return line
+
+        parts = [self.buffer[self.position:]]
+        while True:
+            block = self._next_block()
+            if not block:
+                self.buffer, self.position = "", 0
+                return "".join(parts)
+            end = block.find("\n")
+            if end >= 0:
+                parts.append(block[:end + 1])
+                self.buffer, self.position = block, end + 1
+                return "".join(parts)
+            parts.append(block)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def copy_to(self, out_fd):
+        # writes rest of stream to out_fd block by block
+        out_fd.write(self.buffer[self.position:])
+        self.buffer, self.position = "", 0
+        while True:
+            block = self._next_block()
+            if not block:
+                return
+            out_fd.write(block)
+
+    def close(self):
+        self.closed = True
+        self.stop_event.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StreamCopier(threading.Thread):
+    """
+    Copies file-like object(i.e. MergedInputStream) to output file in background thread.
+    Output could be named pipe, in this case copying starts as soon as reader opens the pipe.
+    Has the same wait method and returncode attribute as subprocess.Popen, returncode is 1 if copying failed.
+    output_opened is set as soon as output file is opened(for named pipe it means that reader is present).
+    """
+    def __init__(self, in_fd, output_file):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.in_fd = in_fd
+        self.output_file = output_file
+        self.returncode = None
+        self.error = None
+        self.output_opened = threading.Event()
+
+    def run(self):
+        try:
+            with open(self.output_file, "wb") as out_fd:
+                self.output_opened.set()
+                if hasattr(self.in_fd, "copy_to"):
+                    self.in_fd.copy_to(out_fd)
+                else:
+                    shutil.copyfileobj(self.in_fd, out_fd)
+            self.returncode = 0
+        except Exception as exception:
+            # i.e. reader of named pipe was closed before end of stream
+            self.error = exception
+            self.returncode = 1
+        finally:
+            self.in_fd.close()
+
+    def wait(self):
+        self.join()
+        return self.returncode
+
+
 filetypes_dict = {"fasta": [".fa", ".fasta", ".fa", ".pep", ".cds"],
                   "fastq": [".fastq", ".fq"],
                   "genbank": [".gb", ".genbank"],
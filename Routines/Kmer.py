@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+from itertools import imap
+from multiprocessing import Pool
+
+import numpy as np
+
+from Routines.Sequence import SequenceRoutines
+
+
+class KmerRoutines(SequenceRoutines):
+    """
+    In-library k-mer counter for small data sets(mitochondrial and plastid genomes, amplicons), replacement for
+    jellyfish count + histo. Sequences are read as raw strings, k-mers are 2-bit encoded to uint64(so length of
+    k-mer is limited to 32) and counted by sorting. K-mers containing non-ACGT symbols are skipped.
+    """
+    max_kmer_length = 32
+
+    # A - 0, C - 1, G - 2, T - 3, other symbols - 4
+    nucleotide_code_table = np.full(256, 4, dtype=np.uint8)
+    nucleotide_code_table[np.frombuffer("ACGTacgt", dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+
+    def __init__(self):
+        SequenceRoutines.__init__(self)
+
+    @staticmethod
+    def raw_sequence_generator(file_list, format=None):
+        # yields sequences of fasta or fastq files as strings, if format is not set it is detected by first symbol
+        # of each file
+        for filename in [file_list] if isinstance(file_list, str) else file_list:
+            with SequenceRoutines.metaopen(filename, "r") as in_fd:
+                first_line = in_fd.readline()
+                if not first_line:
+                    continue
+                file_format = format if format else ("fasta" if first_line[0] == ">" else "fastq")
+                if file_format == "fastq":
+                    line = first_line
+                    while line:
+                        sequence = in_fd.readline()
+                        in_fd.readline()
+                        in_fd.readline()
+                        yield sequence.strip()
+                        line = in_fd.readline()
+                elif file_format == "fasta":
+                    sequence_parts = []
+                    for line in in_fd:
+                        if line[0] == ">":
+                            yield "".join(sequence_parts)
+                            sequence_parts = []
+                        else:
+                            sequence_parts.append(line.strip())
+                    yield "".join(sequence_parts)
+                else:
+                    raise ValueError("Unsupported format for k-mer counting: %s" % file_format)
+
+    def sequence_chunk_generator(self, file_list, format=None, chunk_size=10000000):
+        # yields lists of sequences with total length not less than chunk_size(except last one)
+        chunk = []
+        chunk_length = 0
+        for sequence in self.raw_sequence_generator(file_list, format=format):
+            chunk.append(sequence)
+            chunk_length += len(sequence)
+            if chunk_length >= chunk_size:
+                yield chunk
+                chunk = []
+                chunk_length = 0
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def encode_kmers(sequence_list, kmer_length, canonical=False):
+        """
+        Returns uint64 array with 2-bit encoded k-mers of all sequences in sequence_list,
+        if canonical is True k-mer or its reverse complement, whichever is smaller, is returned.
+        """
+        if (kmer_length < 1) or (kmer_length > KmerRoutines.max_kmer_length):
+            raise ValueError("Length of k-mer should be in range [1, %i]" % KmerRoutines.max_kmer_length)
+        # sequences are separated by newline, so k-mers spanning two sequences contain non-ACGT symbol
+        codes = KmerRoutines.nucleotide_code_table[np.frombuffer("\n".join(sequence_list), dtype=np.uint8)]
+        number_of_kmers = len(codes) - kmer_length + 1
+        if number_of_kmers <= 0:
+            return np.zeros(0, dtype=np.uint64)
+
+        bad_symbol_number = np.concatenate(([0], np.cumsum(codes == 4)))
+        valid_mask = bad_symbol_number[kmer_length:] == bad_symbol_number[:-kmer_length]
+        codes = (codes & 3).astype(np.uint64)
+
+        kmers = KmerRoutines.pack_codes(codes, kmer_length)
+        if canonical:
+            np.minimum(kmers, KmerRoutines.pack_codes(codes ^ np.uint64(3), kmer_length, reverse=True), out=kmers)
+
+        return kmers[valid_mask]
+
+    @staticmethod
+    def pack_codes(codes, kmer_length, reverse=False):
+        # i-th element of result - 2-bit codes of positions [i, i + kmer_length) packed to uint64,
+        # in reverse order if reverse is True. Packing is done by doubling of blocks, so only
+        # O(log(kmer_length)) passes over array are necessary
+        packed = None
+        packed_length = 0
+        block = codes
+        block_length = 1
+        remaining_length = kmer_length
+        while remaining_length:
+            if remaining_length & 1:
+                if packed is None:
+                    packed = block
+                else:
+                    size = len(codes) - packed_length - block_length + 1
+                    if reverse:
+                        packed = (block[packed_length:packed_length + size] << np.uint64(2 * packed_length)) | \
+                                 packed[:size]
+                    else:
+                        packed = (packed[:size] << np.uint64(2 * block_length)) | \
+                                 block[packed_length:packed_length + size]
+                packed_length += block_length
+            remaining_length >>= 1
+            if remaining_length:
+                size = len(codes) - 2 * block_length + 1
+                if reverse:
+                    block = (block[block_length:block_length + size] << np.uint64(2 * block_length)) | block[:size]
+                else:
+                    block = (block[:size] << np.uint64(2 * block_length)) | block[block_length:block_length + size]
+                block_length *= 2
+        return packed
+
+    @staticmethod
+    def count_encoded_kmers(sequence_list, kmer_length, canonical=False):
+        # returns tuple (sorted array of distinct encoded k-mers, array of their counts)
+        kmers, counts = np.unique(KmerRoutines.encode_kmers(sequence_list, kmer_length, canonical=canonical),
+                                  return_counts=True)
+        return kmers, counts.astype(np.int64)
+
+    @staticmethod
+    def merge_kmer_counts(kmers_a, counts_a, kmers_b, counts_b):
+        kmers, inverse = np.unique(np.concatenate((kmers_a, kmers_b)), return_inverse=True)
+        return kmers, np.bincount(inverse, weights=np.concatenate((counts_a, counts_b))).astype(np.int64)
+
+    def count_kmers(self, in_files, kmer_length=23, format=None, count_both_strands=False, threads=1,
+                    chunk_size=10000000):
+        """
+        Counts k-mers in fasta/fastq files(format is detected automatically if not set), files are read in
+        chunks of chunk_size nucleotides, chunks are processed by threads processes.
+        count_both_strands - count canonical k-mers(as jellyfish count -C).
+        Returns tuple (sorted array of distinct encoded k-mers, array of their counts).
+        """
+        arguments_generator = ((chunk, kmer_length, count_both_strands)
+                               for chunk in self.sequence_chunk_generator(in_files, format=format,
+                                                                          chunk_size=chunk_size))
+        process_pool = Pool(threads) if threads > 1 else None
+        results = process_pool.imap(count_kmers_in_chunk, arguments_generator) if process_pool \
+            else imap(count_kmers_in_chunk, arguments_generator)
+
+        kmers = np.zeros(0, dtype=np.uint64)
+        counts = np.zeros(0, dtype=np.int64)
+        for chunk_kmers, chunk_counts in results:
+            kmers, counts = self.merge_kmer_counts(kmers, counts, chunk_kmers, chunk_counts)
+
+        if process_pool:
+            process_pool.close()
+            process_pool.join()
+
+        return kmers, counts
+
+    @staticmethod
+    def decode_kmers(kmers, kmer_length):
+        # returns list of k-mer strings
+        codes = np.empty((len(kmers), kmer_length), dtype=np.uint8)
+        for position in range(0, kmer_length):
+            codes[:, position] = (kmers >> np.uint64(2 * (kmer_length - 1 - position))) & np.uint64(3)
+        letters = np.frombuffer("ACGT", dtype=np.uint8)[codes]
+        return [letters[index].tostring() for index in range(0, len(kmers))]
+
+    @staticmethod
+    def get_histogram(counts, lower_count=1, upper_count=100000000):
+        # returns tuple (multiplicities, numbers of distinct k-mers) for nonempty bins in the same way
+        # as jellyfish histo: k-mers with counts exceeding upper_count are counted in bin upper_count + 1
+        numbers = np.bincount(np.minimum(counts[counts >= lower_count], upper_count + 1))
+        multiplicities = np.flatnonzero(numbers)
+        return multiplicities, numbers[multiplicities]
+
+    def write_histogram(self, counts, output_file, lower_count=1, upper_count=100000000):
+        # output file has the same format as output of jellyfish histo
+        multiplicities, numbers = self.get_histogram(counts, lower_count=lower_count, upper_count=upper_count)
+        with open(output_file, "w") as out_fd:
+            for multiplicity, number in zip(multiplicities, numbers):
+                out_fd.write("%i %i\n" % (multiplicity, number))
+
+    def write_kmer_counts(self, kmers, counts, kmer_length, output_file, lower_count=None, upper_count=None,
+                          column_separator=" ", chunk_size=1000000):
+        # output file has the same format as output of jellyfish dump -c
+        mask = np.ones(len(counts), dtype=bool)
+        if lower_count is not None:
+            mask &= counts >= lower_count
+        if upper_count is not None:
+            mask &= counts <= upper_count
+        kmers, counts = kmers[mask], counts[mask]
+        with open(output_file, "w") as out_fd:
+            for start in range(0, len(kmers), chunk_size):
+                for kmer, count in zip(self.decode_kmers(kmers[start:start + chunk_size], kmer_length),
+                                       counts[start:start + chunk_size]):
+                    out_fd.write("%s%s%i\n" % (kmer, column_separator, count))
+
+    def get_histo(self, in_files, output_file, kmer_length=23, format=None, count_both_strands=False, threads=1,
+                  lower_count=1, upper_count=100000000, chunk_size=10000000):
+        # analog of jellyfish count + jellyfish histo
+        kmers, counts = self.count_kmers(in_files, kmer_length=kmer_length, format=format,
+                                         count_both_strands=count_both_strands, threads=threads,
+                                         chunk_size=chunk_size)
+        self.write_histogram(counts, output_file, lower_count=lower_count, upper_count=upper_count)
+        return kmers, counts
+
+
+def count_kmers_in_chunk(arguments):
+    # wrapper for multiprocessing.Pool, arguments - tuple (list of sequences, kmer length, count both strands)
+    sequence_list, kmer_length, canonical = arguments
+    return KmerRoutines.count_encoded_kmers(sequence_list, kmer_length, canonical=canonical)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import os
+import heapq
 from math import factorial
 from copy import deepcopy
 
@@ -24,12 +25,12 @@ class MathRoutines:
 
     @staticmethod
     def mean_from_bins(bins, counts):
-        return sum(np.multiply(bins, counts))/sum(counts)
+        return np.sum(np.multiply(bins, counts))/np.sum(counts)
 
     def variance_from_bins(self, bins, counts, mean=None):
         mean_value = mean if mean else self.mean_from_bins(bins, counts)
         deviation = bins - mean_value
-        variance = np.sum(np.multiply(np.power(deviation, 2), counts)) / sum(counts)
+        variance = np.sum(np.multiply(np.power(deviation, 2), counts)) / np.sum(counts)
         return variance
 
     def std_from_bins(self, bins, counts, mean=None):
@@ -95,6 +96,115 @@ class MathRoutines:
 
         return number_of_values, plateau_list
 
+    @staticmethod
+    def linkage_1d(positions, method="average"):
+        # fast analog of scipy.cluster.hierarchy.linkage for one-dimensional data, returns linkage matrix in scipy format
+        # works in O(n*log(n)) time and O(n) memory without distance matrix:
+        # in one dimension single, complete and average (UPGMA) linkage always merge neighbouring clusters
+        # (for average linkage distance between non overlapping clusters is equal to difference of their means),
+        # so only distances between neighbours have to be tracked
+        if method not in ("single", "complete", "average"):
+            raise ValueError("Method %s is not supported for one-dimensional linkage" % method)
+        points = np.asarray(positions, dtype=np.float64).ravel()
+        n = len(points)
+        linkage_matrix = np.zeros((max(n - 1, 0), 4), dtype=np.float64)
+        if n < 2:
+            return linkage_matrix
+        order = np.argsort(points, kind="mergesort")
+        sorted_points = points[order].tolist()
+
+        # python lists are used instead of numpy arrays as they are much faster for access to single elements
+        # all lists are indexed by index of first point of cluster in sorted_points
+        end = list(range(0, n))                       # index of last point of cluster
+        previous = list(range(-1, n - 1))             # start of cluster on the left
+        size = [1] * n
+        point_sum = list(sorted_points)
+        cluster_id = order.tolist()                   # id of cluster in linkage matrix, leaves are named as in input
+        version = [0] * n                             # incremented on each merge, -1 for clusters merged to the left
+        rows = []
+
+        if method == "single":
+            # distances between neighbouring clusters never change, so clusters are merged in order of gaps
+            start = list(range(0, n))                 # index of first point of cluster, indexed by its last point
+            for gap_index in np.argsort(np.diff(points[order]), kind="mergesort").tolist():
+                left = start[gap_index]
+                right = gap_index + 1
+                rows.append((min(cluster_id[left], cluster_id[right]), max(cluster_id[left], cluster_id[right]),
+                             sorted_points[right] - sorted_points[gap_index], size[left] + size[right]))
+                end[left] = end[right]
+                start[end[left]] = left
+                size[left] += size[right]
+                cluster_id[left] = n + len(rows) - 1
+            linkage_matrix[:] = rows
+            return linkage_matrix
+
+        heap = [(sorted_points[i + 1] - sorted_points[i], i, 0, 0) for i in range(0, n - 1)]
+        heapq.heapify(heap)
+        while len(rows) < n - 1:
+            dist, left, left_version, right_version = heapq.heappop(heap)
+            right = end[left] + 1
+            if version[left] != left_version or version[right] != right_version:
+                # outdated entry
+                continue
+            rows.append((min(cluster_id[left], cluster_id[right]), max(cluster_id[left], cluster_id[right]),
+                         dist, size[left] + size[right]))
+
+            end[left] = end[right]
+            size[left] += size[right]
+            point_sum[left] += point_sum[right]
+            cluster_id[left] = n + len(rows) - 1
+            version[left] += 1
+            version[right] = -1
+
+            for first, second in ((previous[left], left), (left, end[left] + 1)):
+                if first < 0 or second >= n:
+                    continue
+                previous[second] = first
+                if method == "complete":
+                    new_dist = sorted_points[end[second]] - sorted_points[first]
+                else:
+                    new_dist = point_sum[second] / size[second] - point_sum[first] / size[first]
+                heapq.heappush(heap, (new_dist, first, version[first], version[second]))
+
+        linkage_matrix[:] = rows
+        return linkage_matrix
+
+    @staticmethod
+    def guided_partition(cost_list, number_of_workers, min_bin_cost=None, keep_order=False):
+        # splits items with given costs to bins for parallel processing by number_of_workers workers,
+        # returns list of lists of item indexes.
+        # Each bin gets about remaining_cost / (2 * number_of_workers) (but not less than min_bin_cost,
+        # by default total_cost / (20 * number_of_workers)), so bins become smaller to the end and
+        # last small bins fill workers released by large ones if bins are dispatched from largest to smallest.
+        # By default items are taken in order of decreasing cost and bins are sorted by decreasing cost,
+        # if keep_order is set items are taken in input order and bins are consecutive ranges of items.
+        costs = np.asarray(cost_list, dtype=np.float64)
+        if len(costs) == 0:
+            return []
+        workers = max(int(number_of_workers), 1)
+        remaining_cost = costs.sum()
+        min_cost = min_bin_cost if min_bin_cost is not None else remaining_cost / (20.0 * workers)
+
+        bin_list = []
+        current_bin = []
+        current_cost = 0.0
+        target_cost = max(remaining_cost / (2.0 * workers), min_cost)
+        for index in (range(0, len(costs)) if keep_order else np.argsort(-costs, kind="mergesort")):
+            current_bin.append(index)
+            current_cost += costs[index]
+            if current_cost >= target_cost:
+                bin_list.append(current_bin)
+                remaining_cost -= current_cost
+                current_bin = []
+                current_cost = 0.0
+                target_cost = max(remaining_cost / (2.0 * workers), min_cost)
+        if current_bin:
+            bin_list.append(current_bin)
+        if not keep_order:
+            bin_list.sort(key=lambda item_bin: -costs[item_bin].sum())
+
+        return [map(int, item_bin) for item_bin in bin_list]
+
 
 class SmoothRoutines:
     def __init__(self):
@@ -225,7 +225,8 @@ class MatplotlibRoutines:
     @staticmethod
     def draw_histogram(data_array, output_prefix=None, number_of_bins=None, width_of_bins=None,
                        max_threshold=None, min_threshold=None, xlabel=None, ylabel=None,
-                       title=None, extensions=("png",), ylogbase=None, subplot=None, suptitle=None):
+                       title=None, extensions=("png",), ylogbase=None, subplot=None, suptitle=None, weights=None):
+        # weights - counts of values in data_array, allows drawing of already binned data
         if (number_of_bins is not None) and (width_of_bins is not None):
             raise AttributeError("Options -w/--width_of_bins and -b/--number_of_bins mustn't be set simultaneously")
 
@@ -234,6 +235,12 @@ class MatplotlibRoutines:
                 raise ValueError("Maximum threshold (%s) is lower than minimum threshold(%s)" % (str(max_threshold),
                                                                                                  str(min_threshold)))
 
+        if weights is not None:
+            data_array = np.asarray(data_array)
+            weights = np.asarray(weights)
+            nonempty = weights > 0
+            data_array, weights = data_array[nonempty], weights[nonempty]
+
         max_lenn = max(data_array)
         min_lenn = min(data_array)
 
@@ -241,7 +248,10 @@ class MatplotlibRoutines:
         min_len = min_threshold if (min_threshold is not None) and (min_lenn < min_threshold) else min_lenn
         filtered = []
 
-        if (max_len < max_lenn) and (min_len > min_lenn):
+        if weights is not None:
+            mask = (min_len <= data_array) & (data_array <= max_len)
+            filtered, weights = data_array[mask], weights[mask]
+        elif (max_len < max_lenn) and (min_len > min_lenn):
             for entry in data_array:
                 if min_len <= entry <= max_len:
                     filtered.append(entry)
@@ -269,7 +279,7 @@ class MatplotlibRoutines:
         else:
             bins = 30
 
-        n, bins, patches = plt.hist(filtered, bins=bins)
+        n, bins, patches = plt.hist(filtered, bins=bins, weights=weights)
 
         bin_centers = (bins + ((bins[1] - bins[0])/2))[:-1]
         #print bin_centers
@@ -302,7 +312,7 @@ class MatplotlibRoutines:
                                      figsize=(10, 10), number_of_bins_list=None, width_of_bins_list=None,
                                      max_threshold_list=None, min_threshold_list=None, xlabel_list=None, ylabel_list=None,
                                      title_list=None, ylogbase_list=None, label_list=None,
-                                     extensions=("png",), suptitle=None):
+                                     extensions=("png",), suptitle=None, weights_list=None):
         figure = plt.figure(1, figsize=figsize)
         if suptitle:
             plt.suptitle(suptitle)
@@ -330,7 +340,8 @@ class MatplotlibRoutines:
                                         width_of_bins=parameters[1], max_threshold=parameters[2],
                                         min_threshold=parameters[3], xlabel=parameters[4], ylabel=parameters[5],
                                         title=parameters[6], extensions=("png",), ylogbase=parameters[7], subplot=subplot,
-                                        suptitle=None)
+                                        suptitle=None,
+                                        weights=weights_list[dataset_index] if weights_list else None)
             if output_prefix:
                 output_histo_file = "%s.%s.%shisto" % (output_prefix,
                                                        dataset_index if parameters[8] is None else parameters[9],
@@ -381,7 +392,7 @@ class MatplotlibRoutines:
                                                  figsize=(10, 15), number_of_bins_list=None, width_of_bins_list=None,
                                                  max_threshold_list=None, min_threshold_list=None, xlabel=None, ylabel=None,
                                                  title_list=None, logbase=10, label_list=None,
-                                                 extensions=("png",), suptitle=None):
+                                                 extensions=("png",), suptitle=None, weights_list=None):
         subplot_tuple = (2, 3)
 
         none_list = [None, None, None, None, None, None]
@@ -399,6 +410,8 @@ class MatplotlibRoutines:
                                 min_threshold_list[0], min_threshold_list[1], min_threshold_list[2]] if min_threshold_list else none_list
         title_listtt = [title_list[0], title_list[1], title_list[2],
                         "%s, logscaled" % title_list[0], "%s, logscaled" % title_list[1], "%s, logscaled" % title_list[2]] if title_list else none_list
+        weights_listtt = [weights_list[0], weights_list[1], weights_list[2],
+                          weights_list[0], weights_list[1], weights_list[2]] if weights_list else None
 
         ylogbase_list = [None, None, None, logbase, logbase, logbase]
         xlabel_list = [None, None, None, xlabel, xlabel, xlabel]
@@ -409,7 +422,7 @@ class MatplotlibRoutines:
                                           max_threshold_list=max_threshold_listtt,
                                           min_threshold_list=min_threshold_listtt, xlabel_list=xlabel_list, ylabel_list=ylabel_list,
                                           title_list=title_listtt, ylogbase_list=ylogbase_list, label_list=None,
-                                          extensions=extensions, suptitle=suptitle)
+                                          extensions=extensions, suptitle=suptitle, weights_list=weights_listtt)
 
     def draw_tetra_histogram_with_two_logscaled_from_file(self, list_of_files,  output_prefix,
                                                           figsize=(10, 10), number_of_bins_list=None, width_of_bins_list=None,
@@ -444,6 +457,18 @@ class MatplotlibRoutines:
     def draw_histogram_from_file(input_file, output_prefix, number_of_bins=None, width_of_bins=None,
                                  separator="\n", max_length=None, min_length=1, xlabel=None, ylabel=None,
                                  title=None, extensions=("png",), logbase=10):
+        lengths = np.fromfile(input_file, sep=separator)
+
+        MatplotlibRoutines.draw_histogram_with_logscaled(lengths, output_prefix, number_of_bins=number_of_bins,
+                                                         width_of_bins=width_of_bins, max_length=max_length,
+                                                         min_length=min_length, xlabel=xlabel, ylabel=ylabel,
+                                                         title=title, extensions=extensions, logbase=logbase)
+
+    @staticmethod
+    def draw_histogram_with_logscaled(lengths, output_prefix, number_of_bins=None, width_of_bins=None,
+                                      max_length=None, min_length=1, xlabel=None, ylabel=None,
+                                      title=None, extensions=("png",), logbase=10, weights=None):
+        # weights - counts of lengths, allows drawing of already binned data(i.e. bin starts and counts)
         if (number_of_bins is not None) and (width_of_bins is not None):
             raise AttributeError("Options -w/--width_of_bins and -b/--number_of_bins mustn't be set simultaneously")
 
@@ -452,7 +477,11 @@ class MatplotlibRoutines:
         if max_length < 0:
             raise ValueError("Maximum length can't be negative")
 
-        lengths = np.fromfile(input_file, sep=separator)
+        if weights is not None:
+            lengths = np.asarray(lengths)
+            weights = np.asarray(weights)
+            nonempty = weights > 0
+            lengths, weights = lengths[nonempty], weights[nonempty]
 
         max_lenn = max(lengths)
         min_lenn = min(lengths)
@@ -461,7 +490,10 @@ class MatplotlibRoutines:
         min_len = min_length if min_lenn < min_length else min_lenn
         filtered = []
 
-        if (max_len < max_lenn) and (min_len > min_lenn):
+        if weights is not None:
+            mask = (min_len <= lengths) & (lengths <= max_len)
+            filtered, weights = lengths[mask], weights[mask]
+        elif (max_len < max_lenn) and (min_len > min_lenn):
             for entry in lengths:
                 if min_len <= entry <= max_len:
                     filtered.append(entry)
@@ -489,7 +521,7 @@ class MatplotlibRoutines:
         else:
             bins = 30
 
-        n, bins, patches = plt.hist(filtered, bins=bins)
+        n, bins, patches = plt.hist(filtered, bins=bins, weights=weights)
 
         bin_centers = (bins + ((bins[1] - bins[0])/2))[:-1]
         #print bin_centers
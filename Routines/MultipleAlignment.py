@@ -10,6 +10,7 @@ from Bio.Align import MultipleSeqAlignment
 
 #from Routines import SequenceRoutines
 from CustomCollections.GeneralCollections import SynDict
+from CustomCollections.AlignmentCollections import AlignmentMatrix
 from Routines.Sequence import SequenceRoutines
 
 
@@ -28,82 +29,57 @@ class MultipleAlignmentRoutines(SequenceRoutines):
         return number_of_sequences, length_of_alignment
 
     @staticmethod
-    def get_position_presence_matrix(alignment, gap_symbol="-", verbose=True):
+    def get_alignment_matrix(alignment):
+        # alignment - MultipleSeqAlignment or AlignmentMatrix
+        return alignment if isinstance(alignment, AlignmentMatrix) else AlignmentMatrix.from_alignment(alignment)
 
-        number_of_sequences = len(alignment)
-        alignment_length = len(alignment[0])
-        # converting alignment to numpy letter array stored by columns!
-        alignment_array = np.array([list(rec) for rec in alignment], np.character, order="F")
+    def get_position_presence_matrix(self, alignment, gap_symbol="-", verbose=True):
+        alignment_matrix = self.get_alignment_matrix(alignment)
 
         if verbose:
-            print "%i sequences in alignment" % number_of_sequences
-            print "%i columns in alignment" % alignment_length
+            print "%i sequences in alignment" % len(alignment_matrix)
+            print "%i columns in alignment" % alignment_matrix.get_alignment_length()
 
-        position_presence_array = np.array([[0 for letter in rec.seq] for rec in alignment], int, order="F")
-
-        for column in range(0, alignment_length):
-            column_list = alignment_array[:, column]
-            number_of_gaps = 0
-            for element in column_list:
-                if element == gap_symbol:
-                    number_of_gaps += 1
-            for row in range(0, number_of_sequences):
-                position_presence_array[row, column] = -number_of_gaps if alignment_array[row, column] == gap_symbol else number_of_sequences - number_of_gaps
-
-        #for row in range(0, number_of_sequences):
-        #    for column in range(0, alignment_length):
-        #print alignment_array[0, ]
-        #print alignment_array[:, 1]
-        #print alignment_array
-        #print position_presence_array
-        return position_presence_array
+        return alignment_matrix.get_position_presence_matrix(gap_symbol=gap_symbol)
 
     def get_position_presence_matrix_fom_file(self, alignment_file, output_file, format="fasta", gap_symbol="-",
                                               verbose=True):
 
-        alignment = AlignIO.read(alignment_file, format=format)
+        alignment_matrix = AlignmentMatrix.read(alignment_file, format=format)
 
-        position_matrix = self.get_position_presence_matrix(alignment, gap_symbol, verbose=verbose)
+        position_matrix = self.get_position_presence_matrix(alignment_matrix, gap_symbol, verbose=verbose)
         np.savetxt(output_file, position_matrix, fmt="%i", delimiter='\t')
         #print position_matrix
         return position_matrix
 
     def count_unique_positions_per_sequence(self, alignment, gap_symbol="-", verbose=True):
-        number_of_sequences = len(alignment)
-        alignment_length = len(alignment[0])
-        position_presence_matrix = self.get_position_presence_matrix(alignment, gap_symbol=gap_symbol, verbose=verbose)
-        unique_position_count_dict = {}
-
-        for row in range(0, number_of_sequences):
-            sequence_id = alignment[row].id
-            unique_positions = 0
-            for column in range(0, alignment_length):
-                if (position_presence_matrix[row, column] == 1) or (position_presence_matrix[row, column] == -1):
-                    unique_positions += 1
+        alignment_matrix = self.get_alignment_matrix(alignment)
+        if verbose:
+            print "%i sequences in alignment" % len(alignment_matrix)
+            print "%i columns in alignment" % alignment_matrix.get_alignment_length()
 
-            unique_position_count_dict[sequence_id] = unique_positions
+        unique_position_counts = alignment_matrix.count_unique_positions_per_sequence(gap_symbol=gap_symbol)
 
-        return unique_position_count_dict
+        return dict(zip(alignment_matrix.ids, map(int, unique_position_counts)))
 
     def count_unique_positions_per_sequence_from_file(self, alignment_file, output_prefix, format="fasta",
                                                       gap_symbol="-", return_mode="absolute", verbose=True):
 
-        alignment = AlignIO.read(alignment_file, format=format)
-        number_of_sequences = len(alignment)
-        alignment_length = len(alignment[0])
-        position_presence_matrix = self.get_position_presence_matrix(alignment, gap_symbol=gap_symbol, verbose=verbose)
+        alignment_matrix = AlignmentMatrix.read(alignment_file, format=format)
+        alignment_length = alignment_matrix.get_alignment_length()
         unique_position_count_dict = SynDict()
         unique_position_count_percent_dict = SynDict()
 
-        for row in range(0, number_of_sequences):
-            sequence_id = alignment[row].id
-            unique_positions = 0
-            for column in range(0, alignment_length):
-                if (position_presence_matrix[row, column] == 1) or (position_presence_matrix[row, column] == -1):
-                    unique_positions += 1
+        if verbose:
+            print "%i sequences in alignment" % len(alignment_matrix)
+            print "%i columns in alignment" % alignment_length
+
+        unique_position_counts = alignment_matrix.count_unique_positions_per_sequence(gap_symbol=gap_symbol)
+        gap_counts = alignment_matrix.count_symbol_per_sequence(gap_symbol)
 
-            unique_position_count_dict[sequence_id] = unique_positions
-            unique_position_count_percent_dict[sequence_id] = 100 *  float(unique_positions) / (alignment_length - str(alignment[row].seq).count(gap_symbol))
+        for sequence_id, unique_positions, gaps in zip(alignment_matrix.ids, unique_position_counts, gap_counts):
+            unique_position_count_dict[sequence_id] = int(unique_positions)
+            unique_position_count_percent_dict[sequence_id] = 100 * float(unique_positions) / (alignment_length - gaps)
 
         unique_position_count_dict.write("%s.absolute_counts" % output_prefix)
         unique_position_count_percent_dict.write("%s.percent_counts" % output_prefix)
@@ -135,6 +111,7 @@ class MultipleAlignmentRoutines(SequenceRoutines):
         return region_coordinates_list
 
     def remove_columns_with_gaps(self, alignment, maximum_number_of_gaps_in_column, gap_symbol="-", verbose=False):
+        # returns alignment of the same type as input(MultipleSeqAlignment or AlignmentMatrix)
         num_of_sequences, len_of_alignment = self.get_general_statistics(alignment, verbose=verbose)
         if maximum_number_of_gaps_in_column > num_of_sequences:
             raise ValueError("Allowed number of sequences with gap is bigger than number of sequences")
@@ -143,20 +120,18 @@ class MultipleAlignmentRoutines(SequenceRoutines):
                 print "Alignment was not filtered: allowed number of sequence with gaps is equal to number of sequences"
             return alignment
 
-        columns_without_gaps_list = []
-        for i in range(0, len_of_alignment):
-            if alignment[:, i].count(gap_symbol) <= maximum_number_of_gaps_in_column:
-                columns_without_gaps_list.append(i)
+        alignment_matrix = self.get_alignment_matrix(alignment)
+        filtered_alignment = alignment_matrix.get_columns(
+            alignment_matrix.get_column_mask_by_gaps(maximum_number_of_gaps_in_column, gap_symbol=gap_symbol))
 
-        region_to_retain = self.make_regions_from_columns_to_retain(columns_without_gaps_list)
-        filtered_alignment = alignment[:, region_to_retain[0][0]: region_to_retain[0][1]]
-        if len(region_to_retain) == 1:
-            return filtered_alignment
+        return filtered_alignment if isinstance(alignment, AlignmentMatrix) else filtered_alignment.to_alignment()
 
-        for start, end in region_to_retain[1:]:
-            filtered_alignment += alignment[:, start: end]
-
-        return filtered_alignment
+    def remove_columns_with_gaps_from_file(self, alignment_file, output_file, maximum_number_of_gaps_in_column,
+                                           gap_symbol="-", format="fasta", verbose=False):
+        alignment_matrix = AlignmentMatrix.read(alignment_file, format=format)
+        filtered_alignment = self.remove_columns_with_gaps(alignment_matrix, maximum_number_of_gaps_in_column,
+                                                           gap_symbol=gap_symbol, verbose=verbose)
+        filtered_alignment.write(output_file, format=format)
 
     @staticmethod
     def slice_fasta_alignment(alignment_file, output_file, start, end):
@@ -234,6 +209,8 @@ class MultipleAlignmentRoutines(SequenceRoutines):
 
     @staticmethod
     def merge_alignment(alignment_file_list, merged_alignment_file, coordinates_file, format="fasta"):
+        # returns merged MultipleSeqAlignment, list of alignment lengths and list of alignment coordinates
+        # merge_alignment_streaming keeps only one alignment in memory, but doesn't return merged alignment
         #print("Merging alignments...")
         alignment_list = []
         sequence_lengthes = []
@@ -270,53 +247,92 @@ class MultipleAlignmentRoutines(SequenceRoutines):
                 coord_fd.write("%i\t%i\t%i\n" % (coord_tuple[1] - coord_tuple[0] + 1, coord_tuple[0], coord_tuple[1]))
         return merged_alignment, sequence_lengthes, sequence_coordinates
 
+    @staticmethod
+    def merge_alignment_streaming(alignment_file_list, merged_alignment_file, coordinates_file, format="fasta",
+                                  gap_symbol="-", line_width=60):
+        # alignments are read one by one and their rows are appended to on-disk buffer
+        # <merged_alignment_file>.tmp, so only one alignment is kept in memory.
+        # taxa absent in some alignments are filled with gaps, taxa in merged alignment are sorted by id.
+        # format is a format of input alignments, merged alignment is always written in FASTA as in merge_alignment.
+        # for each taxon first description seen is kept in header of merged alignment.
+        # returns list of taxa ids, list of alignment lengths and list of alignment coordinates
+        buffer_file = "%s.tmp" % merged_alignment_file
+        # for each alignment - (offset in buffer, length, dict taxon id: row index)
+        block_list = []
+        description_dict = {}
+        sequence_lengthes = []
+        sequence_coordinates = []
+        offset = 0
+
+        with open(buffer_file, "wb") as buffer_fd, open(coordinates_file, "w") as coord_fd:
+            coord_fd.write("#length\tstart\tend\n")
+            for alignment_file in sorted(alignment_file_list):
+                alignment_matrix = AlignmentMatrix.read(alignment_file, format=format)
+                alignment_length = alignment_matrix.get_alignment_length()
+                row_dict = dict(zip(alignment_matrix.ids, range(0, len(alignment_matrix))))
+                if len(row_dict) < len(alignment_matrix):
+                    raise ValueError("Alignment %s contains repeated ids" % alignment_file)
+                for taxon, description in zip(alignment_matrix.ids,
+                                              alignment_matrix.descriptions or alignment_matrix.ids):
+                    if taxon not in description_dict:
+                        # description from FASTA header starts with id, other formats may have no id in it
+                        description_dict[taxon] = description if description and description.split()[0] == taxon \
+                            else taxon
+
+                buffer_fd.write(alignment_matrix.matrix.tostring())
+                block_list.append((offset, alignment_length, row_dict))
+                offset += alignment_matrix.matrix.size
+
+                start = sequence_coordinates[-1][1] + 1 if sequence_coordinates else 1
+                sequence_lengthes.append(alignment_length)
+                sequence_coordinates.append((start, start + alignment_length - 1))
+                coord_fd.write("%i\t%i\t%i\n" % (alignment_length, start, start + alignment_length - 1))
+
+        taxa_list = sorted(description_dict)
+        merged_length = sum(sequence_lengthes)
+        gap_code = ord(gap_symbol)
+        buffer_array = np.memmap(buffer_file, dtype=np.uint8, mode="r") if offset > 0 else np.zeros(0, dtype=np.uint8)
+
+        with open(merged_alignment_file, "w") as out_fd:
+            for taxon in taxa_list:
+                row = np.empty(merged_length, dtype=np.uint8)
+                row_start = 0
+                for block_offset, alignment_length, row_dict in block_list:
+                    if taxon in row_dict:
+                        row_offset = block_offset + row_dict[taxon] * alignment_length
+                        row[row_start:row_start + alignment_length] = buffer_array[row_offset:row_offset +
+                                                                                   alignment_length]
+                    else:
+                        row[row_start:row_start + alignment_length] = gap_code
+                    row_start += alignment_length
+                sequence = row.tostring()
+                out_fd.write(">%s\n" % description_dict[taxon])
+                for start in range(0, merged_length, line_width):
+                    out_fd.write("%s\n" % sequence[start:start + line_width])
+
+        del buffer_array
+        os.remove(buffer_file)
+
+        return taxa_list, sequence_lengthes, sequence_coordinates
+
     def extract_degenerate_sites_from_codon_alignment(self, alignment, genetic_code_table=1):
+        # returns alignment of the same type as input(MultipleSeqAlignment or AlignmentMatrix)
         degenerate_codon_set = self.get_degenerate_codon_set(genetic_code_table)
-        number_of_alignments = len(alignment)
-        alignment_length = len(alignment[0])
-        if alignment_length % 3 > 0:
-            raise(ValueError, "Length of alignment is not divisible by 3")
-        else:
-            number_of_codons = int(alignment_length / 3)
-        degenerate_columns = []
-        for i in range(0, number_of_codons):
-            position_strings = []
-            for j in range(0, 3):
-                position_strings.append(list(set(alignment[:, 3*i + j])))
-            if (len(position_strings[0]) > 1) or (len(position_strings[1]) > 1):
-                continue
-            ambigious_codon = position_strings[0][0] + position_strings[1][0] + "N"
-            """
-            if Seq(ambigious_codon).translate(table=genetic_code_table) == "X":
-                continue
-            else:
-                degenerate_columns.append(alignment[:, 3*i + 2])
-                #print(i*3 +3)
-            """
-            if ambigious_codon in degenerate_codon_set:
-                degenerate_columns.append(alignment[:, 3*i + 2])
-
-        number_of_degenerate_columns = len(degenerate_columns)
-        record_list = []
-        for i in range(0, number_of_alignments):
-            string = ""
-            for j in range(0, number_of_degenerate_columns):
-                string += degenerate_columns[j][i]
-            record = SeqRecord(seq=Seq(string), id=alignment[i].id)
-            record_list.append(record)
-
-        #print(number_of_alignments, alignment_length)
-        degenerate_alignment = MultipleSeqAlignment(record_list)
-
-        return degenerate_alignment
+        alignment_matrix = self.get_alignment_matrix(alignment)
+
+        degenerate_columns = alignment_matrix.get_degenerate_site_columns(degenerate_codon_set)
+        degenerate_alignment = AlignmentMatrix(alignment_matrix.matrix[:, degenerate_columns],
+                                               ids=alignment_matrix.ids)
+
+        return degenerate_alignment if isinstance(alignment, AlignmentMatrix) else degenerate_alignment.to_alignment()
 
     def extract_degenerate_sites_from_codon_alignment_from_file(self, alignment_file, output_alignment_file,
                                                                 genetic_code_table=1, format="fasta"):
-        alignment = AlignIO.read(alignment_file, format=format)
-        degenerate_alignment = self.extract_degenerate_sites_from_codon_alignment(alignment,
+        alignment_matrix = AlignmentMatrix.read(alignment_file, format=format)
+        degenerate_alignment = self.extract_degenerate_sites_from_codon_alignment(alignment_matrix,
                                                                                   genetic_code_table=genetic_code_table)
 
-        AlignIO.write([degenerate_alignment], output_alignment_file, format=format)
+        degenerate_alignment.write(output_alignment_file, format=format)
 
     @staticmethod
     def sequences_from_alignment_generator(alignments, gap_symbol="-"):
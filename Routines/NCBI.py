@@ -2,19 +2,26 @@
 import os
 import re
 import time
+import socket
+import urllib
+import urllib2
+import hashlib
+import threading
 import xmltodict
 
 from collections import Iterable
 
 import numpy as np
 
+from StringIO import StringIO
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from Bio import SeqIO, Entrez
 from Bio.SeqRecord import SeqRecord
 from Routines import FileRoutines
 from CustomCollections.GeneralCollections import IdList, SynDict, TwoLvlDict, IdSet
 
-from urllib2 import URLError
+from urllib2 import URLError, HTTPError
 
 
 class AssemblySummary(OrderedDict):
@@ -267,37 +274,282 @@ class AssemblySummaryList(list):
         return self.filter(expression)
 
 
+class EntrezClient(object):
+    """
+    Client for NCBI E-utilities efetch with bounded number of simultaneous requests, rate limit(NCBI allows
+    3 requests per second without api_key and 10 with it) and persistent local cache.
+    Records of genbank and fasta types are cached per (db, id, rettype, retmode), so downloading of partially
+    completed id lists is resumed from cache, responses of other types are cached per request.
+    base_url could be set to local server for testing.
+    """
+    record_split_rettypes = ("gb", "gp", "gbwithparts", "fasta")
+
+    def __init__(self, base_url="https://eutils.ncbi.nlm.nih.gov/entrez/eutils/", cache_dir=None,
+                 max_concurrent_requests=3, requests_per_second=None, email=None, api_key=None, tool="MAVR",
+                 number_of_retries=5, retry_delay=3, max_retry_delay=60, timeout=300, log_file=None):
+        self.base_url = base_url if base_url[-1] == "/" else base_url + "/"
+        self.cache_dir = cache_dir
+        self.max_concurrent_requests = max_concurrent_requests
+        self.requests_per_second = requests_per_second if requests_per_second else (10 if api_key else 3)
+        self.email = email
+        self.api_key = api_key
+        self.tool = tool
+        self.number_of_retries = number_of_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.timeout = timeout
+        self.log_file = log_file
+
+        self.rate_lock = threading.Lock()
+        self.next_request_time = 0
+        self.log_lock = threading.Lock()
+
+    def _wait_for_rate_limit(self):
+        # requests are started not more often than requests_per_second
+        with self.rate_lock:
+            now = time.time()
+            start_time = max(now, self.next_request_time)
+            self.next_request_time = start_time + 1.0 / self.requests_per_second
+        if start_time > now:
+            time.sleep(start_time - now)
+
+    def _log(self, string):
+        if self.log_file:
+            with self.log_lock:
+                with open(self.log_file, "a") as log_fd:
+                    log_fd.write(string + "\n")
+
+    def request(self, utility, parameters):
+        """
+        Sends POST request to utility(i.e. "efetch.fcgi") and returns text of response.
+        Connection errors, 429 and 5xx responses are retried number_of_retries times, delay before retry
+        is doubled after each attempt starting from retry_delay but is not greater than max_retry_delay,
+        IOError is raised if all attempts failed. Other HTTP errors(i.e. 400 for invalid ids) return empty string.
+        """
+        parameters = OrderedDict(parameters)
+        for parameter, value in ("tool", self.tool), ("email", self.email), ("api_key", self.api_key):
+            if value:
+                parameters[parameter] = value
+        url = self.base_url + utility
+        data = urllib.urlencode(parameters)
+        self._log("%s?%s" % (url, data))
+
+        for attempt in range(0, self.number_of_retries + 1):
+            if attempt > 0:
+                time.sleep(min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay))
+            self._wait_for_rate_limit()
+            try:
+                response = urllib2.urlopen(urllib2.Request(url, data), timeout=self.timeout)
+                try:
+                    return response.read()
+                finally:
+                    response.close()
+            except HTTPError as error:
+                if (error.code != 429) and (error.code < 500):
+                    self._log("HTTP error %i for %s?%s" % (error.code, url, data))
+                    return ""
+                last_error = error
+            except (URLError, socket.error) as error:
+                last_error = error
+            self._log("Attempt %i failed(%s) for %s?%s" % (attempt + 1, str(last_error), url, data))
+        raise IOError("Request to %s failed after %i attempts: %s" % (url, self.number_of_retries + 1,
+                                                                     str(last_error)))
+
+    def get_cache_file(self, key):
+        # key - tuple of strings, file name is sha1 of key
+        key_hash = hashlib.sha1("\t".join(key)).hexdigest()
+        return "%s/%s/%s" % (self.cache_dir, key_hash[:2], key_hash)
+
+    def read_from_cache(self, key):
+        if not self.cache_dir:
+            return None
+        cache_file = self.get_cache_file(key)
+        if not os.path.exists(cache_file):
+            return None
+        with open(cache_file, "r") as cache_fd:
+            return cache_fd.read()
+
+    def write_to_cache(self, key, text):
+        # file is renamed after writing, so interrupted writes don't leave partial records in cache
+        if not self.cache_dir:
+            return
+        cache_file = self.get_cache_file(key)
+        directory = os.path.dirname(cache_file)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by other thread
+                pass
+        tmp_file = "%s.%i.%i.tmp" % (cache_file, os.getpid(), threading.current_thread().ident)
+        with open(tmp_file, "w") as tmp_fd:
+            tmp_fd.write(text)
+        os.rename(tmp_file, cache_file)
+
+    @staticmethod
+    def split_records(text, rettype):
+        # returns list of tuples (list of ids of record, text of record) for genbank or fasta text
+        record_list = []
+        if rettype == "fasta":
+            for record in text.split("\n>"):
+                record = record.strip()
+                if not record:
+                    continue
+                record = (record if record[0] == ">" else ">" + record) + "\n"
+                # ids like gi|568815597|ref|NP_001305.2| are split to all parts, accession goes first
+                record_list.append((record[1:].split(None, 1)[0].strip("|").split("|")[::-1], record))
+            return record_list
+
+        record_lines = []
+        accessions = []
+        versions = []
+        for line in StringIO(text):
+            if (not record_lines) and (not line.strip()):
+                continue
+            record_lines.append(line)
+            if line[:9] == "ACCESSION":
+                accessions = line[12:].split()[:1]
+            elif line[:7] == "VERSION":
+                # i.e. VERSION     AAB12345.1  GI:1234567
+                versions = [entry[3:] if entry[:3] == "GI:" else entry for entry in line[12:].split()]
+            elif line[:2] == "//":
+                # version goes first as it is used as id by Biopython
+                record_list.append((versions + accessions, "".join(record_lines)))
+                record_lines = []
+                accessions = []
+                versions = []
+        return record_list
+
+    def get_record_key(self, db, id, rettype, retmode):
+        return db, id, str(rettype), str(retmode)
+
+    def fetch_chunk(self, db, id_list, rettype=None, retmode="text", **parameters):
+        """
+        Returns OrderedDict(id -> text of record) for ids from id_list, cached records are not downloaded.
+        Ids absent in response are absent in dict. Records which ids don't match requested ids(i.e. GI was
+        requested, but record has no GI) are stored under their own first id.
+        """
+        records = OrderedDict()
+        split_records = (rettype in self.record_split_rettypes) and (not parameters)
+        if not split_records:
+            # whole response is cached as single entry
+            key = ("request", db, ",".join(id_list), str(rettype), str(retmode)) + \
+                tuple(["%s=%s" % (parameter, str(parameters[parameter])) for parameter in sorted(parameters)])
+            text = self.read_from_cache(key)
+            if text is None:
+                text = self.efetch(db, id_list, rettype=rettype, retmode=retmode, **parameters)
+                if text:
+                    self.write_to_cache(key, text)
+            records[",".join(id_list)] = text
+            return records
+
+        ids_to_download = []
+        for record_id in id_list:
+            text = self.read_from_cache(self.get_record_key(db, record_id, rettype, retmode))
+            if text is None:
+                ids_to_download.append(record_id)
+            else:
+                records[record_id] = text
+        if not ids_to_download:
+            return records
+
+        requested_ids = set(ids_to_download)
+        # accessions without versions are matched too
+        requested_accessions = dict([(record_id.split(".")[0], record_id) for record_id in ids_to_download])
+        downloaded_records = {}
+        for record_ids, text in self.split_records(self.efetch(db, ids_to_download, rettype=rettype,
+                                                               retmode=retmode), rettype):
+            matched_ids = [record_id for record_id in record_ids if record_id in requested_ids]
+            if not matched_ids:
+                matched_ids = [requested_accessions[record_id.split(".")[0]] for record_id in record_ids
+                               if record_id.split(".")[0] in requested_accessions][:1]
+            if not matched_ids:
+                matched_ids = record_ids[:1]
+            for record_id in matched_ids:
+                downloaded_records[record_id] = text
+                self.write_to_cache(self.get_record_key(db, record_id, rettype, retmode), text)
+
+        # records are returned in order of id_list
+        ordered_records = OrderedDict()
+        for record_id in id_list:
+            if record_id in records:
+                ordered_records[record_id] = records[record_id]
+            elif record_id in downloaded_records:
+                ordered_records[record_id] = downloaded_records.pop(record_id)
+        for record_id in downloaded_records:
+            ordered_records[record_id] = downloaded_records[record_id]
+        return ordered_records
+
+    def efetch(self, db, id_list, rettype=None, retmode="text", **parameters):
+        # single efetch request without cache, returns text of response
+        request_parameters = OrderedDict([("db", db),
+                                          ("id", id_list if isinstance(id_list, str) else ",".join(id_list))])
+        if rettype:
+            request_parameters["rettype"] = rettype
+        if retmode:
+            request_parameters["retmode"] = retmode
+        for parameter in parameters:
+            if parameters[parameter] is not None:
+                request_parameters[parameter] = parameters[parameter]
+        return self.request("efetch.fcgi", request_parameters)
+
+    def fetch_records(self, db, id_list, rettype=None, retmode="text", chunk_size=100, **parameters):
+        """
+        Generator of tuples (id, text of record) for ids from id_list, ids are downloaded by chunks of chunk_size,
+        up to max_concurrent_requests chunks simultaneously. Records are yielded in order of chunks as soon as
+        chunk is downloaded, so they could be parsed while next chunks are downloaded.
+        """
+        id_list = [id_list] if isinstance(id_list, str) else list(id_list)
+        parameters = dict([(parameter, parameters[parameter]) for parameter in parameters
+                           if parameters[parameter] is not None])
+
+        def fetch_chunk(chunk):
+            return self.fetch_chunk(db, chunk, rettype=rettype, retmode=retmode, **parameters)
+
+        chunk_list = [id_list[start:start + chunk_size] for start in range(0, len(id_list), chunk_size)]
+        thread_pool = ThreadPool(self.max_concurrent_requests) if (self.max_concurrent_requests > 1) and \
+            (len(chunk_list) > 1) else None
+        results = thread_pool.imap(fetch_chunk, chunk_list) if thread_pool else (fetch_chunk(chunk)
+                                                                                for chunk in chunk_list)
+        try:
+            for records in results:
+                for record_id in records:
+                    yield record_id, records[record_id]
+        finally:
+            if thread_pool:
+                thread_pool.terminate()
+                thread_pool.join()
+
+    def fetch(self, db, id_list, out_file, rettype=None, retmode="text", chunk_size=100, **parameters):
+        # writes records to out_file and returns IdList of fetched ids
+        fetched_ids = IdList()
+        with open(out_file, "w") as out_fd:
+            for record_id, text in self.fetch_records(db, id_list, rettype=rettype, retmode=retmode,
+                                                      chunk_size=chunk_size, **parameters):
+                out_fd.write(text)
+                fetched_ids.append(record_id)
+        return fetched_ids
+
+
 class NCBIRoutines(FileRoutines):
     def __init__(self):
         FileRoutines.__init__(self)
 
     @staticmethod
     def efetch(database, id_list, out_file, retmode=None, rettype=None, seq_start=None, seq_stop=None, strand=None, verbose=False,
-               number_of_retries=100, retry_delay=None, log_file="efetch.log"):
+               number_of_retries=5, retry_delay=None, log_file="efetch.log", cache_dir=None, email=None,
+               api_key=None):
         # replacement for Biopython Entrez.efetch
         # Biopython Entrez.efetch is bugged - it ignores seq_start and seq_stop values
         # eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nuccore&id=669632474&retmode=text&rettype=gb&seq_start=10832751&seq_stop=10848091&strand=1
-        query = "eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?"
-        query += "db=%s" % database
-        query += "&id=%s" % (id_list if isinstance(id_list, str) else ",".join(id_list))
-        query += "&retmode=%s" % retmode if retmode else ""
-        query += "&rettype=%s" % rettype if rettype else ""
-
-        query += "&seq_start=%s" % str(seq_start) if seq_start else ""
-        query += "&seq_stop=%s" % str(seq_stop) if seq_stop else ""
-        query += "&strand=%s" % str(strand) if strand else ""
-
-        curl_options = " --retry %i" % number_of_retries if number_of_retries else ""
-        curl_options += " --retry-delay %i" % retry_delay if retry_delay else ""
-        curl_options += " '%s'" % query
-        curl_options += " > %s" % out_file
-
-        curl_string = "curl %s" % curl_options
-        with open(log_file, "a") as log_fd:
-            log_fd.write(curl_string + "\n")
         if verbose:
-            print curl_string
-        os.system(curl_string)
+            print "Fetching %s from %s" % (id_list if isinstance(id_list, str) else ",".join(id_list), database)
+        id_list = [id_list] if isinstance(id_list, str) else list(id_list)
+        client = EntrezClient(cache_dir=cache_dir, email=email, api_key=api_key, number_of_retries=number_of_retries,
+                              retry_delay=retry_delay if retry_delay else 3, log_file=log_file)
+        # all ids are fetched by single request as before
+        return client.fetch(database, id_list, out_file, rettype=rettype, retmode=retmode,
+                            chunk_size=max(1, len(id_list)), seq_start=seq_start, seq_stop=seq_stop, strand=strand)
 
     def get_gene_sequences(self, email, query, retmax=100000, output_directory=None):
         if output_directory:
@@ -334,32 +586,59 @@ class NCBIRoutines(FileRoutines):
                         strand=strand)
             time.sleep(0.4)
 
-    def get_cds_for_proteins(self, protein_id_list, output_prefix, download_chunk_size=100, temp_dir_prefix="temp"):
-
+    def get_cds_for_proteins(self, protein_id_list, output_prefix, download_chunk_size=100, cache_dir="entrez_cache",
+                             max_concurrent_requests=3, email=None, api_key=None, entrez_client=None):
+        """
+        Downloads genbank records of proteins and corresponding transcripts and extracts CDS from transcripts.
+        Records are parsed while they are downloaded(up to max_concurrent_requests chunks simultaneously),
+        downloaded records are kept in cache_dir, so interrupted run is resumed without repeated downloads.
+        entrez_client - EntrezClient to use instead of default one(i.e. with other base_url)
+        """
         from Tools.Abstract import Tool
 
-        transcript_temp_dir = "%s_transcripts" % temp_dir_prefix
-        protein_temp_dir = "%s_proteins" % temp_dir_prefix
+        client = entrez_client if entrez_client else EntrezClient(cache_dir=cache_dir,
+                                                                  max_concurrent_requests=max_concurrent_requests,
+                                                                  email=email, api_key=api_key,
+                                                                  log_file="%s.efetch.log" % output_prefix)
         number_of_ids = len(protein_id_list)
         print "Total %i ids" % number_of_ids
 
-        for directory in transcript_temp_dir, protein_temp_dir:
-            self.save_mkdir(directory)
         pep_file = "%s.pep.genbank" % output_prefix
         transcript_file = "%s.trascript.genbank" % output_prefix
 
-        ranges = np.append(np.arange(0, number_of_ids, download_chunk_size), [number_of_ids])
-
-        print "Downloading proteins..."
-        for i in range(0, len(ranges)-1):
-            print "Downloading chunk %i" % i
-            pep_tmp_file = "%s/%s_%i" % (protein_temp_dir, pep_file, i)
-            self.efetch("protein", protein_id_list[ranges[i]:ranges[i+1]], pep_tmp_file, rettype="gb", retmode="text")
-
-        os.system("cat %s/* > %s" % (protein_temp_dir, pep_file))
-
-        peptide_dict = SeqIO.index_db("tmp.idx", pep_file, format="genbank")
-        downloaded_protein_ids = IdList(peptide_dict.keys())
+        downloaded_protein_ids = IdList()
+        pep_without_transcripts = IdList()
+        pep_with_several_CDS_features = IdList()
+        pep_to_transcript_accordance = SynDict()
+        transcript_ids = IdList()
+        transcript_id_set = set()
+
+        print "Downloading proteins and extracting transcript ids corresponding to them..."
+        with open(pep_file, "w") as pep_fd:
+            for requested_id, record_text in client.fetch_records("protein", protein_id_list, rettype="gb",
+                                                                  retmode="text", chunk_size=download_chunk_size):
+                pep_fd.write(record_text)
+                record = SeqIO.read(StringIO(record_text), format="genbank")
+                pep_id = record.id
+                downloaded_protein_ids.append(pep_id)
+                for feature in record.features:
+                    if feature.type == "CDS":
+                        try:
+                            transcript_id = feature.qualifiers["coded_by"][0].split(":")[0]
+                            if pep_id not in pep_to_transcript_accordance:
+                                pep_to_transcript_accordance[pep_id] = [transcript_id]
+                            else:
+                                pep_to_transcript_accordance[pep_id].append(transcript_id)
+                                print("Genbank record for %s contains several CDS features" % pep_id)
+                                pep_with_several_CDS_features.append(pep_id)
+                            if transcript_id in transcript_id_set:
+                                print "Repeated transcript id: %s" % transcript_id
+                                continue
+                            transcript_ids.append(transcript_id)
+                            transcript_id_set.add(transcript_id)
+                        except:
+                            print "Transcript id for %s was not found" % pep_id
+                            pep_without_transcripts.append(pep_id)
 
         print "%i proteins were downloaded" % len(downloaded_protein_ids)
         not_downloaded_proteins_ids = Tool.intersect_ids([protein_id_list], [downloaded_protein_ids], mode="only_a")
@@ -368,31 +647,6 @@ class NCBIRoutines(FileRoutines):
         downloaded_protein_ids.write("%s.downloaded.ids" % output_prefix)
         print Tool.intersect_ids([protein_id_list], [downloaded_protein_ids], mode="count")
 
-        pep_without_transcripts = IdList()
-        pep_with_several_CDS_features = IdList()
-        pep_to_transcript_accordance = SynDict()
-        transcript_ids = IdList()
-
-        print "Extracting transcript ids corresponding to proteins..."
-        for pep_id in peptide_dict:
-            for feature in peptide_dict[pep_id].features:
-                if feature.type == "CDS":
-                    try:
-                        transcript_id = feature.qualifiers["coded_by"][0].split(":")[0]
-                        if pep_id not in pep_to_transcript_accordance:
-                            pep_to_transcript_accordance[pep_id] = [transcript_id]
-                        else:
-                            pep_to_transcript_accordance[pep_id].append(transcript_id)
-                            print("Genbank record for %s contains several CDS features" % pep_id)
-                            pep_with_several_CDS_features.append(pep_id)
-                        if transcript_id in transcript_ids:
-                            print "Repeated transcript id: %s" % transcript_id
-                            continue
-                        transcript_ids.append(transcript_id)
-                    except:
-                        print "Transcript id for %s was not found" % pep_id
-                        pep_without_transcripts.append(pep_id)
-
         pep_with_several_CDS_features.write("%s.pep_with_several_CDS.ids" % output_prefix)
         pep_without_transcripts.write("%s.pep_without_transcripts.ids" % output_prefix)
         transcript_ids.write("%s.transcripts.ids" % output_prefix)
@@ -402,48 +656,37 @@ class NCBIRoutines(FileRoutines):
 
         pep_to_transcript_accordance.write("%s.pep_to_transcript.accordance" % output_prefix, splited_values=True)
 
-        transcript_ranges = np.append(np.arange(0, number_of_transcripts, download_chunk_size), [number_of_transcripts])
-
-        print "Downloading transcripts..."
-        for i in range(0, len(transcript_ranges)-1):
-            print "Downloading chunk %i" % i
-            transcript_tmp_file = "%s/%s_%i" % (transcript_temp_dir, transcript_file, i)
-            self.efetch("nuccore", transcript_ids[transcript_ranges[i]:transcript_ranges[i+1]],
-                        transcript_tmp_file, rettype="gb", retmode="text")
-
-        os.system("cat %s/* > %s" % (transcript_temp_dir, transcript_file))
-
-
-        transcript_dict = SeqIO.index_db("tmp_1.idx", transcript_file, format="genbank")
-
-        cds_records_list = []
-        for transcript_id in transcript_dict:
-            for feature in transcript_dict[transcript_id].features:
-                CDS_counter = 1
-                if feature.type == "CDS":
-                    #print feature
-
-                    feature_seq = feature.extract(transcript_dict[transcript_id].seq)
-                    feature_id = transcript_id  # case with several CDS per transcripts is was not taken into account
-                    if "protein_id" in feature.qualifiers:
-                        description = "protein=%s" % feature.qualifiers["protein_id"][0]
-                    else:
-                        print "Corresponding protein id was not found for %s" % transcript_id
-                    cds_records_list.append(SeqRecord(seq=feature_seq, id=feature_id, description=description))
-        SeqIO.write(cds_records_list, "%s.cds" % output_prefix, format="fasta")
+        print "Downloading transcripts and extracting CDS..."
+        number_of_downloaded_transcripts = 0
+        with open(transcript_file, "w") as transcript_fd, open("%s.cds" % output_prefix, "w") as cds_fd:
+            for requested_id, record_text in client.fetch_records("nuccore", transcript_ids, rettype="gb",
+                                                                  retmode="text", chunk_size=download_chunk_size):
+                transcript_fd.write(record_text)
+                record = SeqIO.read(StringIO(record_text), format="genbank")
+                transcript_id = record.id
+                number_of_downloaded_transcripts += 1
+                cds_records_list = []
+                for feature in record.features:
+                    if feature.type == "CDS":
+                        feature_seq = feature.extract(record.seq)
+                        feature_id = transcript_id  # case with several CDS per transcripts is was not taken into account
+                        if "protein_id" in feature.qualifiers:
+                            description = "protein=%s" % feature.qualifiers["protein_id"][0]
+                        else:
+                            description = ""
+                            print "Corresponding protein id was not found for %s" % transcript_id
+                        cds_records_list.append(SeqRecord(seq=feature_seq, id=feature_id, description=description))
+                SeqIO.write(cds_records_list, cds_fd, format="fasta")
 
         stat_string = "Input protein ids\t %i\n" % number_of_ids
-        stat_string += "Downloaded proteins\t%i\n" % number_of_transcripts
-        stat_string += "Downloaded transcripts\t%i\n" % len(transcript_dict)
+        stat_string += "Downloaded proteins\t%i\n" % len(downloaded_protein_ids)
+        stat_string += "Downloaded transcripts\t%i\n" % number_of_downloaded_transcripts
 
         print stat_string
 
         with open("%s.stats" % output_prefix, "w") as stat_fd:
             stat_fd.write(stat_string)
 
-        for filename in "tmp.idx", "tmp_1.idx":
-            os.remove(filename)
-
     def get_cds_for_proteins_from_id_file(self, protein_id_file, output_prefix):
         pep_ids = IdList()
         pep_ids.read(protein_id_file)
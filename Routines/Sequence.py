@@ -8,7 +8,9 @@ import pickle
 from random import randint
 
 from copy import deepcopy
+from itertools import imap
 from collections import OrderedDict
+from multiprocessing import Pool
 
 import numpy as np
 
@@ -19,6 +21,7 @@ from Bio.SeqFeature import SeqFeature, FeatureLocation
 
 from CustomCollections.GeneralCollections import TwoLvlDict, SynDict, IdList, IdSet
 from Routines import FileRoutines
+from Routines.Math import MathRoutines
 from Routines.Functions import output_dict
 
 
@@ -27,87 +30,166 @@ class SequenceRoutines(FileRoutines):
     def __init__(self):
         FileRoutines.__init__(self)
 
-    def split_fasta(self, input_fasta, output_dir, num_of_recs_per_file=None, num_of_files=None, output_prefix=None):
+    @staticmethod
+    def raw_fasta_record_generator(fasta_file):
+        # yields records of fasta file as tuples (header line, list of sequence lines, sequence length)
+        # without parsing to SeqRecord, lines are kept as is(with newline symbols)
+        header = None
+        lines = []
+        length = 0
+        with FileRoutines.metaopen(fasta_file, "r") as in_fd:
+            for line in in_fd:
+                if line[-1] != "\n":
+                    line += "\n"
+                if line[0] == ">":
+                    if header is not None:
+                        yield header, lines, length
+                    header = line
+                    lines = []
+                    length = 0
+                elif header is not None:
+                    lines.append(line)
+                    length += len(line.strip())
+            if header is not None:
+                yield header, lines, length
+
+    def split_fasta(self, input_fasta, output_dir, num_of_recs_per_file=None, num_of_files=None, output_prefix=None,
+                    num_of_residues_per_file=None, mode="consecutive"):
         """
-        by default splits input files into files with num_of_recs_per_file.
-        if num_of_files is set num_of_recs_per_file is ignored.
+        Splits fasta file in single pass without temporary index, records are written as is.
+        num_of_recs_per_file - consecutive records are written to files with num_of_recs_per_file records.
+        num_of_residues_per_file - consecutive records are written to files with total length not greater than
+            num_of_residues_per_file(record longer than num_of_residues_per_file is written to separated file).
+        num_of_files - records are distributed between num_of_files files,
+            mode sets the way of distribution:
+                "consecutive" - files contain consecutive records, equal number of records per file
+                                (except last one), number of records is counted by additional fast pass over file
+                "round_robin" - i-th record is written to file i % num_of_files, so files have equal number of records
+                               (all files are opened simultaneously in this and next modes)
+                "residues" - record is written to file with minimal total length of already written records.
+        If num_of_files is set num_of_recs_per_file and num_of_residues_per_file are ignored.
+        Output files are named <output_dir>/<output_prefix>_<index>.fasta, index is one-based.
+        Returns list of output files, empty files are not created.
         """
-        self.save_mkdir(output_dir)
+        if (not num_of_files) and (not num_of_recs_per_file) and (not num_of_residues_per_file):
+            raise ValueError("Neither num_of_files nor num_of_recs_per_file nor num_of_residues_per_file was set")
+        if num_of_files and (mode not in ("consecutive", "round_robin", "residues")):
+            raise ValueError("Unknown mode of fasta splitting: %s" % mode)
+
+        if num_of_files and (mode == "consecutive"):
+            with self.metaopen(input_fasta, "r") as in_fd:
+                number_of_records = sum(1 for line in in_fd if line[0] == ">")
+            num_of_recs_per_file = max(1, (number_of_records + num_of_files - 1) // num_of_files)
+            num_of_files = None
+
+        self.safe_mkdir(output_dir)
         out_prefix = self.split_filename(input_fasta)[1] if output_prefix is None else output_prefix
-        sequence_dict = SeqIO.index_db("temp.idx", input_fasta, "fasta")
-
-        split_index = 1
-        records_written = 0
-        record_ids_list = list(sequence_dict.keys())
-        number_of_records = len(record_ids_list)
-
-        num_of_recs = int(number_of_records/num_of_files) + 1 if num_of_files else num_of_recs_per_file
-        while (records_written + num_of_recs) <= number_of_records:
-
-            SeqIO.write(self.record_by_id_generator(sequence_dict,
-                                                    record_ids_list[records_written:records_written+num_of_recs]),
-                        "%s/%s_%i.fasta" % (output_dir, out_prefix, split_index), format="fasta")
-            split_index += 1
-            records_written += num_of_recs
-
-        if records_written != number_of_records:
-            SeqIO.write(self.record_by_id_generator(sequence_dict,
-                                                    record_ids_list[records_written:]),
-                        "%s/%s_%i.fasta" % (output_dir, out_prefix, split_index), format="fasta")
-
-        os.remove("temp.idx")
-
-    def split_fasta_by_seq_len(self, input_fasta, output_dir, max_len_per_file=None, output_prefix=None):
+        output_file_list = []
+
+        def open_next_file():
+            output_file_list.append("%s/%s_%i.fasta" % (output_dir, out_prefix, len(output_file_list) + 1))
+            return open(output_file_list[-1], "w")
+
+        if num_of_files:
+            out_fd_list = []
+            written_residues = []
+            try:
+                for record_index, (header, lines, length) in enumerate(self.raw_fasta_record_generator(input_fasta)):
+                    if len(out_fd_list) < num_of_files:
+                        # first num_of_files records are written to different files in both modes
+                        out_fd_list.append(open_next_file())
+                        written_residues.append(0)
+                        file_index = len(out_fd_list) - 1
+                    elif mode == "round_robin":
+                        file_index = record_index % num_of_files
+                    else:
+                        file_index = written_residues.index(min(written_residues))
+                    out_fd_list[file_index].write(header)
+                    out_fd_list[file_index].writelines(lines)
+                    written_residues[file_index] += length
+            finally:
+                for out_fd in out_fd_list:
+                    out_fd.close()
+            return output_file_list
+
+        out_fd = None
+        records_in_file = 0
+        residues_in_file = 0
+        try:
+            for header, lines, length in self.raw_fasta_record_generator(input_fasta):
+                if out_fd is None:
+                    start_new_file = True
+                elif num_of_recs_per_file:
+                    start_new_file = records_in_file >= num_of_recs_per_file
+                else:
+                    start_new_file = residues_in_file + length > num_of_residues_per_file
+
+                if start_new_file:
+                    if out_fd is not None:
+                        out_fd.close()
+                    out_fd = open_next_file()
+                    records_in_file = 0
+                    residues_in_file = 0
+
+                out_fd.write(header)
+                out_fd.writelines(lines)
+                records_in_file += 1
+                residues_in_file += length
+        finally:
+            if out_fd is not None:
+                out_fd.close()
+
+        return output_file_list
+
+    def split_fasta_by_cost(self, input_fasta, output_dir, number_of_workers, output_prefix=None,
+                            cost_function=None, min_file_cost=None):
         """
-        by default splits input files into files with num_of_recs_per_file.
-        if num_of_files is set num_of_recs_per_file is ignored.
+        Splits fasta file into files with balanced cost of processing for number_of_workers parallel workers.
+        cost_function takes sequence length and returns estimated cost of processing of the record,
+        by default it is length + 100 (constant part accounts for per query overhead).
+        Files contain consecutive records and become smaller from first to last(see MathRoutines.guided_partition),
+        they should be dispatched from largest to smallest(for example sorted by size).
+        Returns list of output files in order of records.
         """
-        self.save_mkdir(output_dir)
-
+        self.safe_mkdir(output_dir)
         out_prefix = self.split_filename(input_fasta)[1] if output_prefix is None else output_prefix
-        sequence_dict = SeqIO.index_db("temp.idx", input_fasta, "fasta")
-        length = 0
-
-        for record_id in sequence_dict:
-            length += len(sequence_dict[record_id].seq)
-
-        max_len = max_len_per_file if max_len_per_file else int(length / self.threads)
-
-        split_index = 1
-        id_list = []
-        total_length = 0
-
-        for record_id in sequence_dict:
-            record_length = len(sequence_dict[record_id].seq)
-            if record_length >= max_len:
-                SeqIO.write(sequence_dict[record_id],
-                            "%s/%s_%i.fasta" % (output_dir, out_prefix, split_index), format="fasta")
-
-            elif total_length + record_length > max_len:
-                SeqIO.write(self.record_by_id_generator(sequence_dict, id_list),
-                            "%s/%s_%i.fasta" % (output_dir, out_prefix, split_index), format="fasta")
-                total_length = record_length
-                id_list = [record_id]
-
-            elif total_length + record_length == max_len:
-                id_list.append(record_id)
-                SeqIO.write(self.record_by_id_generator(sequence_dict, id_list),
-                            "%s/%s_%i.fasta" % (output_dir, out_prefix, split_index), format="fasta")
-                total_length = 0
-                id_list = []
-
-            elif total_length + record_length < max_len:
-                id_list.append(record_id)
-                total_length += record_length
-                continue
+        cost_function = cost_function if cost_function else lambda length: length + 100
+
+        cost_list = [cost_function(length) for header, lines, length in self.raw_fasta_record_generator(input_fasta)]
+        bin_list = MathRoutines.guided_partition(cost_list, number_of_workers, min_bin_cost=min_file_cost,
+                                                 keep_order=True)
+
+        output_file_list = []
+        out_fd = None
+        records_left = 0
+        try:
+            for header, lines, length in self.raw_fasta_record_generator(input_fasta):
+                if records_left == 0:
+                    if out_fd is not None:
+                        out_fd.close()
+                    records_left = len(bin_list[len(output_file_list)])
+                    output_file_list.append("%s/%s_%i.fasta" % (output_dir, out_prefix, len(output_file_list) + 1))
+                    out_fd = open(output_file_list[-1], "w")
+                out_fd.write(header)
+                out_fd.writelines(lines)
+                records_left -= 1
+        finally:
+            if out_fd is not None:
+                out_fd.close()
+
+        return output_file_list
 
-            split_index += 1
-
-        if id_list:
-            SeqIO.write(self.record_by_id_generator(sequence_dict, id_list),
-                        "%s/%s_%i.fasta" % (output_dir, out_prefix, split_index), format="fasta")
-
-        os.remove("temp.idx")
+    def split_fasta_by_seq_len(self, input_fasta, output_dir, max_len_per_file=None, output_prefix=None):
+        """
+        splits input file into files with total sequence length not greater than max_len_per_file.
+        if max_len_per_file is not set records are split into self.threads files of consecutive records,
+        so order of records is kept in merged results(i.e. of AUGUSTUS).
+        """
+        if max_len_per_file:
+            return self.split_fasta(input_fasta, output_dir, num_of_residues_per_file=max_len_per_file,
+                                    output_prefix=output_prefix)
+        return self.split_fasta(input_fasta, output_dir, num_of_files=self.threads, output_prefix=output_prefix,
+                                mode="consecutive")
 
     def extract_common_sequences(self, list_of_files_with_sequences_of_samples, list_of_names_of_samples,
                                  output_dir, separator="_", format="fasta"):
@@ -377,7 +459,22 @@ class SequenceRoutines(FileRoutines):
     def check_pairing_from_file(self, forward_file, reverse_file, output_prefix, forward_record_id_suffix,
                                 reverse_record_id_suffix, parsing_mode="index_db", format="fasta",
                                 forward_index_file="forward_tmp.idx", reverse_index_file="reverse_tmp.idx",
-                                retain_index=False, output_file_extension="fasta"):
+                                retain_index=False, output_file_extension="fasta", pairing_mode="auto"):
+        # fasta and fastq files are paired by restore_pairs without index(parsing_mode is ignored),
+        # other formats are parsed by SeqIO
+        forward_paired_file = "%s.pe.forward.%s" % (output_prefix, output_file_extension)
+        reverse_paired_file = "%s.pe.reverse.%s" % (output_prefix, output_file_extension)
+        forward_unpaired_file = "%s.se.forward.%s" % (output_prefix, output_file_extension)
+        reverse_unpaired_file = "%s.se.reverse.%s" % (output_prefix, output_file_extension)
+
+        if format in ("fasta", "fastq"):
+            self.restore_pairs(forward_file, reverse_file, forward_paired_file, reverse_paired_file,
+                               forward_unpaired_file, reverse_unpaired_file, format=format,
+                               forward_record_id_suffix=forward_record_id_suffix,
+                               reverse_record_id_suffix=reverse_record_id_suffix, mode=pairing_mode,
+                               tmp_dir="%s.pairing_tmp" % output_prefix)
+            return
+
         forward_dict = self.parse_seq_file(forward_file, parsing_mode, format=format, index_file=forward_index_file)
         reverse_dict = self.parse_seq_file(reverse_file, parsing_mode, format=format, index_file=reverse_index_file)
 
@@ -387,11 +484,6 @@ class SequenceRoutines(FileRoutines):
         only_reverse_full_ids = self.check_pairing(forward_dict, reverse_dict,
                                                    forward_record_id_suffix, reverse_record_id_suffix)
 
-        forward_paired_file = "%s.pe.forward.%s" % (output_prefix, output_file_extension)
-        reverse_paired_file = "%s.pe.reverse.%s" % (output_prefix, output_file_extension)
-        forward_unpaired_file = "%s.se.forward.%s" % (output_prefix, output_file_extension)
-        reverse_unpaired_file = "%s.se.reverse.%s" % (output_prefix, output_file_extension)
-
         for (dictionary, ids, filename) in zip((forward_dict, reverse_dict, forward_dict, reverse_dict),
                                                (forward_full_paired_ids, reverse_full_paired_ids, only_forward_full_ids, only_reverse_full_ids),
                                                (forward_paired_file, reverse_paired_file, forward_unpaired_file, reverse_unpaired_file)):
@@ -400,6 +492,175 @@ class SequenceRoutines(FileRoutines):
         if (parsing_mode == "index_db") and (not retain_index):
             os.remove(forward_index_file)
             os.remove(reverse_index_file)
+
+    @staticmethod
+    def raw_record_with_id_generator(file_list, format="fasta"):
+        # yields tuples (record id, record text) from fasta or fastq(four lines per record) files
+        # without parsing to SeqRecord
+        for filename in [file_list] if isinstance(file_list, str) else file_list:
+            if format == "fasta":
+                for header, lines, length in SequenceRoutines.raw_fasta_record_generator(filename):
+                    yield header[1:].split(None, 1)[0], header + "".join(lines)
+            elif format == "fastq":
+                with FileRoutines.metaopen(filename, "r") as in_fd:
+                    for line in in_fd:
+                        record = line + in_fd.next() + in_fd.next() + in_fd.next()
+                        if record[-1] != "\n":
+                            record += "\n"
+                        yield line[1:].split(None, 1)[0], record
+            else:
+                raise ValueError("Unsupported format for raw parsing: %s" % format)
+
+    @staticmethod
+    def strip_id_suffix(record_id, suffix):
+        if not suffix:
+            return record_id
+        if record_id[-len(suffix):] != suffix:
+            raise ValueError("Record %s doesn't have id suffix %s" % (record_id, suffix))
+        return record_id[:-len(suffix)]
+
+    def restore_pairs(self, forward_files, reverse_files, forward_paired_file, reverse_paired_file,
+                      forward_unpaired_file, reverse_unpaired_file, format="fastq", forward_record_id_suffix="",
+                      reverse_record_id_suffix="", mode="auto", max_buffered_records=1000000,
+                      number_of_partitions=64, tmp_dir="pairing_tmp"):
+        """
+        Splits forward and reverse records to pairs and unpaired records in sequential passes without index,
+        records are written as is. Records are paired by ids with removed suffixes.
+        mode:
+            "ordered" - streaming merge-join, inputs must be in the same order(i.e. sorted by name or
+                        both obtained by filtering of the same pair of files)
+            "partition" - records are hash-partitioned to number_of_partitions temporary files in tmp_dir
+                          which are joined one by one
+            "auto" - try "ordered" mode and restart in "partition" mode if inputs turn out to be unordered
+        Returns tuple (number of pairs, number of forward unpaired, number of reverse unpaired).
+        """
+        output_files = (forward_paired_file, reverse_paired_file, forward_unpaired_file, reverse_unpaired_file)
+        suffixes = (forward_record_id_suffix, reverse_record_id_suffix)
+        if mode in ("auto", "ordered"):
+            counts = self._restore_pairs_ordered(forward_files, reverse_files, output_files, format, suffixes,
+                                                 max_buffered_records)
+            if counts is not None:
+                return counts
+            if mode == "ordered":
+                raise ValueError("Input files are not in the same order")
+            sys.stderr.write("Input files are not in the same order. Switching to partition mode...\n")
+        elif mode != "partition":
+            raise ValueError("Unknown pairing mode: %s" % mode)
+
+        return self._restore_pairs_partitioned(forward_files, reverse_files, output_files, format, suffixes,
+                                               number_of_partitions, tmp_dir)
+
+    def _restore_pairs_ordered(self, forward_files, reverse_files, output_files, format, suffixes,
+                               max_buffered_records):
+        # inputs are read alternately, unmatched records are kept in buffers until their mate is found.
+        # if inputs have the same order, all records read from one input before the mate of record from
+        # other input are unpaired. Returns None(and removes output) if order turns out to be violated.
+        generators = [self.raw_record_with_id_generator(forward_files, format=format),
+                      self.raw_record_with_id_generator(reverse_files, format=format)]
+        forward_pe_fd, reverse_pe_fd, forward_se_fd, reverse_se_fd = [self.metaopen(filename, "w")
+                                                                      for filename in output_files]
+        unpaired_fd_list = [forward_se_fd, reverse_se_fd]
+        pending = [OrderedDict(), OrderedDict()]
+        unpaired_ids = [set(), set()]
+        exhausted = [False, False]
+        pair_number = 0
+        ordered = True
+
+        while ordered and not (exhausted[0] and exhausted[1]):
+            for side in (0, 1):
+                if exhausted[side]:
+                    continue
+                try:
+                    record_id, record = generators[side].next()
+                except StopIteration:
+                    exhausted[side] = True
+                    continue
+                key = self.strip_id_suffix(record_id, suffixes[side])
+                other = 1 - side
+
+                if key in pending[other]:
+                    for unpaired_key in pending[side]:
+                        unpaired_fd_list[side].write(pending[side][unpaired_key])
+                        unpaired_ids[side].add(unpaired_key)
+                    pending[side].clear()
+                    while True:
+                        other_key, other_record = pending[other].popitem(last=False)
+                        if other_key == key:
+                            break
+                        unpaired_fd_list[other].write(other_record)
+                        unpaired_ids[other].add(other_key)
+                    forward_pe_fd.write(record if side == 0 else other_record)
+                    reverse_pe_fd.write(other_record if side == 0 else record)
+                    pair_number += 1
+                elif (key in unpaired_ids[other]) or (len(pending[0]) + len(pending[1]) >= max_buffered_records):
+                    ordered = False
+                    break
+                else:
+                    pending[side][key] = record
+
+        if ordered:
+            for side in (0, 1):
+                for key in pending[side]:
+                    unpaired_fd_list[side].write(pending[side][key])
+                    unpaired_ids[side].add(key)
+
+        for fd in forward_pe_fd, reverse_pe_fd, forward_se_fd, reverse_se_fd:
+            fd.close()
+
+        if not ordered:
+            for filename in output_files:
+                os.remove(filename)
+            return None
+
+        return pair_number, len(unpaired_ids[0]), len(unpaired_ids[1])
+
+    def _restore_pairs_partitioned(self, forward_files, reverse_files, output_files, format, suffixes,
+                                   number_of_partitions, tmp_dir):
+        # tmp_dir is removed at the end only if it was created here
+        tmp_dir_created = not os.path.exists(tmp_dir)
+        self.safe_mkdir(tmp_dir)
+        partition_files = [["%s/%i.%s.%s" % (tmp_dir, index, side_name, format)
+                            for side_name in ("forward", "reverse")] for index in range(0, number_of_partitions)]
+
+        for side, files in (0, forward_files), (1, reverse_files):
+            partition_fd_list = [open(partition_files[index][side], "w") for index in range(0, number_of_partitions)]
+            for record_id, record in self.raw_record_with_id_generator(files, format=format):
+                key = self.strip_id_suffix(record_id, suffixes[side])
+                partition_fd_list[hash(key) % number_of_partitions].write(record)
+            for fd in partition_fd_list:
+                fd.close()
+
+        forward_pe_fd, reverse_pe_fd, forward_se_fd, reverse_se_fd = [self.metaopen(filename, "w")
+                                                                      for filename in output_files]
+        pair_number = 0
+        forward_unpaired_number = 0
+        reverse_unpaired_number = 0
+        for forward_partition, reverse_partition in partition_files:
+            forward_dict = OrderedDict()
+            for record_id, record in self.raw_record_with_id_generator(forward_partition, format=format):
+                forward_dict[self.strip_id_suffix(record_id, suffixes[0])] = record
+            for record_id, record in self.raw_record_with_id_generator(reverse_partition, format=format):
+                key = self.strip_id_suffix(record_id, suffixes[1])
+                if key in forward_dict:
+                    forward_pe_fd.write(forward_dict.pop(key))
+                    reverse_pe_fd.write(record)
+                    pair_number += 1
+                else:
+                    reverse_se_fd.write(record)
+                    reverse_unpaired_number += 1
+            for key in forward_dict:
+                forward_se_fd.write(forward_dict[key])
+            forward_unpaired_number += len(forward_dict)
+            os.remove(forward_partition)
+            os.remove(reverse_partition)
+
+        for fd in forward_pe_fd, reverse_pe_fd, forward_se_fd, reverse_se_fd:
+            fd.close()
+        if tmp_dir_created:
+            os.rmdir(tmp_dir)
+
+        return pair_number, forward_unpaired_number, reverse_unpaired_number
+
     """
     @staticmethod
     def check_pairing_from_interleaved_dict(record_dict, forward_record_id_suffix, reverse_record_id_suffix):
@@ -1251,35 +1512,114 @@ class SequenceRoutines(FileRoutines):
         #   perfect - search only for perfect homopolymers, all options other than min_size are ignored
         #   non_perfect - search for non_perfect homopolymers with max_single_insert_size, max_total_insert_length
         #                 and max_number_of_insertions
-        seq_length = len(seq)
-        i = 0
-        homopolymers_coords = []
-        homopolymers_lengthes = []
-        #print(seq_length)
-        prev_end = 0
-        while i < seq_length:
-            if seq[i] == nucleotide:
-                end, new_start = self.find_homopolymer_end(seq, nucleotide, seq_length, i, search_type=search_type,
+        starts, ends, symbols = self.find_homopolymer_runs(seq, nucleotides=nucleotide, min_size=min_size,
+                                                           search_type=search_type,
                                                            max_single_insert_size=max_single_insert_size,
                                                            max_total_insert_length=max_total_insert_length,
                                                            max_number_of_insertions=max_number_of_insertions)
-                # print(end, i)
-                length = end - i
-                if homopolymers_coords:
-                    prev_end = homopolymers_coords[-1][1]
-
-                if length >= min_size and end > prev_end:
-                    homopolymers_coords.append((i, end))
-                    homopolymers_lengthes.append(length)
-
-                i = end
-                if new_start is not None:
-                    i = new_start
+        return zip(starts.tolist(), ends.tolist()), ends - starts
+
+    @staticmethod
+    def get_runs(seq):
+        # returns arrays (starts, ends, symbols) of runs of identical symbols in sequence
+        symbols = np.frombuffer(str(seq), dtype=np.uint8)
+        if len(symbols) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), symbols
+        starts = np.flatnonzero(np.concatenate(([True], symbols[1:] != symbols[:-1])))
+        ends = np.append(starts[1:], len(symbols))
+        return starts, ends, symbols[starts]
+
+    @staticmethod
+    def find_homopolymer_runs(seq, nucleotides="ACGT", min_size=5, search_type="perfect",
+                              max_single_insert_size=1, max_total_insert_length=None, max_number_of_insertions=2):
+        """
+        Finds homopolymers of all nucleotides from nucleotides in one pass over runs of identical symbols.
+        Non-perfect homopolymers are found in the same way as by find_homopolymer_end: each run of nucleotide
+        is extended over following runs while each insertion is not longer than max_single_insert_size and total
+        length of insertions(limited by max_number_of_insertions, as it counts inserted symbols) is not exceeded,
+        homopolymers ending inside previously found one are skipped. Unlike find_homopolymer_end homopolymer
+        reaching end of sequence always ends after last run of nucleotide.
+        Returns arrays (starts, ends, symbols) sorted by start.
+        """
+        run_starts, run_ends, run_symbols = SequenceRoutines.get_runs(seq)
+        max_insertion_length = max_number_of_insertions
+        if max_total_insert_length:
+            max_insertion_length = min(max_insertion_length, max_total_insert_length)
+
+        start_list = []
+        end_list = []
+        symbol_list = []
+        for nucleotide in nucleotides:
+            nucleotide_mask = run_symbols == ord(nucleotide)
+            starts = run_starts[nucleotide_mask]
+            ends = run_ends[nucleotide_mask]
+            if len(starts) == 0:
                 continue
-            i += 1
+            if search_type == "perfect":
+                last_runs = np.arange(0, len(starts))
+            else:
+                insertion_lengths = starts[1:] - ends[:-1]
+                # last run reachable without exceeding total length of insertions
+                cumulative_insertion_lengths = np.concatenate(([0], np.cumsum(insertion_lengths)))
+                last_runs = np.searchsorted(cumulative_insertion_lengths,
+                                            cumulative_insertion_lengths + max_insertion_length, side="right") - 1
+                # last run before first too long insertion
+                long_insertions = np.flatnonzero(insertion_lengths > max_single_insert_size)
+                long_insertions = np.append(long_insertions, len(starts) - 1)
+                last_runs = np.minimum(last_runs,
+                                       long_insertions[np.searchsorted(long_insertions, np.arange(0, len(starts)))])
+
+            homopolymer_ends = ends[last_runs]
+            long_enough = homopolymer_ends - starts >= min_size
+            # ends are nondecreasing, so homopolymer is new if it ends after all previous long enough homopolymers
+            previous_max_ends = np.maximum.accumulate(np.where(long_enough, homopolymer_ends, 0))
+            new_mask = long_enough & (homopolymer_ends > np.concatenate(([0], previous_max_ends[:-1])))
+
+            start_list.append(starts[new_mask])
+            end_list.append(homopolymer_ends[new_mask])
+            symbol_list.append(np.full(np.count_nonzero(new_mask), ord(nucleotide), dtype=np.uint8))
+
+        if not start_list:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        starts, ends, symbols = np.concatenate(start_list), np.concatenate(end_list), np.concatenate(symbol_list)
+        order = np.argsort(starts, kind="mergesort")
+        return starts[order], ends[order], symbols[order]
+
+    def find_homopolymers_from_file(self, input_file, output_file, nucleotides="ACGT", min_size=5,
+                                    search_type="perfect", max_single_insert_size=1, max_total_insert_length=None,
+                                    max_number_of_insertions=2, output_format="bed", threads=1):
+        """
+        Finds homopolymers in all records of fasta file(case-insensitive) and streams them to output_file in bed
+        (zero-based, with nucleotide and length) or gff format. Records are read without parsing to SeqRecord and
+        processed in parallel by threads processes, order of records is kept.
+        """
+        if output_format not in ("bed", "gff"):
+            raise ValueError("Unsupported output format: %s" % output_format)
+        parameters = (nucleotides.upper(), min_size, search_type, max_single_insert_size, max_total_insert_length,
+                      max_number_of_insertions)
+        arguments_generator = ((header[1:].split(None, 1)[0] if len(header) > 2 else "",
+                                "".join(lines).replace("\n", "")) + parameters
+                               for header, lines, length in self.raw_fasta_record_generator(input_file))
+
+        process_pool = Pool(threads) if threads > 1 else None
+        results = process_pool.imap(find_homopolymers_in_record, arguments_generator) if process_pool \
+            else imap(find_homopolymers_in_record, arguments_generator)
+
+        with open(output_file, "w") as out_fd:
+            if output_format == "gff":
+                out_fd.write("##gff-version 3\n")
+            for record_id, starts, ends, symbols in results:
+                if output_format == "bed":
+                    for start, end, symbol in zip(starts, ends, symbols):
+                        out_fd.write("%s\t%i\t%i\t%s\t%i\n" % (record_id, start, end, chr(symbol), end - start))
+                else:
+                    for start, end, symbol in zip(starts, ends, symbols):
+                        out_fd.write("%s\tMAVR\thomopolymer\t%i\t%i\t.\t+\t.\tNucleotide=%s;Length=%i\n"
+                                     % (record_id, start + 1, end, chr(symbol), end - start))
 
-        homopolymers_lengthes = np.array(homopolymers_lengthes)
-        return homopolymers_coords, homopolymers_lengthes
+        if process_pool:
+            process_pool.close()
+            process_pool.join()
 
     @staticmethod
     def calculate_assembly_stats(record_dict, thresholds_list=(0, 500, 1000), seq_len_file=None):
@@ -1694,6 +2034,20 @@ def find_homopolymer_end(seq, nucleotide, seq_length, start, search_type="perfec
 
 
 
+def find_homopolymers_in_record(arguments):
+    # wrapper for multiprocessing.Pool, arguments - tuple (record id, sequence, nucleotides, min_size, search_type,
+    # max_single_insert_size, max_total_insert_length, max_number_of_insertions)
+    record_id, sequence = arguments[:2]
+    nucleotides, min_size, search_type, max_single_insert_size, max_total_insert_length, \
+        max_number_of_insertions = arguments[2:]
+    starts, ends, symbols = SequenceRoutines.find_homopolymer_runs(sequence.upper(), nucleotides=nucleotides,
+                                                                   min_size=min_size, search_type=search_type,
+                                                                   max_single_insert_size=max_single_insert_size,
+                                                                   max_total_insert_length=max_total_insert_length,
+                                                                   max_number_of_insertions=max_number_of_insertions)
+    return record_id, starts, ends, symbols
+
+
 # ----------------------Filters-----------------------
 
 
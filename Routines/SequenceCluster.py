@@ -8,6 +8,7 @@ from Bio import SeqIO
 from Routines import FileRoutines
 from Routines.Sequence import SequenceRoutines
 from CustomCollections.GeneralCollections import SynDict, IdSet, IdList
+from CustomCollections.CompactCollections import CompactIdSet, CompactSynDict
 
 
 class SequenceClusterRoutines:
@@ -16,9 +17,18 @@ class SequenceClusterRoutines:
         pass
 
     @staticmethod
-    def read_cluster_files_from_dir(dir_with_cluster_files):
+    def read_cluster_files_from_dir(dir_with_cluster_files, compact=False, id_index=None):
+        # if compact is set clusters are read to CompactSynDict sharing single IdIndex(id_index or new one)
         cluster_files_list = sorted(os.listdir(dir_with_cluster_files))
         clusters_dict = OrderedDict()
+        if compact:
+            file_dict = OrderedDict()
+            for filename in cluster_files_list:
+                filepath = "%s%s" % (FileRoutines.check_path(dir_with_cluster_files), filename)
+                file_dict[FileRoutines.split_filename(filepath)[1]] = filepath
+            return CompactSynDict.read_files(file_dict, id_index=id_index, header=False, separator="\t",
+                                             values_separator=",", key_index=0, value_index=1, comments_prefix="#")
+
         for filename in cluster_files_list:
             filepath = "%s%s" % (FileRoutines.check_path(dir_with_cluster_files), filename)
             filename_list = FileRoutines.split_filename(filepath)
@@ -30,6 +40,15 @@ class SequenceClusterRoutines:
 
     @staticmethod
     def get_cluster_names(clusters_dict, out_file=None, white_list_ids=None):
+        if clusters_dict and all(isinstance(clusters_dict[species], CompactSynDict) for species in clusters_dict):
+            # union of integer codes instead of union of ordered sets of strings
+            cluster_names = CompactIdSet(id_index=clusters_dict[clusters_dict.keys()[0]].id_index)
+            for species in clusters_dict:
+                cluster_names |= clusters_dict[species].key_set()
+            if out_file:
+                cluster_names.write(out_file)
+            return cluster_names & white_list_ids if white_list_ids else cluster_names
+
         cluster_names = IdSet()
         for species in clusters_dict:
             species_clusters = IdSet(clusters_dict[species].keys())
@@ -45,6 +64,11 @@ class SequenceClusterRoutines:
         for species in clusters_dict:
             sequence_names_dict[species] = IdSet()
         for species in clusters_dict:
+            if isinstance(clusters_dict[species], CompactSynDict):
+                cluster_ids = [cluster_id for cluster_id in clusters_dict[species]
+                               if (not white_list_ids) or (cluster_id in white_list_ids)]
+                sequence_names_dict[species] = clusters_dict[species].value_set(cluster_ids)
+                continue
             for cluster_id in clusters_dict[species]:
                 if white_list_ids:
                     if cluster_id not in white_list_ids:
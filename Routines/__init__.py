@@ -12,6 +12,7 @@ from Routines.EggNOG import EggNOGRoutines
 from Routines.Ensembl import EnsemblRoutines
 from Routines.TreeFam import TreeFamRoutines
 from Routines.Drawing import DrawingRoutines
+from Routines.Kmer import KmerRoutines
 from Routines.Sequence import SequenceRoutines
 from Routines.Alignment import AlignmentRoutines
 from Routines.Matplotlib import MatplotlibRoutines
@@ -32,6 +33,7 @@ EggNOGRoutines = EggNOGRoutines()
 EnsemblRoutines = EnsemblRoutines()
 TreeFamRoutines = TreeFamRoutines()
 DrawingRoutines = DrawingRoutines()
+KmerRoutines = KmerRoutines()
 SequenceRoutines = SequenceRoutines()
 AlignmentRoutines = AlignmentRoutines()
 MatplotlibRoutines = MatplotlibRoutines()
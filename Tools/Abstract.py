@@ -1,24 +1,341 @@
 #!/usr/bin/env python
 import os
 import sys
-import multiprocessing as mp
+import time
+import errno
+import fcntl
+import signal
+import threading
+from Queue import Queue
 from subprocess import PIPE, Popen
 from collections import Iterable
 
 
 from Routines.Sequence import SequenceRoutines
 
-print_mutex = mp.Lock()
+# use mutexes to safe write to stdout and logs from multiple threads
+print_mutex = threading.Lock()
+log_mutex = threading.Lock()
 
+# command is started by this small helper process, which waits for the shell and writes resource usage
+# of its children to file descriptor given as first argument. The helper is needed because peak RSS of a process
+# started directly by python includes RSS of the python process itself(it is inherited through fork and exec)
+rusage_helper_code = """
+import os
+import sys
+import signal
+import resource
+import subprocess
+return_code = subprocess.call(sys.argv[2], shell=True)
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+os.write(int(sys.argv[1]), ("%f %f %i\\n" % (usage.ru_utime, usage.ru_stime, usage.ru_maxrss)).encode())
+if return_code < 0:
+    signal.signal(-return_code, signal.SIG_DFL)
+    os.kill(os.getpid(), -return_code)
+sys.exit(return_code)
+"""
+
+
+class JobResult(object):
+    # structured record of execution of a single shell command
+    # wall_time, user_time and system_time are in seconds, max_rss is peak resident set size in kilobytes
+    # user_time, system_time and max_rss include all processes started by command(shell and its children)
+    # and are measured separately for each command(see rusage_helper_code), max_rss could not be less than RSS of
+    # helper process(several megabytes) and is None if it was not reported, i.e. if command was terminated
+    # status is one of waiting, running, done, failed, cancelled
+    header_list = ["#date", "command", "status", "return_code", "attempts",
+                   "wall_time", "user_time", "system_time", "max_rss_kb"]
+
+    def __init__(self, command):
+        self.command = command
+        self.status = "waiting"
+        self.return_code = None
+        self.attempts = 0
+        self.start_time = None
+        self.wall_time = None
+        self.user_time = None
+        self.system_time = None
+        self.max_rss = None
+
+    def __str__(self):
+        date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start_time)) if self.start_time else "."
+
+        def to_str(value, value_format="%s"):
+            return "." if value is None else value_format % value
+
+        return "\t".join([date, self.command, self.status, to_str(self.return_code), str(self.attempts),
+                          to_str(self.wall_time, "%.3f"), to_str(self.user_time, "%.3f"),
+                          to_str(self.system_time, "%.3f"), to_str(self.max_rss)])
+
+
+class JobBatch(object):
+    # group of shell commands submitted together, results are stored in the same order as commands
+    # failed commands are restarted up to retries times,
+    # if fail_fast is set first failed command cancels the rest of the batch(running commands are terminated)
+    # if log_file is set a tab-separated line(see JobResult) is appended to it for each finished command
+    # callback(if set) is called as callback(index, result) from worker thread after each successful command,
+    # exception in callback marks command as failed
+    # finish_callback(if set) is called as finish_callback(batch) once after all commands are finished
+    # (or cancelled) and before wait() returns, i.e. to remove temporary files of asynchronous run
+
+    def __init__(self, command_list, retries=0, fail_fast=True, log_file=None, callback=None,
+                 finish_callback=None):
+        self.results = [JobResult(command) for command in command_list]
+        self.retries = retries
+        self.fail_fast = fail_fast
+        self.log_file = log_file
+        self.callback = callback
+        self.finish_callback = finish_callback
+        self.cancelled = False
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.remaining = len(self.results)
+        if self.remaining == 0:
+            self._finish()
+
+    def _finish(self):
+        if self.finish_callback:
+            try:
+                self.finish_callback(self)
+            except Exception as error:
+                with print_mutex:
+                    sys.stderr.write("Error in finish callback of batch:\n\t%s\n" % str(error))
+        self.finished.set()
+
+    def job_finished(self):
+        # called once for each command, last one finishes batch
+        with self.lock:
+            self.remaining -= 1
+            last_job = self.remaining == 0
+        if last_job:
+            self._finish()
+
+    def all_done(self):
+        # True if all commands finished successfully, could be used in finish_callback
+        return all(result.status == "done" for result in self.results)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for process in self.processes.values():
+                try:
+                    # each command is started in its own process group, so children of shell are terminated too
+                    os.killpg(process.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def ready(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        # returns list of JobResult. Waiting is done by short intervals
+        # because Event.wait without timeout could not be interrupted by Ctrl+C in python 2
+        end_time = time.time() + timeout if timeout is not None else None
+        try:
+            while not self.finished.is_set():
+                if end_time is not None and time.time() >= end_time:
+                    break
+                self.finished.wait(1)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        return self.results
+
+    # for compatibility with AsyncResult returned by multiprocessing.Pool.map_async
+    get = wait
+
+    def successful(self):
+        return self.ready() and self.all_done()
+
+    def get_failed(self):
+        return [result for result in self.results if result.status == "failed"]
+
+    @staticmethod
+    def _wait_process(process):
+        # waits for process and returns its return code and resource usage(including usage of its children)
+        while True:
+            try:
+                pid, status, resource_usage = os.wait4(process.pid, 0)
+                break
+            except OSError as error:
+                if error.errno != errno.EINTR:
+                    raise
+        return_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        # process was already waited, so Popen must not wait for it again
+        process.returncode = return_code
+        return return_code, resource_usage
+
+    @staticmethod
+    def _read_usage(read_fd):
+        # returns (user_time, system_time, max_rss) written by helper or None if helper was killed before writing
+        try:
+            usage_string = os.read(read_fd, 256)
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+            usage_string = ""
+        finally:
+            os.close(read_fd)
+        if not usage_string.strip():
+            return None
+        user_time, system_time, max_rss = usage_string.split()
+        return float(user_time), float(system_time), int(max_rss)
+
+    def _reap_process(self, process):
+        # waits for terminated process to not leave zombie, second Ctrl+C kills its process group
+        try:
+            self._wait_process(process)
+        except KeyboardInterrupt:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self._wait_process(process)
+
+    def write_log(self, result):
+        if not self.log_file:
+            return
+        with log_mutex:
+            write_header = not os.path.exists(self.log_file)
+            with open(self.log_file, "a") as log_fd:
+                if write_header:
+                    log_fd.write("\t".join(JobResult.header_list) + "\n")
+                log_fd.write("%s\n" % str(result))
+
+    def run_job(self, index):
+        result = self.results[index]
+        while True:
+            with self.lock:
+                if self.cancelled:
+                    result.status = "cancelled"
+                    break
+                result.attempts += 1
+                result.status = "running"
+                with print_mutex:
+                    sys.stdout.write("Executing:\n\t%s\n" % result.command)
+                result.start_time = time.time()
+                # resource usage is read after helper is finished, so read end of pipe is nonblocking:
+                # write end could be inherited by processes started concurrently by other threads
+                read_fd, write_fd = os.pipe()
+                fcntl.fcntl(read_fd, fcntl.F_SETFL, fcntl.fcntl(read_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                # process is started under lock, so cancel() could not miss it
+                process = Popen([sys.executable, "-c", rusage_helper_code, str(write_fd), result.command],
+                                preexec_fn=os.setsid, close_fds=False)
+                os.close(write_fd)
+                self.processes[index] = process
+
+            try:
+                return_code, resource_usage = self._wait_process(process)
+            except KeyboardInterrupt:
+                # command runs in its own process group and doesn't receive Ctrl+C from terminal,
+                # so it is terminated explicitly(i.e. synchronous command started by Tool.execute)
+                self.cancel()
+                self._reap_process(process)
+                with self.lock:
+                    del self.processes[index]
+                os.close(read_fd)
+                raise
+
+            with self.lock:
+                del self.processes[index]
+            result.wall_time = time.time() - result.start_time
+            result.return_code = return_code
+            usage = self._read_usage(read_fd)
+            if usage is None:
+                result.user_time = resource_usage.ru_utime
+                result.system_time = resource_usage.ru_stime
+                result.max_rss = None
+            else:
+                result.user_time, result.system_time, result.max_rss = usage
+
+            if return_code == 0:
+                result.status = "done"
+                break
+            if self.cancelled:
+                result.status = "cancelled"
+                break
+            if result.attempts > self.retries:
+                result.status = "failed"
+                break
+            with print_mutex:
+                sys.stderr.write("Command failed with return code %i, restarting(attempt %i of %i):\n\t%s\n"
+                                 % (return_code, result.attempts + 1, self.retries + 1, result.command))
 
-def execute(exe_string):
-    # this function is global because of stutid damned pickle mode in python!!!!!
-    # use mutex to safe write to stdout from multiple threads
-    print_mutex.acquire()
-    sys.stdout.write("Executing:\n\t%s\n" % exe_string)
-    print_mutex.release()
+        if (result.status == "done") and self.callback:
+            try:
+                self.callback(index, result)
+            except Exception as error:
+                result.status = "failed"
+                with print_mutex:
+                    sys.stderr.write("Error in callback of command:\n\t%s\n\t%s\n" % (result.command, str(error)))
 
-    os.system(exe_string)
+        if result.status != "cancelled":
+            self.write_log(result)
+        if (result.status == "failed") and self.fail_fast and (not self.cancelled):
+            with print_mutex:
+                sys.stderr.write("Command failed with return code %i, cancelling other commands:\n\t%s\n"
+                                 % (result.return_code, result.command))
+            self.cancel()
+
+        self.job_finished()
+        return result
+
+
+class JobRunner(object):
+    # bounded pool of threads, each thread runs one shell command at a time via subprocess
+    # runner could be shared by several batches(for example passed as external_process_pool
+    # to parallel hmmscan and blast), then total number of simultaneously running commands is limited by max_jobs
+
+    def __init__(self, max_jobs=4):
+        self.max_jobs = max_jobs
+        self.queue = Queue()
+        self.threads = []
+
+    def _start_threads(self):
+        while len(self.threads) < self.max_jobs:
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            batch, index = task
+            try:
+                batch.run_job(index)
+            except Exception as error:
+                # job was not started(i.e. fork failed), batch must not wait for it forever
+                batch.results[index].status = "failed"
+                with print_mutex:
+                    sys.stderr.write("Error during execution of %s:\n\t%s\n" % (batch.results[index].command,
+                                                                                  str(error)))
+                batch.job_finished()
+
+    def submit(self, command_list, retries=0, fail_fast=True, log_file=None, callback=None, finish_callback=None):
+        # returns JobBatch immediately, use its wait() method to get results
+        batch = JobBatch(command_list, retries=retries, fail_fast=fail_fast, log_file=log_file, callback=callback,
+                         finish_callback=finish_callback)
+        self._start_threads()
+        for index in range(0, len(command_list)):
+            self.queue.put((batch, index))
+        return batch
+
+    def run(self, command_list, retries=0, fail_fast=True, log_file=None, callback=None, finish_callback=None):
+        return self.submit(command_list, retries=retries, fail_fast=fail_fast, log_file=log_file,
+                           callback=callback, finish_callback=finish_callback).wait()
+
+    def shutdown(self, wait=True):
+        # threads stop after all already submitted commands are finished
+        for thread in self.threads:
+            self.queue.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        self.threads = []
 
 
 class Tool(SequenceRoutines):
@@ -35,27 +352,33 @@ class Tool(SequenceRoutines):
         self.max_memory = max_memory
         self.timelog = timelog
 
+    def run_exe_string(self, exe_string, capture_output=False):
+        # returns file object with stdout if capture_output is set, JobResult otherwise
+        if capture_output:
+            sys.stdout.write("Executing:\n\t%s\n" % exe_string)
+            return Popen([exe_string], shell=True, stdout=PIPE).stdout  # returns file object
+
+        batch = JobBatch([exe_string], fail_fast=False, log_file=self.timelog)
+        return batch.run_job(0)
+
     def execute(self, options="", cmd=None, capture_output=False):
         command = cmd if cmd is not None else self.cmd
 
         exe_string = (self.check_path(self.path) if self.path else "") + command + " " + options
 
-        sys.stdout.write("Executing:\n\t%s\n" % exe_string)
-        if self.timelog:
-            os.system("date >> %s" % self.timelog)
-            with open(self.timelog, "a") as time_fd:
-                time_fd.write("Command\t%s\n" % exe_string)
-
-        exe_string = "time -f 'Time\\t%%E real,\\t%%U user,\\t%%S sys' -a -o %s %s" % (self.timelog, exe_string) if self.timelog else exe_string
-
-        if capture_output:
-            return Popen([exe_string], shell=True, stdout=PIPE).stdout  # returns file object
-        else:
-            os.system(exe_string)
-            return None
+        return self.run_exe_string(exe_string, capture_output=capture_output)
 
     def parallel_execute(self, options_list, cmd=None, capture_output=False, threads=None, dir_list=None,
-                         write_output_to_file=None, external_process_pool=None, async_run=False):
+                         write_output_to_file=None, external_process_pool=None, async_run=False,
+                         retries=0, fail_fast=True, dispatch_order=None, job_callback=None, finish_callback=None):
+        # external_process_pool - JobRunner shared with other calls, own runner with threads jobs is used if not set
+        # dispatch_order - list of indexes of options in order of execution(i.e. from longest job to shortest)
+        # job_callback - function called as job_callback(index, result) after each successful command,
+        #                index is an index in options_list regardless of dispatch_order
+        # finish_callback - function called as finish_callback(batch) after all commands are finished,
+        #                   in asynchronous mode it is the place for removal of temporary files
+        # returns JobBatch if async_run is set, list of JobResult otherwise(in order of dispatch)
+        # raises RuntimeError if some of commands failed
         command = cmd if cmd is not None else self.cmd
         if dir_list:
             if isinstance(dir_list, str):
@@ -75,14 +398,36 @@ class Tool(SequenceRoutines):
         with open("exe_list.t", "a") as exe_fd:
             for entry in exe_string_list:
                 exe_fd.write("%s\n" % entry)
-        process_pool = external_process_pool if external_process_pool else mp.Pool(threads if threads else self.threads)
 
-        results = process_pool.map_async(execute, exe_string_list) if async_run else process_pool.map(execute, exe_string_list)
-        #process_pool.close()
+        if dispatch_order is not None:
+            exe_string_list = [exe_string_list[index] for index in dispatch_order]
+        if job_callback and (dispatch_order is not None):
+            callback = lambda index, result: job_callback(dispatch_order[index], result)
+        else:
+            callback = job_callback
+
+        job_runner = external_process_pool if external_process_pool else JobRunner(threads if threads else self.threads)
+        batch = job_runner.submit(exe_string_list, retries=retries, fail_fast=fail_fast, log_file=self.timelog,
+                                  callback=callback, finish_callback=finish_callback)
+        if not external_process_pool:
+            # threads of own runner stop after batch is finished
+            job_runner.shutdown(wait=False)
+        if async_run:
+            return batch
+
+        results = batch.wait()
         if write_output_to_file:
             with open(write_output_to_file, "w") as out_fd:
-                out_fd.write(results)
-        return results if capture_output else None
+                out_fd.write("\t".join(JobResult.header_list) + "\n")
+                for result in results:
+                    out_fd.write("%s\n" % str(result))
+
+        failed_results = batch.get_failed()
+        if failed_results:
+            raise RuntimeError("%i of %i commands failed, first failed command(return code %i):\n\t%s"
+                               % (len(failed_results), len(results), failed_results[0].return_code,
+                                  failed_results[0].command))
+        return results
 
     
 class JavaTool(Tool):
@@ -104,17 +449,4 @@ class JavaTool(Tool):
 
         exe_string = (self.check_path(self.path) if self.path else "") + java_string
 
-        sys.stdout.write("Executing:\n\t%s\n" % exe_string)
-        if self.timelog:
-            os.system("date >> %s" % self.timelog)
-            with open(self.timelog, "a") as time_fd:
-                time_fd.write("Command\t%s\n" % exe_string)
-
-        exe_string = "time -f 'Time\\t%%E real,\\t%%U user,\\t%%S sys' -a -o %s %s" % (self.timelog, exe_string) if self.timelog else exe_string
-
-        if capture_output:
-            return Popen([exe_string], shell=True, stdout=PIPE).stdout  # returns file object
-        else:
-            os.system(exe_string)
-            return None
-
+        return self.run_exe_string(exe_string, capture_output=capture_output)
@@ -3,8 +3,11 @@ import os
 import shutil
 import numpy as np
 
-from Routines import FileRoutines, SequenceRoutines, MatplotlibRoutines, DrawingRoutines
+from itertools import groupby
+
+from Routines import FileRoutines, MatplotlibRoutines, DrawingRoutines
 from CustomCollections.GeneralCollections import IdList, SynDict
+from Parsers.AUGUSTUS import AUGUSTUSOutput, AUGUSTUSGene
 
 from Tools.Abstract import Tool
 from Tools.LinuxTools import CGAS
@@ -120,9 +123,7 @@ class AUGUSTUS(Tool):
         FileRoutines.safe_mkdir(splited_dir)
         FileRoutines.safe_mkdir(splited_out_dir)
 
-        self.split_fasta_by_seq_len(genome_file, splited_dir)
-
-        input_list_of_files = sorted(os.listdir(splited_dir))
+        input_list_of_files = map(os.path.basename, self.split_fasta_by_seq_len(genome_file, splited_dir))
         list_of_output_files = []
         options_list = []
         for filename in input_list_of_files:
@@ -142,109 +143,73 @@ class AUGUSTUS(Tool):
 
     def extract_proteins_from_output(self, augustus_output, protein_output, evidence_stats_file=None,
                                      supported_by_hints_file=None, complete_proteins_id_file=None, id_prefix="p."):
-        if evidence_stats_file:
-            ev_fd = open(evidence_stats_file, "w")
-            ev_fd.write("#gene_id\ttranscript_id\tsupported_fraction\tcds_support\tintron_support\t")
-            ev_fd.write("5'UTR_support\t3'UTR_support\tincompatible_hints_groups\tprotein_length\n")
-
-        if evidence_stats_file:
-            sup_fd = open(supported_by_hints_file, "w")
-            sup_fd.write("#gene_id\ttranscript_id\tsupported_fraction\tcds_support\tintron_support\t")
-            sup_fd.write("5'UTR_support\t3'UTR_support\tincompatible_hints_groups\tprotein_length\n")
-
-        if complete_proteins_id_file:
-            complete_fd = open(complete_proteins_id_file, "w")
+        """
+        Extracts in single pass over AUGUSTUS output proteins, evidence for all transcripts and for transcripts
+        supported by hints, ids of complete proteins and evidence, ids and proteins of longest isoforms
+        (<evidence_stats_file>.longest_pep, <evidence_stats_file>.longest_pep.ids,
+        <evidence_stats_file>.longest_pep.pep and the same files for supported_by_hints_file)
+        """
+        fd_list = []
+
+        def open_file(filename, header=None):
+            fd = open(filename, "w")
+            fd_list.append(fd)
+            if header:
+                fd.write(header)
+            return fd
+
+        def write_protein(fd, gene_id, transcript):
+            fd.write(">%s%s\t gene=%s start_presence=%s stop_presence=%s\n" % (id_prefix, transcript.id, gene_id,
+                                                                               str(transcript.start_presence),
+                                                                               str(transcript.stop_presence)))
+            fd.write(transcript.protein)
+            fd.write("\n")
+
+        try:
+            out_fd = open_file(protein_output)
+            complete_fd = open_file(complete_proteins_id_file) if complete_proteins_id_file else None
+
+            # tuples (evidence fd, longest isoform evidence fd, longest isoform id fd, longest isoform protein fd,
+            #         minimum supported fraction)
+            evidence_output_list = []
+            for evidence_file, minimum_supported_fraction in (evidence_stats_file, 0), \
+                                                             (supported_by_hints_file, 0.00001):
+                if evidence_file:
+                    evidence_output_list.append((open_file(evidence_file, AUGUSTUSOutput.evidence_header),
+                                                 open_file("%s.longest_pep" % evidence_file,
+                                                           AUGUSTUSOutput.evidence_header),
+                                                 open_file("%s.longest_pep.ids" % evidence_file),
+                                                 open_file("%s.longest_pep.pep" % evidence_file),
+                                                 minimum_supported_fraction))
 
-        with open(protein_output, "w") as out_fd:
             with open(augustus_output, "r") as in_fd:
-                for line in in_fd:
-                    if line[:12] == "# start gene":
-                        gene = line.strip().split()[-1]
-                    elif "\ttranscript\t" in line:
-                        transcript_id = line.split("\t")[8].split(";")[0].split("=")[1]
-                        start_presence = False
-                        stop_presence = False
-                        #out_fd.write(">%s%s\t gene=%s\n" % (id_prefix, transcript_id, gene))
-                    elif "\tstart_codon\t" in line:
-                        start_presence = True
-                    elif "\tstop_codon\t" in line:
-                        stop_presence = True
-                    elif "# protein sequence" in line:
-                        protein = line.strip().split("[")[-1]
-                        if "]" in protein:
-                            protein = protein.split("]")[0]
-                        else:
-                            while True:
-                                part = in_fd.next().split()[-1]
-                                if "]" in part:
-                                    protein += part.split("]")[0]
-                                    break
-                                else:
-                                    protein += part
-                        if complete_proteins_id_file:
-                            #print "AAAAA"
-                            #print (start_presence, stop_presence)
-                            if start_presence and stop_presence:
-                                complete_fd.write("%s%s\n" % (id_prefix, transcript_id))
-
-                        out_fd.write(">%s%s\t gene=%s start_presence=%s stop_presence=%s\n" % (id_prefix, transcript_id,
-                                                                                               gene,
-                                                                                               str(start_presence),
-                                                                                               str(stop_presence)))
-                        out_fd.write(protein)
-                        protein_len = len(protein)
-                        out_fd.write("\n")
-
-                    elif evidence_stats_file or supported_by_hints_file:
-                        if line[:17] == "# % of transcript":
-                            supported_fraction = line.strip().split()[-1]
-                            while True:
-                                tmp_line = in_fd.next()
-                                if tmp_line[:12] == "# CDS exons:":
-                                    cds_support = tmp_line.strip().split()[-1]
-                                elif tmp_line[:14] == "# CDS introns:":
-                                    introns_support = tmp_line.strip().split()[-1]
-                                elif tmp_line[:13] == "# 5'UTR exons":
-                                    five_utr_support = tmp_line.strip().split()[-1]
-                                elif tmp_line[:13] == "# 3'UTR exons":
-                                    three_introns_support = tmp_line.strip().split()[-1]
-                                elif tmp_line[:27] == "# incompatible hint groups:":
-                                    incompatible_hint_groups = tmp_line.strip().split()[-1]
-                                    if evidence_stats_file:
-                                        ev_fd.write("%s\t%s\t%s\t" % (gene, transcript_id, supported_fraction))
-                                        ev_fd.write("%s\t%s\t%s\t%s\t%s\t%i\n" % (cds_support, introns_support,
-                                                                                  five_utr_support,
-                                                                                  three_introns_support,
-                                                                                  incompatible_hint_groups,
-                                                                                  protein_len))
-                                    if supported_by_hints_file and (float(supported_fraction) > 0):
-                                        sup_fd.write("%s\t%s\t%s\t" % (gene, transcript_id, supported_fraction))
-                                        sup_fd.write("%s\t%s\t%s\t%s\t%s\t%i\n" % (cds_support, introns_support,
-                                                                                   five_utr_support,
-                                                                                   three_introns_support,
-                                                                                   incompatible_hint_groups,
-                                                                                   protein_len))
-
-                                    break
-
-        if evidence_stats_file:
-            ev_fd.close()
-
-        self.extract_longest_isoforms(evidence_stats_file, "%s.longest_pep" % evidence_stats_file,
-                                      minimum_supported_fraction=0)
-        SequenceRoutines.extract_sequence_by_ids(protein_output,
-                                                 "%s.longest_pep.ids" % evidence_stats_file,
-                                                 "%s.longest_pep.pep" % evidence_stats_file)
-
-        if supported_by_hints_file:
-            supported_by_hints_longest_pep_evidence = "%s.longest_pep" % supported_by_hints_file
-            supported_by_hints_longest_pep = "%s.longest_pep.pep" % supported_by_hints_file
-            supported_by_hints_longest_pep_ids = "%s.longest_pep.ids" % supported_by_hints_file
-            self.extract_longest_isoforms(evidence_stats_file, supported_by_hints_longest_pep_evidence,
-                                          minimum_supported_fraction=0.00001)
-            SequenceRoutines.extract_sequence_by_ids(protein_output,
-                                                     supported_by_hints_longest_pep_ids,
-                                                     supported_by_hints_longest_pep)
+                for gene in AUGUSTUSOutput.record_generator(in_fd):
+                    for transcript in gene.transcripts.values():
+                        if transcript.protein is not None:
+                            write_protein(out_fd, gene.id, transcript)
+                            if complete_fd and transcript.start_presence and transcript.stop_presence:
+                                complete_fd.write("%s%s\n" % (id_prefix, transcript.id))
+                        if not transcript.has_evidence():
+                            continue
+                        for ev_fd, longest_ev_fd, longest_id_fd, longest_pep_fd, minimum_supported_fraction \
+                                in evidence_output_list:
+                            if float(transcript.supported_fraction) >= minimum_supported_fraction:
+                                ev_fd.write(transcript.evidence_str(gene.id) + "\n")
+
+                    for ev_fd, longest_ev_fd, longest_id_fd, longest_pep_fd, minimum_supported_fraction \
+                            in evidence_output_list:
+                        longest_transcript = gene.get_longest_transcript(minimum_supported_fraction)
+                        if longest_transcript is None:
+                            continue
+                        longest_ev_fd.write(longest_transcript.evidence_str(gene.id) + "\n")
+                        longest_id_fd.write("%s\n" % longest_transcript.id)
+                        write_protein(longest_pep_fd, gene.id, longest_transcript)
+        finally:
+            for fd in fd_list:
+                fd.close()
+
+        if not evidence_stats_file:
+            return
 
         evidence_files = (evidence_stats_file,
                           "%s.longest_pep" % evidence_stats_file,
@@ -283,49 +248,31 @@ class AUGUSTUS(Tool):
 
     @staticmethod
     def extract_longest_isoforms(evidence_file, filtered_evidence_file, minimum_supported_fraction=0):
+        # evidence lines of the same gene are expected to go one after another as in AUGUSTUS output
         longest_id_file = "%s.ids" % filtered_evidence_file
-        ev_fd = open(evidence_file, "r")
-        with open(longest_id_file, "w") as id_fd:
+        with open(evidence_file, "r") as ev_fd:
+            with open(longest_id_file, "w") as id_fd:
                 with open(filtered_evidence_file, "w") as filtered_ev_fd:
                     filtered_ev_fd.write(ev_fd.readline())
-                    for line in ev_fd:
-                        prev_line = line
-                        line_list = prev_line.strip().split("\t")
-                        if float(line_list[2]) < minimum_supported_fraction:
-                            continue
-                        prev_gene = line_list[0]
-                        prev_transcript = line_list[1]
-                        prev_pep_len = line_list[-1]
-
-                        break
-                    for line in ev_fd:
-
-                        line_list = line.strip().split("\t")
-                        if float(line_list[2]) < minimum_supported_fraction:
+                    for gene, line_group in groupby(ev_fd, key=lambda line: line.split("\t", 1)[0]):
+                        isoform_list = []
+                        for line in line_group:
+                            line_list = line.strip().split("\t")
+                            isoform_list.append((int(line_list[-1]), line_list[2], (line_list[1], line)))
+                        longest_isoform = AUGUSTUSGene.select_longest_isoform(isoform_list,
+                                                                              minimum_supported_fraction)
+                        if longest_isoform is None:
                             continue
-                        gene = line_list[0]
-                        transcript = line_list[1]
-                        pep_len = line_list[-1]
-                        if gene == prev_gene:
-                            if pep_len > prev_pep_len:
-                                prev_line = line
-                                prev_gene = gene
-                                prev_transcript = transcript
-                                prev_pep_len = pep_len
-                            continue
-                        id_fd.write("%s\n" % prev_transcript)
-                        filtered_ev_fd.write(prev_line)
-                        prev_line = line
-                        prev_gene = gene
-                        prev_transcript = transcript
-                        prev_pep_len = pep_len
-                    # if script breaks here it means that prediction was made without hints or all genes doesnt have hint support
-                    id_fd.write("%s\n" % prev_transcript)
-        ev_fd.close()
+                        id_fd.write("%s\n" % longest_isoform[0])
+                        filtered_ev_fd.write(longest_isoform[1])
 
     @staticmethod
     def extract_CDS_annotations_from_output(augustus_output, CDS_output):
-        CGAS.grep("'\\tCDS\\t'", augustus_output, output=CDS_output, use_regexp=True)
+        with open(augustus_output, "r") as in_fd:
+            with open(CDS_output, "w") as out_fd:
+                for line in in_fd:
+                    if "\tCDS\t" in line:
+                        out_fd.write(line)
 
     @staticmethod
     def extract_gene_ids_from_output(augustus_output, all_genes_output):
@@ -353,10 +300,17 @@ class AUGUSTUS(Tool):
 
     def assign_synonyms_to_features_from_augustus_gff(self, input_gff, output_file, prefix,
                                                       number_of_digits_in_number=8, feature_type="gene"):
-        options = " > %s" % output_file
-        cmd = """grep -P "\\t%s\\t" %s | sed 's/.*ID=//;s/;.*//' | awk -F'\\t' 'BEGIN {NUMBER=1};{printf "%%s\\t%s%%0%ii\\n",$1,NUMBER; NUMBER=NUMBER+1;}'""" % (feature_type, input_gff, prefix, number_of_digits_in_number)
-
-        self.execute(options, cmd=cmd)
+        # features are numbered in order of their appearance, ids are taken from last ID= entry of line
+        # (as in previous grep | sed | awk implementation)
+        id_template = "%%s\t%s%%0%ii\n" % (prefix, number_of_digits_in_number)
+        number = 0
+        with open(input_gff, "r") as in_fd:
+            with open(output_file, "w") as out_fd:
+                for line in in_fd:
+                    if "\t%s\t" % feature_type not in line:
+                        continue
+                    number += 1
+                    out_fd.write(id_template % (line.rstrip("\n").split("ID=")[-1].split(";")[0], number))
 
     def assign_synonyms_to_annotations_from_augustus_gff(self, input_gff, output_prefix, species_prefix,
                                                          number_of_digits_in_number=8):
@@ -472,76 +426,60 @@ class AUGUSTUS(Tool):
         cds_id_template = "%sC%%0%ii" % (species_prefix, number_of_digits_in_id)
         with open(augustus_gff, "r") as in_fd:
             with open(output_gff, "w") as out_fd:
-                for line in in_fd:
-                    tmp = line.strip()
-                    if len(tmp) < 13:
-                        out_fd.write(line)
-                        continue
-                    if tmp[:12] != "# start gene":
-                        out_fd.write(line)
-                        continue
-                    augustus_gene_id = tmp.split(" ")[-1]
+                # lines outside of gene blocks are written as is
+                for gene in AUGUSTUSOutput.record_generator(in_fd, outside_line_handler=out_fd.write):
+                    augustus_gene_id = gene.id
                     gene_counter += 1
 
                     gene_syn_id = gene_id_template % gene_counter
                     genes_syn_dict[augustus_gene_id] = gene_syn_id
                     augustus_transcript_id = ""
-                    augustus_transcript_parent = ""
                     out_fd.write("# start gene %s\n" % gene_syn_id)
-                    tmp = in_fd.next().strip()
-                    while True:
-                        while tmp[0] != "#":
-                            tmp_list = tmp.split("\t")
-                            feature_type = tmp_list[2]
-                            edited_str = "\t".join(tmp_list[:-1])
-                            info_field_list = tmp_list[-1].split(";")
-                            if feature_type == "gene":
-                                edited_str += "\tID=%s\n" % gene_syn_id
-                            elif feature_type == "transcript":
-                                for entry in info_field_list:
-                                    if "ID" in entry:
-                                        augustus_transcript_id = entry.split("=")[-1]
-                                        if augustus_transcript_id not in transcripts_syn_dict:
-                                            transcripts_counter += 1
-                                            transcripts_syn_dict[augustus_transcript_id] = transcript_id_template % transcripts_counter
-                                        transcript_syn_id = transcripts_syn_dict[augustus_transcript_id]
-                                    if "Parent" in entry:
-                                        augustus_transcript_parent = entry.split("=")[-1]
-                                        if augustus_transcript_parent != augustus_gene_id:
-                                            raise ValueError("Transcript parent id and gene id are not same!")
-                                edited_str += "\tID=%s;Parent=%s\n" % (transcript_syn_id, gene_syn_id)
-                            elif feature_type == "CDS":
-                                for entry in info_field_list:
-                                    if "ID" in entry:
-                                        augustus_cds_id = entry.split("=")[-1]
-                                        if augustus_cds_id not in cds_syn_dict:
-                                            cds_counter += 1
-                                            cds_syn_dict[augustus_cds_id] = cds_id_template % cds_counter
-                                        cds_syn_id = cds_syn_dict[augustus_cds_id]
-                                    if "Parent" in entry:
-                                        augustus_cds_parent = entry.split("=")[-1]
-                                        if augustus_cds_parent != augustus_transcript_id:
-                                            raise ValueError("CDS parent id and transcript id are not same!")
-                                edited_str += "\tID=%s;Parent=%s\n" % (cds_syn_id, transcript_syn_id)
-                            elif (feature_type == "stop_codon") or (feature_type == "start_codon"):
-                                for entry in info_field_list:
-                                    if "Parent" in entry:
-                                        augustus_feature_parent = entry.split("=")[-1]
-                                        if augustus_feature_parent != augustus_transcript_id:
-                                            raise ValueError("Feature parent id and transcript id are not same!")
-                                edited_str += "\tParent=%s\n" % transcript_syn_id
-                            else:
-                                edited_str = tmp + "\n"
-
-                            out_fd.write(edited_str)
-                            tmp = in_fd.next().strip()
-                        while tmp[0] == "#":
-                            if "# end gene" in tmp:
-                                break
+                    for line in gene.lines[1:-1]:
+                        tmp = line.strip()
+                        if tmp[0] == "#":
                             out_fd.write(tmp + "\n")
-                            tmp = in_fd.next().strip()
-                        if "# end gene" in tmp:
-                                break
+                            continue
+                        tmp_list = tmp.split("\t")
+                        feature_type = tmp_list[2]
+                        edited_str = "\t".join(tmp_list[:-1])
+                        info_field_list = tmp_list[-1].split(";")
+                        if feature_type == "gene":
+                            edited_str += "\tID=%s\n" % gene_syn_id
+                        elif feature_type == "transcript":
+                            for entry in info_field_list:
+                                if "ID" in entry:
+                                    augustus_transcript_id = entry.split("=")[-1]
+                                    if augustus_transcript_id not in transcripts_syn_dict:
+                                        transcripts_counter += 1
+                                        transcripts_syn_dict[augustus_transcript_id] = transcript_id_template % transcripts_counter
+                                    transcript_syn_id = transcripts_syn_dict[augustus_transcript_id]
+                                if "Parent" in entry:
+                                    if entry.split("=")[-1] != augustus_gene_id:
+                                        raise ValueError("Transcript parent id and gene id are not same!")
+                            edited_str += "\tID=%s;Parent=%s\n" % (transcript_syn_id, gene_syn_id)
+                        elif feature_type == "CDS":
+                            for entry in info_field_list:
+                                if "ID" in entry:
+                                    augustus_cds_id = entry.split("=")[-1]
+                                    if augustus_cds_id not in cds_syn_dict:
+                                        cds_counter += 1
+                                        cds_syn_dict[augustus_cds_id] = cds_id_template % cds_counter
+                                    cds_syn_id = cds_syn_dict[augustus_cds_id]
+                                if "Parent" in entry:
+                                    if entry.split("=")[-1] != augustus_transcript_id:
+                                        raise ValueError("CDS parent id and transcript id are not same!")
+                            edited_str += "\tID=%s;Parent=%s\n" % (cds_syn_id, transcript_syn_id)
+                        elif (feature_type == "stop_codon") or (feature_type == "start_codon"):
+                            for entry in info_field_list:
+                                if "Parent" in entry:
+                                    if entry.split("=")[-1] != augustus_transcript_id:
+                                        raise ValueError("Feature parent id and transcript id are not same!")
+                            edited_str += "\tParent=%s\n" % transcript_syn_id
+                        else:
+                            edited_str = tmp + "\n"
+
+                        out_fd.write(edited_str)
                     out_fd.write("# end gene %s\n" % gene_syn_id)
         genes_syn_dict.write(genes_syn_file)
         transcripts_syn_dict.write(transcripts_syn_file)
@@ -4,6 +4,8 @@ __author__ = 'Sergei F. Kliver'
 import os
 import shutil
 
+from itertools import imap
+from multiprocessing import Pool
 from collections import OrderedDict
 from Tools.Abstract import Tool
 
@@ -89,9 +91,10 @@ class Exonerate(Tool):
                            num_of_files=None,
                            converted_output_dir="converted_output"):
         splited_filename = split_filename(query_file)
-        self.split_fasta(query_file, splited_fasta_dir, num_of_recs_per_file=num_of_recs_per_file,
-                         num_of_files=num_of_files,
-                         output_prefix=splited_filename[1])
+        splited_files = map(os.path.basename,
+                            self.split_fasta(query_file, splited_fasta_dir, num_of_recs_per_file=num_of_recs_per_file,
+                                             num_of_files=num_of_files,
+                                             output_prefix=splited_filename[1]))
 
         common_options = self.parse_common_options(model, show_alignment=show_alignment,
                                                    show_sugar=show_sugar, show_cigar=show_cigar,
@@ -101,7 +104,6 @@ class Exonerate(Tool):
                                                    other_options=other_options)
 
         options_list = []
-        splited_files = os.listdir(splited_fasta_dir)
 
         save_mkdir(splited_result_dir)
         #save_mkdir(converted_output_dir)
@@ -139,102 +141,159 @@ class Exonerate(Tool):
             #shutil.rmtree(splited_result_dir)
             #shutil.rmtree(converted_output_dir)
 
+    # suffixes of files produced by split_output
+    output_suffixes = OrderedDict([
+                                   ("vulgar", ".vulgar"),
+                                   ("cigar", ".cigar"),
+                                   ("sugar", ".sugar"),
+                                   ("alignment", ".alignment"),
+                                   ("gff", ".gff"),
+                                   ("target_gff", ".target.gff"),
+                                   ("query_gff", ".query.gff"),
+
+                                   ("splice", ".splice.gff"),
+                                   ("exon", ".exon.gff"),
+                                   ("intron", ".intron.gff"),
+                                   ("cds", ".cds.gff"),
+                                   ("gene", ".gene.gff"),
+
+                                   ("top_hits_vulgar", ".top_hits.vulgar"),
+                                   ("top_hits_sugar", ".top_hits.sugar"),
+                                   ("top_hits_query_gff", ".top_hits.query.gff"),
+                                   ("top_hits_simple", ".top_hits.query.simple"),
+                                   ])
+    # top hit streams and streams they are extracted from, top hit is first line of each run of lines
+    # with the same query id(first field)
+    top_hit_sources = OrderedDict([
+                                   ("top_hits_vulgar", "vulgar"),
+                                   ("top_hits_sugar", "sugar"),
+                                   ("top_hits_query_gff", "query_gff"),
+                                   ])
+
     @staticmethod
-    def split_output(exonerate_output_files, output_prefix):
-        names_dict = {
-                      "vulgar": "%s.vulgar" % output_prefix,
-                      "cigar": "%s.cigar" % output_prefix,
-                      "sugar": "%s.sugar" % output_prefix,
-                      "alignment": "%s.alignment" % output_prefix,
-                      "gff": "%s.gff" % output_prefix,
-                      "target_gff": "%s.target.gff" % output_prefix,
-                      "query_gff": "%s.query.gff" % output_prefix,
-
-                      "splice": "%s.splice.gff" % output_prefix,
-                      "exon": "%s.exon.gff" % output_prefix,
-                      "intron": "%s.intron.gff" % output_prefix,
-                      "cds": "%s.cds.gff" % output_prefix,
-                      "gene": "%s.gene.gff" % output_prefix,
-                      }
-        top_hits_gff = "%s.top_hits.gff" % output_prefix
-        top_hits_vulgar = "%s.top_hits.vulgar" % output_prefix
-        top_hits_sugar = "%s.top_hits.sugar" % output_prefix
-        top_hits_target_gff = "%s.top_hits.target.gff" % output_prefix
-        top_hits_query_gff = "%s.top_hits.query.gff" % output_prefix
-        top_hits_simple = "%s.top_hits.query.simple" % output_prefix
-
-        fd_dict = {}
-        for output_type in names_dict:
-            fd_dict[output_type] = open(names_dict[output_type], "w")
-
-        for filename in exonerate_output_files:
-            index = 0
-            with open(filename, "r") as in_fd:
-                #print u
-                #tmp = None
-                for line in in_fd:
-                    tmp = line
-                    if tmp[:13] == "C4 Alignment:":
-                        tmp = in_fd.next()
-                        fd_dict["alignment"].write(tmp)
-                        while True:
-                            tmp = next(in_fd, "")
-                            if (tmp[0] == "c") or (tmp[0] == "v") or (tmp[0] == "s") or (tmp[0] == "#"):
-                                break
-                            fd_dict["alignment"].write(tmp)
-                            if tmp == "":
-                                break
+    def parse_output_file(exonerate_output_file, output_prefix):
+        """
+        Splits single exonerate output file to files <output_prefix><suffix> for all output types
+        (see Exonerate.output_suffixes) in one pass. Top hits are extracted in the same pass.
+        GFF dumps are considered to be query and target gff in turn.
+        """
+        fd_dict = OrderedDict()
+        for output_type in Exonerate.output_suffixes:
+            fd_dict[output_type] = open("%s%s" % (output_prefix, Exonerate.output_suffixes[output_type]), "w")
+        last_query_dict = dict([(output_type, None) for output_type in Exonerate.top_hit_sources.values()])
+
+        def write_with_top_hit(output_type, line):
+            fd_dict[output_type].write(line)
+            if (line[0] == "#") or (not line.strip()):
+                return
+            query_id = line.split(None, 1)[0]
+            if query_id != last_query_dict[output_type]:
+                fd_dict["top_hits_%s" % output_type].write(line)
+                if output_type == "query_gff":
+                    tmp = line.rstrip("\n").split("\t")
+                    fd_dict["top_hits_simple"].write("%s\t%s\t%s\n" % (tmp[0], tmp[3], tmp[4]))
+            last_query_dict[output_type] = query_id
+
+        # state is None, "alignment_header", "alignment" or "gff"
+        state = None
+        gff_index = 0
+        with open(exonerate_output_file, "r") as in_fd:
+            for line in in_fd:
+                if state == "alignment_header":
+                    fd_dict["alignment"].write(line)
+                    state = "alignment"
+                    continue
+                if state == "alignment":
+                    if line[0] not in "cvs#":
+                        fd_dict["alignment"].write(line)
+                        continue
+                    state = None
+
+                if state == "gff":
+                    fd_dict["gff"].write(line)
+                    if gff_index == 0:
+                        write_with_top_hit("query_gff", line)
+                    else:
+                        fd_dict["target_gff"].write(line)
+                    if line[0] != "#":
+                        if "\tsplice" in line:
+                            fd_dict["splice"].write(line)
+                        elif "\texon\t" in line:
+                            fd_dict["exon"].write(line)
+                        elif "\tintron\t" in line:
+                            fd_dict["intron"].write(line)
+                        elif "\tcds\t" in line:
+                            fd_dict["cds"].write(line)
+                        elif "\tgene\t" in line:
+                            fd_dict["gene"].write(line)
+                    elif line == "# --- END OF GFF DUMP ---\n":
+                        state = None
+                        gff_index = 1 - gff_index
+                    continue
+
+                if line[:13] == "C4 Alignment:":
+                    state = "alignment_header"
+                elif line == "# --- START OF GFF DUMP ---\n":
+                    fd_dict["gff"].write(line)
+                    fd_dict["query_gff" if gff_index == 0 else "target_gff"].write(line)
+                    state = "gff"
+                elif line[:7] == "vulgar:":
+                    write_with_top_hit("vulgar", line[7:])
+                elif line[:6] == "sugar:":
+                    write_with_top_hit("sugar", line[6:])
+                elif line[:6] == "cigar:":
+                    fd_dict["cigar"].write(line[6:])
 
-                    if tmp == "# --- START OF GFF DUMP ---\n":
-                        fd_dict["gff"].write(tmp)
-                        if index == 0:
-                            fd_dict["query_gff"].write(tmp)
-                        else:
-                            fd_dict["target_gff"].write(tmp)
+        for output_type in fd_dict:
+            fd_dict[output_type].close()
 
-                        while True:
-                            tmp = next(in_fd, "")
-                            fd_dict["gff"].write(tmp)
-                            if index == 0:
-                                fd_dict["query_gff"].write(tmp)
-                            else:
-                                fd_dict["target_gff"].write(tmp)
-                            if tmp[0] != "#":
-                                if "\tsplice" in tmp:
-                                    fd_dict["splice"].write(tmp)
-                                elif "\texon\t" in tmp:
-                                    fd_dict["exon"].write(tmp)
-                                elif "\tintron\t" in tmp:
-                                    fd_dict["intron"].write(tmp)
-                                elif "\tcds\t" in tmp:
-                                    fd_dict["cds"].write(tmp)
-                                elif "\tgene\t" in tmp:
-                                    fd_dict["gene"].write(tmp)
+        return output_prefix
 
-                            if tmp == "# --- END OF GFF DUMP ---\n":
-                                break
-                        index = 1 if index == 0 else 0
-                        continue
+    @staticmethod
+    def split_output(exonerate_output_files, output_prefix, threads=1, tmp_dir=None):
+        """
+        Splits exonerate output files by output types(see Exonerate.output_suffixes).
+        Files are parsed concurrently by threads processes, results are merged in order of input files,
+        so output is the same regardless of number of threads.
+        """
+        tmp_directory = tmp_dir if tmp_dir else "%s.split_tmp" % output_prefix
+        save_mkdir(tmp_directory)
+        arguments_list = [(filename, "%s/%i" % (tmp_directory, index))
+                          for index, filename in enumerate(exonerate_output_files)]
+
+        fd_dict = OrderedDict()
+        for output_type in Exonerate.output_suffixes:
+            fd_dict[output_type] = open("%s%s" % (output_prefix, Exonerate.output_suffixes[output_type]), "w")
+        # query id of last top hit, used to join runs of lines with the same query id split between files
+        last_query_dict = dict([(output_type, None) for output_type in Exonerate.top_hit_sources])
+        last_query_dict["top_hits_simple"] = None
+
+        process_pool = Pool(threads) if threads > 1 else None
+        results = process_pool.imap(parse_exonerate_output_file, arguments_list) if process_pool \
+            else imap(parse_exonerate_output_file, arguments_list)
+
+        for shard_prefix in results:
+            for output_type in fd_dict:
+                shard_file = "%s%s" % (shard_prefix, Exonerate.output_suffixes[output_type])
+                with open(shard_file, "r") as in_fd:
+                    if output_type in last_query_dict:
+                        for line in in_fd:
+                            query_id = line.split(None, 1)[0] if line.strip() else None
+                            if query_id != last_query_dict[output_type]:
+                                fd_dict[output_type].write(line)
+                            last_query_dict[output_type] = query_id
+                    else:
+                        shutil.copyfileobj(in_fd, fd_dict[output_type])
+                os.remove(shard_file)
+
+        if process_pool:
+            process_pool.close()
+            process_pool.join()
 
-                    if tmp == "":
-                        break
-                    if tmp[:7] == "vulgar:":
-                        fd_dict["vulgar"].write(tmp[7:])
-                    elif tmp[:6] == "sugar:":
-                        fd_dict["sugar"].write(tmp[6:])
-                    elif tmp[:6] == "cigar:":
-                        fd_dict["cigar"].write(tmp[6:])
         for output_type in fd_dict:
             fd_dict[output_type].close()
 
-        # extract top hits from vulgar
-        awk_string_prefix = "awk '{if (substr($0,0,1) != \"#\") {if ($1 != SEQ_ID) {print $0}; SEQ_ID=$1}}' "
-        os.system(awk_string_prefix + " %s > %s" % (names_dict["vulgar"], top_hits_vulgar))
-        os.system(awk_string_prefix + " %s > %s" % (names_dict["sugar"], top_hits_sugar))
-        os.system(awk_string_prefix + " %s > %s" % (names_dict["query_gff"], top_hits_query_gff))
-
-        awk_string_prefix = "awk -F'\\t' '{printf \"%s\\t%s\\t%s\\n\",$1,$4,$5}' "
-        os.system(awk_string_prefix + " %s > %s" % (top_hits_query_gff, top_hits_simple))
+        shutil.rmtree(tmp_directory)
 
     @staticmethod
     def extract_top_hits_from_target_gff(list_of_target_gff, top_hits_gff, secondary_hits_gff, id_white_list_file=None,
@@ -338,5 +397,10 @@ class Exonerate(Tool):
         filtered_out_gff_fd.close()
 
 
+def parse_exonerate_output_file(arguments):
+    # wrapper for multiprocessing.Pool, arguments - tuple (exonerate output file, output prefix)
+    return Exonerate.parse_output_file(*arguments)
+
+
 if __name__ == "__main__":
     pass
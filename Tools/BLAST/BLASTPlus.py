@@ -5,8 +5,7 @@ import os
 from subprocess import PIPE, Popen
 
 from Tools.Abstract import Tool
-from Tools.LinuxTools import CGAS
-from Routines.File import check_path, save_mkdir, split_filename
+from Routines.File import check_path, save_mkdir, split_filename, ShardMerger
 from CustomCollections.GeneralCollections import SynDict
 
 class BLASTPlus(Tool):
@@ -40,15 +39,20 @@ class BLASTPlus(Tool):
         save_mkdir(splited_dir)
         save_mkdir(splited_out_dir)
 
-        number_of_files = num_of_seqs_per_scan if num_of_seqs_per_scan else 5 * threads if threads else 5 * self.threads
-        self.split_fasta(seqfile, splited_dir, num_of_files=number_of_files)
-        input_list_of_files = sorted(os.listdir(splited_dir))
+        if num_of_seqs_per_scan:
+            # files of consecutive queries, so merged output keeps order of queries
+            input_list_of_files = self.split_fasta(seqfile, splited_dir, num_of_files=num_of_seqs_per_scan,
+                                                   mode="consecutive")
+        else:
+            # files of consecutive queries with balanced total query length, so merged output keeps order of queries.
+            # files become smaller from first to last and are dispatched by decreasing size(see dispatch_order)
+            input_list_of_files = self.split_fasta_by_cost(seqfile, splited_dir,
+                                                           threads if threads else self.threads)
         list_of_files = []
 
-        for filename in input_list_of_files:
-            filename_prefix = split_filename(filename)[1]
+        for input_file in input_list_of_files:
+            filename_prefix = split_filename(input_file)[1]
 
-            input_file = "%s%s" % (splited_dir, filename)
             output_file = "%s%s.hits" % (splited_out_dir, filename_prefix)
 
             list_of_files.append((input_file, output_file))
@@ -68,11 +72,16 @@ class BLASTPlus(Tool):
             options_list.append(options)
             out_files.append(out_filename)
 
-        self.parallel_execute(options_list, cmd=blast_command, threads=threads, async_run=async_run,
-                              external_process_pool=external_process_pool)
+        # outputs of shards are appended to outfile in order of queries as soon as they are ready
+        merger = ShardMerger(out_files, outfile) if combine_output_to_single_file else None
+        dispatch_order = sorted(range(0, len(input_list_of_files)),
+                                key=lambda index: os.path.getsize(input_list_of_files[index]), reverse=True)
 
-        if combine_output_to_single_file:
-            CGAS.cat(out_files, output=outfile)
+        # JobBatch is returned in asynchronous mode, list of JobResult otherwise
+        return self.parallel_execute(options_list, cmd=blast_command, threads=threads, async_run=async_run,
+                                     external_process_pool=external_process_pool, dispatch_order=dispatch_order,
+                                     job_callback=(lambda index, result: merger.shard_finished(index)) if merger
+                                     else None)
 
     @staticmethod
     def extract_hits_from_tbl_output(blast_hits, output_file):
@@ -382,12 +391,12 @@ class BLASTn(Tool, BLASTPlus):
                         threads=None, num_of_seqs_per_scan=None,
                         combine_output_to_single_file=True):
 
-        self.parallel_blast("blastn", seqfile, database, outfile=outfile,
-                            blast_options=blast_options, split_dir=split_dir,
-                            splited_output_dir=splited_output_dir,
-                            evalue=evalue, output_format=output_format,
-                            threads=threads, num_of_seqs_per_scan=num_of_seqs_per_scan,
-                            combine_output_to_single_file=combine_output_to_single_file)
+        return self.parallel_blast("blastn", seqfile, database, outfile=outfile,
+                                   blast_options=blast_options, split_dir=split_dir,
+                                   splited_output_dir=splited_output_dir,
+                                   evalue=evalue, output_format=output_format,
+                                   threads=threads, num_of_seqs_per_scan=num_of_seqs_per_scan,
+                                   combine_output_to_single_file=combine_output_to_single_file)
 
 
 class BLASTp(Tool, BLASTPlus):
@@ -407,12 +416,12 @@ class BLASTp(Tool, BLASTPlus):
                         threads=None, num_of_seqs_per_scan=None,
                         combine_output_to_single_file=True):
 
-        self.parallel_blast("blastp", seqfile, database, outfile=outfile,
-                            blast_options=blast_options, split_dir=split_dir,
-                            splited_output_dir=splited_output_dir,
-                            evalue=evalue, output_format=output_format,
-                            threads=threads, num_of_seqs_per_scan=num_of_seqs_per_scan,
-                            combine_output_to_single_file=combine_output_to_single_file)
+        return self.parallel_blast("blastp", seqfile, database, outfile=outfile,
+                                   blast_options=blast_options, split_dir=split_dir,
+                                   splited_output_dir=splited_output_dir,
+                                   evalue=evalue, output_format=output_format,
+                                   threads=threads, num_of_seqs_per_scan=num_of_seqs_per_scan,
+                                   combine_output_to_single_file=combine_output_to_single_file)
 
 
 class DustMasker(Tool):
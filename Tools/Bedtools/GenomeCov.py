@@ -2,10 +2,13 @@
 __author__ = 'Sergei F. Kliver'
 
 import os
+from array import array
+
 import numpy as np
 
 from Tools.Abstract import Tool
-from Routines import MathRoutines
+from CustomCollections.CoverageCollections import CoverageRLE
+
 
 class GenomeCov(Tool):
     def __init__(self, path="", max_threads=4):
@@ -29,86 +32,80 @@ class GenomeCov(Tool):
 
         self.execute(options="", cmd=awk_string)
 
+    def get_coverage_rle(self, input_bam, genome_bed, scale=None):
+        # streams bedGraph(with zero coverage regions) from bedtools directly to run-length encoded coverage
+        # without intermediate files
+        options = " -ibam %s" % input_bam
+        options += " -bga"
+        options += " -scale %f" % scale if scale else ""
+        options += " -g %s" % genome_bed
+
+        bedgraph_fd = self.execute(options, capture_output=True)
+        coverage = CoverageRLE(bedgraph_fd, genome_file=genome_bed, value_type=float if scale else int)
+        bedgraph_fd.close()
+        return coverage
+
+    def analyze_coverage(self, input_bam, genome_bed, output_file, coverage_prefix=None, scale=None):
+        # writes coverage statistics per scaffold, if coverage_prefix is set
+        # coverage is saved in binary form(see CoverageRLE.save) and could be loaded memory-mapped
+        coverage = self.get_coverage_rle(input_bam, genome_bed, scale=scale)
+        coverage.write_stats(output_file)
+        if coverage_prefix:
+            coverage.save(coverage_prefix)
+        return coverage
+
+    @staticmethod
+    def analyze_bedgraph_file(bedgraph_file, output_file, genome_bed=None, value_type=int):
+        coverage = CoverageRLE(bedgraph_file, genome_file=genome_bed, value_type=value_type)
+        coverage.write_stats(output_file)
+        return coverage
+
+    @staticmethod
+    def analyze_per_base_coverage_file(coverage_file, output_file):
+        # analyzes output of bedtools genomecov -d scaffold by scaffold without collapsing
+        coverage = CoverageRLE()
+
+        def write_scaffold(scaffold, coverage_array):
+            coverage.add_per_base_coverage(scaffold, np.frombuffer(coverage_array, dtype=np.int64))
+            out_fd.write(coverage.format_stats(coverage.get_stats(scaffold)))
+            # only runs of current scaffold are kept in memory
+            del coverage[scaffold]
+
+        with open(coverage_file, "r") as in_fd:
+            with open(output_file, "w") as out_fd:
+                out_fd.write(coverage.stats_header)
+                current_scaffold = None
+                coverage_array = array("l")
+                for line in in_fd:
+                    if line == "\n":
+                        continue
+                    scaffold, position, value = line.split("\t")
+                    if scaffold != current_scaffold:
+                        if current_scaffold is not None:
+                            write_scaffold(current_scaffold, coverage_array)
+                        current_scaffold = scaffold
+                        coverage_array = array("l")
+                    coverage_array.append(int(value))
+                if current_scaffold is not None:
+                    write_scaffold(current_scaffold, coverage_array)
+
     @staticmethod
     def analyze_collapsed_coverage_file(collapsed_file, output_file):
+        coverage = CoverageRLE()
         line_number = 0
         with open(collapsed_file, "r") as in_fd:
             with open(output_file, "w") as out_fd:
-
-                output_header = "#Scaffold\tLength\tMean_coverage\tMedian_coverage\tMin_coverage\tMax_coverage\tCoveraged_positions\tZero_coverage_position_number\tZero_coveraged_region_number\tLeading_zero_covarage_len\tTrailing_zero_covarage_len\tZero_coverage_region_coordinates\tMean_coverage(without_zerocoveraged_ends)\tMedian_coverage(without_zerocoveraged_ends)\tLength_without_zero_coverage_ends\n"
-
-                out_fd.write(output_header)
+                out_fd.write(coverage.stats_header)
                 for line in in_fd:
                     line_number += 1
-                    #print (line_number)
-                    #print [line]
                     if line == "\n" or line == "":    # skip blank lines
                         continue
-                    tmp = line.strip().split("\t")
-                    #print tmp
-                    record_id = tmp[0]
-                    record_len = int(tmp[1])
-                    coverage_array = map(int, tmp[2].split(","))
+                    record_id, record_len, coverage_string = line.strip().split("\t")
+                    coverage_array = np.fromstring(coverage_string, dtype=np.int64, sep=",")
 
-                    if record_len != len(coverage_array):
+                    if int(record_len) != len(coverage_array):
                         raise ValueError("Malformed line %i" % line_number)
 
-                    mean_coverage = float(np.mean(coverage_array))
-                    median_coverage = float(np.median(coverage_array))
-                    min_coverage = float(np.min(coverage_array))
-                    max_coverage = float(np.max(coverage_array))
-                    coveraged_position_number = np.count_nonzero(coverage_array)
-
-                    zero_coverage_position_number, zero_coverage_regions_list = MathRoutines.find_flat_regions_in_array(coverage_array, value=0)
-
-                    if zero_coverage_position_number > 0:
-
-                        if zero_coverage_regions_list[0][0] == 0:
-                            leading_zero_coverage_len = zero_coverage_regions_list[0][1]
-                            start_coverage_coordinate = zero_coverage_regions_list[0][1]
-                        else:
-                            leading_zero_coverage_len = 0
-                            start_coverage_coordinate = 0
-
-                        if zero_coverage_regions_list[-1][0] + zero_coverage_regions_list[-1][1] == record_len:
-                            trailing_zero_coverage_len = zero_coverage_regions_list[-1][1]
-                            end_coverage_coordinate = zero_coverage_regions_list[-1][0]
-                        else:
-                            trailing_zero_coverage_len = 0
-                            end_coverage_coordinate = record_len
-
-                        zero_coveraged_region_number = len(zero_coverage_regions_list)
-                        zero_coverage_coordinates_list = []
-                        for (start, length) in zero_coverage_regions_list:
-                            zero_coverage_coordinates_list.append("%i-%i" % (start + 1, start + length))
-
-                    else:
-                        leading_zero_coverage_len = 0
-                        trailing_zero_coverage_len = 0
-                        zero_coveraged_region_number = 0
-                        start_coverage_coordinate = 0
-                        end_coverage_coordinate = record_len
-                        zero_coverage_coordinates_list = ["."]
-
-                    length_without_zerocoveraged_ends = end_coverage_coordinate - start_coverage_coordinate
-                    mean_coverage_without_zero_coverage_ends = float(np.mean(coverage_array[start_coverage_coordinate:end_coverage_coordinate]))
-                    median_coverage_without_zero_coverage_ends = float(np.median(coverage_array[start_coverage_coordinate:end_coverage_coordinate]))
-
-                    out_fd.write("%s\t%i\t%.2f\t%.2f\t%i\t%i\t%i\t%i\t%i\t%i\t%i\t%s\t%.2f\t%.2f\t%i\n" % (record_id,
-                                                                                                           record_len,
-                                                                                                           mean_coverage,
-                                                                                                           median_coverage,
-                                                                                                           min_coverage,
-                                                                                                           max_coverage,
-                                                                                                           coveraged_position_number,
-                                                                                                           zero_coverage_position_number,
-                                                                                                           zero_coveraged_region_number,
-                                                                                                           leading_zero_coverage_len,
-                                                                                                           trailing_zero_coverage_len,
-                                                                                                           ",".join(zero_coverage_coordinates_list),
-                                                                                                           mean_coverage_without_zero_coverage_ends,
-                                                                                                           median_coverage_without_zero_coverage_ends,
-                                                                                                           length_without_zerocoveraged_ends
-                                                                                                           ))
-
-
+                    coverage.add_per_base_coverage(record_id, coverage_array)
+                    out_fd.write(coverage.format_stats(coverage.get_stats(record_id)))
+                    del coverage[record_id]
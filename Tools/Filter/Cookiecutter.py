@@ -44,7 +44,7 @@ class Cookiecutter(Tool):
         options += " -N" if use_N_filter else ""
         options += " > %s" % stats_file
 
-        self.execute(options, cmd="rm_reads")
+        return self.execute(options, cmd="rm_reads")
 
 
 class CookiecutterOld(Tool):
@@ -21,7 +21,7 @@ class FaCut(Tool):
         options += " -n %s" % name_type if name_type else ""
         options += " > %s" % stat_file if stat_file else ""
 
-        self.execute(options, cmd="filter_by_mean_quality")
+        return self.execute(options, cmd="filter_by_mean_quality")
 
     def split_fastq(self, input_file, output_prefix):
 
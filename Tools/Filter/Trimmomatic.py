@@ -70,7 +70,7 @@ class Trimmomatic(JavaTool):
 
         options += " > %s 2>&1" % logfile if logfile else ""
 
-        self.execute(options=options)
+        return self.execute(options=options)
 
     @staticmethod
     def parse_log(log_file):
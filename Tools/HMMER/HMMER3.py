@@ -8,7 +8,7 @@ from Bio import SearchIO
 from Tools.Abstract import Tool
 from Tools.LinuxTools import CGAS
 from CustomCollections.GeneralCollections import IdList, SynDict
-from Routines.File import check_path, split_filename, read_ids, save_mkdir
+from Routines.File import check_path, split_filename, read_ids, save_mkdir, ShardMerger
 
 
 class HMMER3(Tool):
@@ -237,6 +237,11 @@ class HMMER3(Tool):
 
         self.execute(options, cmd="hmmscan")
 
+    @staticmethod
+    def replace_description(line):
+        # biopython 1.65 fails on some descriptions in hmmscan output
+        return "Description: <unknown description>\n" if line[:12] == "Description:" else line
+
     def parallel_hmmscan(self, hmmfile, seqfile, outfile, num_of_seqs_per_scan=None, split_dir="splited_fasta",
                          splited_output_dir="splited_output_dir",
                          tblout_outfile=None, domtblout_outfile=None, pfamtblout_outfile=None,
@@ -269,15 +274,20 @@ class HMMER3(Tool):
         if splited_pfamtblout_dir:
             save_mkdir(splited_pfamtblout_dir)
 
-        number_of_files = num_of_seqs_per_scan if num_of_seqs_per_scan else 5 * threads if threads else 5 * self.threads
-        self.split_fasta(seqfile, splited_dir, num_of_files=number_of_files)
-        input_list_of_files = sorted(os.listdir(splited_dir))
+        if num_of_seqs_per_scan:
+            # files of consecutive queries, so merged output keeps order of queries
+            input_list_of_files = self.split_fasta(seqfile, splited_dir, num_of_files=num_of_seqs_per_scan,
+                                                   mode="consecutive")
+        else:
+            # files of consecutive queries with balanced total query length, so merged output keeps order of queries.
+            # files become smaller from first to last and are dispatched by decreasing size(see dispatch_order)
+            input_list_of_files = self.split_fasta_by_cost(seqfile, splited_dir,
+                                                           threads if threads else self.threads)
         list_of_files = []
 
-        for filename in input_list_of_files:
-            filename_prefix = split_filename(filename)[1]
+        for input_file in input_list_of_files:
+            filename_prefix = split_filename(input_file)[1]
 
-            input_file = "%s%s" % (splited_dir, filename)
             output_file = "%s%s.hits" % (splited_out_dir, filename_prefix)
             tblout_file = "%s%s.hits" % (splited_tblout_dir, filename_prefix) if splited_tblout_dir else None
             domtblout_file = "%s%s.hits" % (splited_domtblout_dir, filename_prefix) if splited_domtblout_dir else None
@@ -329,30 +339,37 @@ class HMMER3(Tool):
             domtblout_files.append(domtblout_file)
             pfamtblout_files.append(pfamtblout_file)
 
-        self.parallel_execute(options_list, cmd="hmmscan", threads=threads, async_run=async_run,
-                              external_process_pool=external_process_pool)
-
+        # outputs of shards are appended to final files in order of queries as soon as they are ready
+        merger_list = []
         if combine_output_to_single_file:
-            if biopython_165_compartibility:
-                CGAS.cgas(out_files, sed_string="s/^Description:.*/Description: <unknown description>/", output=outfile)
-            else:
-                CGAS.cat(out_files, output=outfile)
-        if tblout_outfile:
-            CGAS.cat(tblout_files, output=tblout_outfile)
-        if domtblout_outfile:
-            CGAS.cat(domtblout_files, output=domtblout_outfile)
-        if pfamtblout_outfile:
-            CGAS.cat(pfamtblout_files, output=pfamtblout_outfile)
-
-        if remove_tmp_dirs:
-            if splited_tblout_dir:
-                shutil.rmtree(splited_tblout_dir)
-            if splited_domtblout_dir:
-                shutil.rmtree(splited_domtblout_dir)
-            if splited_pfamtblout_dir:
-                shutil.rmtree(splited_pfamtblout_dir)
-            for tmp_dir in splited_dir, splited_out_dir:
-                shutil.rmtree(tmp_dir)
+            line_function = self.replace_description if biopython_165_compartibility else None
+            merger_list.append(ShardMerger(out_files, outfile, line_function=line_function,
+                                           remove_shards=remove_tmp_dirs))
+        for merged_file, shard_files in ((tblout_outfile, tblout_files), (domtblout_outfile, domtblout_files),
+                                         (pfamtblout_outfile, pfamtblout_files)):
+            if merged_file:
+                merger_list.append(ShardMerger(shard_files, merged_file, remove_shards=remove_tmp_dirs))
+
+        def merge_shard(index, result):
+            for merger in merger_list:
+                merger.shard_finished(index)
+
+        dispatch_order = sorted(range(0, len(input_list_of_files)),
+                                key=lambda index: os.path.getsize(input_list_of_files[index]), reverse=True)
+
+        def remove_tmp_files(batch):
+            # temporary files are kept if some of scans failed
+            if not (remove_tmp_dirs and batch.all_done()):
+                return
+            for tmp_dir in splited_tblout_dir, splited_domtblout_dir, splited_pfamtblout_dir, \
+                    splited_dir, splited_out_dir:
+                if tmp_dir:
+                    shutil.rmtree(tmp_dir)
+
+        # temporary files are removed after the last scan, so it works for asynchronous run too
+        return self.parallel_execute(options_list, cmd="hmmscan", threads=threads, async_run=async_run,
+                                     external_process_pool=external_process_pool, dispatch_order=dispatch_order,
+                                     job_callback=merge_shard, finish_callback=remove_tmp_files)
 
     def hmmsearch(self, hmmfile, seqfile, outfile, multialignout=None, tblout=None, domtblout=None, pfamtblout=None,
                   dont_output_alignments=False, model_evalue_threshold=None, model_score_threshold=None,
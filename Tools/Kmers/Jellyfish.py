@@ -11,6 +11,7 @@ import matplotlib.pyplot as plt
 
 from Tools.Abstract import Tool
 from Routines import MatplotlibRoutines, MathRoutines
+from CustomCollections.HistogramCollections import KmerHistogramCollection
 
 
 class Jellyfish(Tool):
@@ -223,6 +224,33 @@ class Jellyfish(Tool):
 
             plt.close()
 
+    def analyze_histo_files(self, histo_files, output_prefix, kmer_length=23, order=3, mode="wrap",
+                            check_peaks_coef=10, write_sample_reports=True, draw=False,
+                            output_formats=["svg", "png"], logbase=10, non_log_low_limit=5, non_log_high_limit=100):
+        """
+        histo_files - dict sample id: histo file or list of histo files(sample ids are names of files
+        without directory and extension then).
+        All histograms are loaded to one array and statistics are calculated for all samples at once,
+        table with statistics is written to <output_prefix>.histo.stats.tab and reports for each sample
+        to <output_prefix>.<sample_id>.histo.stats. Drawing of distributions(draw=True) is a separate stage
+        performed by draw_kmer_distribution for each sample.
+        """
+        histo_file_dict = KmerHistogramCollection.get_histo_file_dict(histo_files)
+        collection = KmerHistogramCollection.read(histo_file_dict)
+        collection.calculate_stats(order=order, mode=mode, check_peaks_coef=check_peaks_coef)
+        collection.write_stats("%s.histo.stats.tab" % output_prefix)
+        if write_sample_reports:
+            collection.write_sample_reports(output_prefix)
+
+        if draw:
+            for sample_id in collection.sample_ids:
+                self.draw_kmer_distribution(histo_file_dict[sample_id], kmer_length,
+                                            "%s.%s" % (output_prefix, sample_id), output_formats=output_formats,
+                                            logbase=logbase, non_log_low_limit=non_log_low_limit,
+                                            non_log_high_limit=non_log_high_limit, order=order, mode=mode,
+                                            check_peaks_coef=check_peaks_coef)
+        return collection
+
     @staticmethod
     def find_peak_indexes_from_histo(counts, order=3, mode="wrap"):
         """
@@ -281,21 +309,17 @@ class Jellyfish(Tool):
         nearest_value_to_first_min_idx = MathRoutines.find_nearest_scalar(counts[local_maximums_idx[first_unique_peak_idx_idx]:],
                                                                           counts[local_minimums_idx[0]]) + local_maximums_idx[first_unique_peak_idx_idx]
 
-        number_of_distinct_kmers = sum(counts)
-        number_of_distinct_kmers_with_errors = sum(counts[0:local_minimums_idx[0]])
-        total_number_of_kmers = sum(np.multiply(counts, bins))
-        total_number_of_kmers_with_errors = sum(np.multiply(counts[0:local_minimums_idx[0]],
-                                                                     bins[0:local_minimums_idx[0]]))
+        number_of_distinct_kmers = np.sum(counts)
+        number_of_distinct_kmers_with_errors = np.sum(counts[0:local_minimums_idx[0]])
+        total_number_of_kmers = np.sum(np.multiply(counts, bins))
+        total_number_of_kmers_with_errors = np.sum(np.multiply(counts[0:local_minimums_idx[0]],
+                                                               bins[0:local_minimums_idx[0]]))
 
         maximums_to_show = [(bins[i], counts[i]) for i in peaks_in_checked_area_idx]
         minimums_to_show = [(bins[i], counts[i]) for i in minimums_in_checked_area_idx]
 
-        estimated_genome_size = 0
-
-        for i in range(int(minimums_to_show[0][0]), len(counts)):
-            estimated_genome_size += counts[i] * bins[i]
-
-        estimated_genome_size = estimated_genome_size/first_unique_peak_coverage
+        estimated_genome_size = np.sum(np.multiply(counts[int(minimums_to_show[0][0]):],
+                                                   bins[int(minimums_to_show[0][0]):])) / first_unique_peak_coverage
 
         return maximums_to_show, \
                minimums_to_show, \
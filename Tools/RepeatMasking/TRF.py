@@ -66,8 +66,10 @@ class TRF(Tool):
                                       max_len_per_file=100000, store_intermediate_files=False):
         work_dir = os.getcwd()
         splited_filename = split_filename(query_file)
-        self.split_fasta_by_seq_len(query_file, splited_fasta_dir, max_len_per_file=max_len_per_file,
-                                    output_prefix=splited_filename[1])
+        splited_files = map(os.path.basename,
+                            self.split_fasta_by_seq_len(query_file, splited_fasta_dir,
+                                                        max_len_per_file=max_len_per_file,
+                                                        output_prefix=splited_filename[1]))
 
         common_options = self.parse_common_options(matching_weight=matching_weight,
                                                    mismatching_penalty=mismatching_penalty,
@@ -79,7 +81,6 @@ class TRF(Tool):
                                                    make_dat_file=True)
         common_options += " -h"  # suppress html output
         options_list = []
-        splited_files = os.listdir(splited_fasta_dir)
 
         save_mkdir(splited_result_dir)
         save_mkdir(converted_output_dir)
@@ -2,6 +2,7 @@
 
 from Tools.Abstract import Tool
 from Routines import DrawingRoutines
+from CustomCollections.HistogramCollections import InsertSizeHistogram
 
 class SamtoolsV1(Tool):
     """
@@ -136,88 +137,60 @@ class SamtoolsV1(Tool):
                      sort_by_name=sort_by_name, max_memory_per_thread=max_memory_per_thread)
         self.index(output_bam)
 
-    def get_insert_sizes(self, input_sam, output_prefix):
-
-        output_concordant_only = "%s.concordant.len" % output_prefix
-        output_discordant_only = "%s.discordant.len" % output_prefix
-        output_all = "%s.all.len" % output_prefix
+    def get_insert_sizes(self, input_sam, output_prefix, width_of_bin=1, max_insert_size=100000, max_pairs=None):
+        # insert sizes of concordant, discordant and all pairs are binned in one pass over samtools view output,
+        # histograms are written to <output_prefix>.insert_size.histo
+        # max_pairs - stop after this number of pairs
+        output_histo = "%s.insert_size.histo" % output_prefix
 
         common_flags_for_filtering_out = self.bam_flags["supplementary_alignment"]
         common_flags_for_filtering_out += self.bam_flags["not_primary_alignment"]
         common_flags_for_filtering_out += self.bam_flags["read_unmapped"]
         common_flags_for_filtering_out += self.bam_flags["mate_unmapped"]
 
-        flags_for_discordant_only = common_flags_for_filtering_out + self.bam_flags["read_mapped_in_proper_pair"]
-
-        samtools_options_for_discordant_only = " -F %i" % flags_for_discordant_only
-        samtools_options_for_discordant_only += " %s" % input_sam
-
-        samtools_options_for_concordant_only = " -F %i" % common_flags_for_filtering_out
-        samtools_options_for_concordant_only += " -f %i" % self.bam_flags["read_mapped_in_proper_pair"]
-        samtools_options_for_concordant_only += " %s" % input_sam
-
-        samtools_string_for_discordant_only = "samtools view %s" % samtools_options_for_discordant_only
-        samtools_string_for_concordant_only = "samtools view %s" % samtools_options_for_concordant_only
+        samtools_options = " -F %i" % common_flags_for_filtering_out
+        samtools_options += " %s" % input_sam
 
-        awk_string = "awk -F'\\t' '{ if ($9 > 0) print $9}'"
-        cmd_discordant_only = "%s | %s > %s" % (samtools_string_for_discordant_only, awk_string, output_discordant_only)
-        cmd_concordant_only = "%s | %s > %s" % (samtools_string_for_concordant_only, awk_string, output_concordant_only)
-        print(cmd_discordant_only)
-        print(cmd_concordant_only)
+        histogram = InsertSizeHistogram(width_of_bin=width_of_bin, max_insert_size=max_insert_size)
+        sam_fd = self.execute(options=samtools_options, cmd="samtools view", capture_output=True)
+        histogram.read_sam_stream(sam_fd, max_pairs=max_pairs, filter_flags=common_flags_for_filtering_out)
+        sam_fd.close()
 
-        self.parallel_execute(options_list=[cmd_concordant_only, cmd_discordant_only], cmd="", threads=2,)
+        histogram.write(output_histo)
 
-        cat_cmd = "cat %s %s > %s" % (output_discordant_only, output_concordant_only, output_all)
-        self.execute(cmd=cat_cmd)
+        return histogram
 
     def draw_insert_size_distribution(self, input_sam, output_prefix, width_of_bin=5, max_insert_size=1200,
-                                      min_insert_size=0, extensions=("png",), separator="\n", logbase=10):
-
-        output_concordant_only_file = "%s.concordant.len" % output_prefix
-        output_discordant_only_file = "%s.discordant.len" % output_prefix
-        output_all_file = "%s.all.len" % output_prefix
-
-        self.get_insert_sizes(input_sam, output_prefix)
-        """
-        DrawingRoutines.draw_tetra_histogram_with_two_logscaled_from_file([output_concordant_file, output_all_file],
-                                                                          output_prefix, figsize=(10, 10),
-                                                                          number_of_bins_list=None,
-                                                                          width_of_bins_list=[width_of_bin, width_of_bin],
-                                                                          max_threshold_list=[max_insert_size, max_insert_size],
-                                                                          min_threshold_list=[min_insert_size, min_insert_size],
-                                                                          xlabel="Insert size",
-                                                                          ylabel="Number of fragments",
-                                                                          title_list=["Concordant pairs", "All pairs"],
-                                                                          logbase=logbase,
-                                                                          label_list=None,
-                                                                          extensions=extensions,
-                                                                          suptitle="Insert size distribution",
-                                                                          separator=separator)
-        """
-        DrawingRoutines.draw_hexa_histogram_with_three_logscaled_from_file([output_concordant_only_file,
-                                                                           output_discordant_only_file,
-                                                                           output_all_file],
-                                                                           output_prefix, figsize=(15, 10),
-                                                                           number_of_bins_list=None,
-                                                                           width_of_bins_list=[width_of_bin,
-                                                                                               width_of_bin,
-                                                                                               width_of_bin],
-                                                                           max_threshold_list=[max_insert_size,
-                                                                                               max_insert_size,
-                                                                                               max_insert_size],
-                                                                           min_threshold_list=[min_insert_size,
-                                                                                               min_insert_size,
-                                                                                               min_insert_size],
-                                                                           xlabel="Insert size",
-                                                                           ylabel="Number of fragments",
-                                                                           title_list=["Concordant pairs",
-                                                                                       "Discordant pairs",
-                                                                                       "All pairs"],
-                                                                           logbase=logbase,
-                                                                           label_list=None,
-                                                                           extensions=extensions,
-                                                                           suptitle="Insert size distribution",
-                                                                           separator=separator)
+                                      min_insert_size=0, extensions=("png",), logbase=10, max_pairs=None):
+
+        histogram = self.get_insert_sizes(input_sam, output_prefix, max_insert_size=max_insert_size,
+                                          max_pairs=max_pairs)
+        bin_starts = histogram.get_bin_starts()
+        categories = ["concordant", "discordant", "all"]
+
+        DrawingRoutines.draw_hexa_histogram_with_three_logscaled([bin_starts] * 3,
+                                                                 output_prefix, figsize=(15, 10),
+                                                                 number_of_bins_list=None,
+                                                                 width_of_bins_list=[width_of_bin,
+                                                                                     width_of_bin,
+                                                                                     width_of_bin],
+                                                                 max_threshold_list=[max_insert_size,
+                                                                                     max_insert_size,
+                                                                                     max_insert_size],
+                                                                 min_threshold_list=[min_insert_size,
+                                                                                     min_insert_size,
+                                                                                     min_insert_size],
+                                                                 xlabel="Insert size",
+                                                                 ylabel="Number of fragments",
+                                                                 title_list=["Concordant pairs",
+                                                                             "Discordant pairs",
+                                                                             "All pairs"],
+                                                                 logbase=logbase,
+                                                                 label_list=None,
+                                                                 extensions=extensions,
+                                                                 suptitle="Insert size distribution",
+                                                                 weights_list=[histogram.get_counts(category)
+                                                                               for category in categories])
 
 class SamtoolsV0(SamtoolsV1, Tool):
     """
@@ -12,7 +12,9 @@ parser.add_argument("-i", "--input", action="store", dest="input", required=True
                     help="Input comma-separated list of files/directories with exonerate output")
 parser.add_argument("-o", "--output_prefix", action="store", dest="output_prefix",
                     help="Prefix of output files")
+parser.add_argument("-t", "--threads", action="store", dest="threads", type=int, default=1,
+                    help="Number of processes to parse input files. Default: 1")
 
 args = parser.parse_args()
 
-Exonerate.split_output(args.input, args.output_prefix)
+Exonerate.split_output(args.input, args.output_prefix, threads=args.threads)
@@ -20,7 +20,15 @@ parser.add_argument("-o", "--output_dir", action="store", dest="output_dir",
                     type=lambda s: check_path(os.path.abspath(s)),
                     default="./", help="Directory to write output. Default: current directory")
 parser.add_argument("-t", "--threads", action="store", dest="threads", default=1, type=int,
-                    help="Number of threads to use in Trimmomatic. Default - 1.")
+                    help="Total number of threads. They are divided between samples handled in parallel. "
+                         "Default - 1.")
+parser.add_argument("-w", "--samples_in_parallel", action="store", dest="samples_in_parallel", default=1, type=int,
+                    help="Number of samples to handle simultaneously. Default - 1.")
+parser.add_argument("--max_memory", action="store", dest="max_memory", type=int,
+                    help="Total memory available(in gigabytes). "
+                         "Limits number of samples handled in parallel if --trimmomatic_memory is set")
+parser.add_argument("--trimmomatic_memory", action="store", dest="trimmomatic_memory", type=int,
+                    help="Memory for single Trimmomatic run(in gigabytes)")
 
 parser.add_argument("-a", "--adapters", action="store", dest="adapters", type=os.path.abspath,
                     required=True,
@@ -64,6 +72,10 @@ parser.add_argument("--skip_coockiecutter", action="store_true",
                     help="Skip filtration by coockiecutter")
 parser.add_argument("-z", "--read_name_type", action="store", dest="read_name_type", default="illumina",
                     help="Read name type")
+parser.add_argument("--no_resume", action="store_false", dest="resume", default=True,
+                    help="Rerun all stages. By default stages finished in previous run are skipped")
+parser.add_argument("--use_named_pipes", action="store_true", dest="use_named_pipes", default=False,
+                    help="Don't write merged raw reads to disk, stream them to first filtering tool via named pipes")
 
 
 args = parser.parse_args()
@@ -90,4 +102,7 @@ FilteringPipeline.filter(args.samples_dir, args.output_dir, args.adapter_kmers,
                          crop_length=None, head_crop_length=None, min_len=args.min_len,
                          base_quality=args.base_quality, read_name_type=args.read_name_type,
                          remove_intermediate_files=args.remove_intermediate_files,
-                         skip_coockiecutter=args.skip_coockiecutter)
+                         skip_coockiecutter=args.skip_coockiecutter,
+                         samples_in_parallel=args.samples_in_parallel, max_memory=args.max_memory,
+                         trimmomatic_memory=args.trimmomatic_memory, resume=args.resume,
+                         use_named_pipes=args.use_named_pipes)
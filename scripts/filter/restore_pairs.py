@@ -1,16 +1,12 @@
 #!/usr/bin/env python
 __author__ = 'Sergei F. Kliver'
 """
-Script is very slow because it uses Biopython SeqIO to parse fastq.
-Use it only for small fastqs
+Reads are paired in sequential passes without index. If input files are in the same order(sorted by name or
+both obtained by filtering of the same pair of files) streaming merge-join is used, otherwise reads are
+hash-partitioned to temporary files.
 """
-import os
-import re
-import sys
 import argparse
 
-from Bio import SeqIO
-
 from Routines import SequenceRoutines
 
 
@@ -25,41 +21,35 @@ parser.add_argument("-r", "--input_right", action="store", dest="input_right", t
                     help="Comma-separated list of files with left reads")
 parser.add_argument("-o", "--out_prefix", action="store", dest="out_prefix", required=True,
                     help="Prefix of output files")
+parser.add_argument("-m", "--mode", action="store", dest="mode", default="auto",
+                    help="Pairing mode. Allowed: 'ordered' - input files are in the same order, "
+                         "'partition' - input files are unordered, "
+                         "'auto'(default) - try 'ordered' and switch to 'partition' if files are unordered")
+parser.add_argument("-a", "--left_suffix", action="store", dest="left_suffix", default="",
+                    help="Suffix of read ids in left files(i.e. '/1'). Default: no suffix")
+parser.add_argument("-b", "--right_suffix", action="store", dest="right_suffix", default="",
+                    help="Suffix of read ids in right files(i.e. '/2'). Default: no suffix")
+parser.add_argument("-p", "--number_of_partitions", action="store", dest="number_of_partitions", type=int,
+                    default=64, help="Number of temporary files per input in 'partition' mode. Default: 64")
+parser.add_argument("-t", "--tmp_dir", action="store", dest="tmp_dir", default="pairing_tmp",
+                    help="Directory for temporary files in 'partition' mode. Default: pairing_tmp")
 
 args = parser.parse_args()
 
-out_left = "%s_1.fastq" % args.out_prefix
-out_right = "%s_2.fastq" % args.out_prefix
-out_left_se = "%s_1.se.fastq" % args.out_prefix
-out_right_se = "%s_2.se.fastq" % args.out_prefix
-
-out_left_fd = open("%s_1.fastq" % args.out_prefix, "w")
-out_right_fd = open("%s_2.fastq" % args.out_prefix, "w")
-out_left_se_fd = open("%s_1.se.fastq" % args.out_prefix, "w")
-out_right_se_fd = open("%s_2.se.fastq" % args.out_prefix, "w")
-
-left_input_reads_dict = SeqIO.index_db("left_in_reads.idx", args.input_left, "fastq")
-right_input_reads_dict = SeqIO.index_db("right_in_reads.idx", args.input_right, "fastq")
-
-left_input_set = set(left_input_reads_dict.keys())
-right_input_set = set(right_input_reads_dict.keys())
-
-
-SeqIO.write(SequenceRoutines.record_by_id_generator(left_input_reads_dict,
-                                                    sorted(left_input_set & right_input_set),
-                                                    verbose=True), out_left, "fastq")
-SeqIO.write(SequenceRoutines.record_by_id_generator(right_input_reads_dict,
-                                                    sorted(left_input_set & right_input_set),
-                                                    verbose=True), out_right, "fastq")
-SeqIO.write(SequenceRoutines.record_by_id_generator(left_input_reads_dict,
-                                                    left_input_set - right_input_set,
-                                                    verbose=True), out_left_se, "fastq")
-SeqIO.write(SequenceRoutines.record_by_id_generator(right_input_reads_dict,
-                                                    right_input_set - left_input_set,
-                                                    verbose=True), out_right_se, "fastq")
-out_left_fd.close()
-out_right_fd.close()
-out_left_se_fd.close()
-out_right_se_fd.close()
-os.remove("left_in_reads.idx")
-os.remove("right_in_reads.idx")
+pair_number, \
+left_unpaired_number, \
+right_unpaired_number = SequenceRoutines.restore_pairs(args.input_left, args.input_right,
+                                                       "%s_1.fastq" % args.out_prefix,
+                                                       "%s_2.fastq" % args.out_prefix,
+                                                       "%s_1.se.fastq" % args.out_prefix,
+                                                       "%s_2.se.fastq" % args.out_prefix,
+                                                       format="fastq",
+                                                       forward_record_id_suffix=args.left_suffix,
+                                                       reverse_record_id_suffix=args.right_suffix,
+                                                       mode=args.mode,
+                                                       number_of_partitions=args.number_of_partitions,
+                                                       tmp_dir=args.tmp_dir)
+
+print("Pairs: %i" % pair_number)
+print("Left unpaired: %i" % left_unpaired_number)
+print("Right unpaired: %i" % right_unpaired_number)
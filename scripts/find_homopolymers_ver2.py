@@ -12,7 +12,7 @@ import matplotlib.pyplot as plt
 
 from Bio import SeqIO
 
-from Routines.Sequence import find_homopolymers
+from Routines import SequenceRoutines
 
 parser = argparse.ArgumentParser()
 
@@ -69,17 +69,20 @@ with open(args.out_file, "w") as out_fd:
         sequence = UTRs_dict[record_id].seq
         number_of_UTRs += 1
 
-        coords_list, length_list = find_homopolymers(sequence, args.nucleotide, min_size=args.min_size,
-                                                     search_type=args.search_type,
-                                                     max_single_insert_size=args.max_single_insert_size,
-                                                     max_total_insert_length=args.max_total_insert_length,
-                                                     max_number_of_insertions=args.max_number_of_insertions)
-        gene_name = UTRs_dict[record_id].description.split(";")[2].split("=")[1].split("-")[0]
+        coords_list, length_list = SequenceRoutines.find_homopolymers(sequence, args.nucleotide,
+                                                                      min_size=args.min_size,
+                                                                      search_type=args.search_type,
+                                                                      max_single_insert_size=args.max_single_insert_size,
+                                                                      max_total_insert_length=args.max_total_insert_length,
+                                                                      max_number_of_insertions=args.max_number_of_insertions)
+        # gene name and parent id are extracted from description of flybase fasta
+        description_list = UTRs_dict[record_id].description.split(";")
+        gene_name = description_list[2].split("=")[1].split("-")[0]
         if not coords_list:
             out_filterd_gene_name_fd.write(gene_name + "\n")
             continue
         id_fd.write(record_id + "\n")
-        gene_id = UTRs_dict[record_id].description.split(";")[5].split("=")[1]   # extract parent id from description of flybase fasta
+        gene_id = description_list[5].split("=")[1]
         gene_id_fd.write(gene_id + "\n")
           # extract gene name from description of flybase fasta
         gene_name_fd.write(gene_name + "\n")
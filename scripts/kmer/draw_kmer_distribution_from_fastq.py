@@ -13,6 +13,7 @@ import argparse
 from Bio import SeqIO
 
 #from Routines import MatplotlibRoutines
+from Routines import KmerRoutines
 from Routines.Sequence import rev_com_generator
 from Routines.File import make_list_of_path_to_files
 
@@ -51,6 +52,9 @@ parser.add_argument("-r", "--add_reverse_complement", action="store_true", dest=
                          "Not compatible with -b/--count_both_strands option")
 parser.add_argument("-j", "--jellyfish_path", action="store", dest="jellyfish_path",
                     help="Path to jellyfish")
+parser.add_argument("-p", "--python_counter", action="store_true", dest="python_counter",
+                    help="Count kmers by in-library counter instead of jellyfish. Intended for small data sets "
+                         "(mitochondrial or plastid genomes, amplicons). Kmer length is limited to 32")
 parser.add_argument("-w", "--low_limit", action="store", dest="low_limit", type=int, default=5,
                     help="Low limit of histogram without logscale. Default - 5")
 parser.add_argument("-g", "-high_limit", action="store", dest="high_limit", type=int, default=100,
@@ -78,13 +82,18 @@ kmer_file = "%s_%i_mer.kmer" % (args.output_prefix, args.kmer_length)
 histo_file = "%s_%i_mer.histo" % (args.output_prefix, args.kmer_length)
 picture_prefix = "%s_%i_mer_histogram" % (args.output_prefix, args.kmer_length)
 
-Jellyfish.threads = args.threads
-Jellyfish.timelog = "%s_%i_mer.jellyfish.time.log" % (args.output_prefix, args.kmer_length)
-Jellyfish.path = args.jellyfish_path if args.jellyfish_path else ""
-Jellyfish.count(args.input if not args.add_rev_com else file_with_rev_com, base_file,
-                kmer_length=args.kmer_length, hash_size=args.hash_size,
-                count_both_strands=args.count_both_strands)
-Jellyfish.histo(base_file, histo_file, upper_count=10000000)
+if args.python_counter:
+    KmerRoutines.get_histo(args.input if not args.add_rev_com else file_with_rev_com, histo_file,
+                           kmer_length=args.kmer_length, count_both_strands=args.count_both_strands,
+                           threads=args.threads, upper_count=10000000)
+else:
+    Jellyfish.threads = args.threads
+    Jellyfish.timelog = "%s_%i_mer.jellyfish.time.log" % (args.output_prefix, args.kmer_length)
+    Jellyfish.path = args.jellyfish_path if args.jellyfish_path else ""
+    Jellyfish.count(args.input if not args.add_rev_com else file_with_rev_com, base_file,
+                    kmer_length=args.kmer_length, hash_size=args.hash_size,
+                    count_both_strands=args.count_both_strands)
+    Jellyfish.histo(base_file, histo_file, upper_count=10000000)
 Jellyfish.draw_kmer_distribution(histo_file, args.kmer_length, picture_prefix, output_formats=args.output_formats,
                                  logbase=args.logbase, non_log_low_limit=args.low_limit,
                                  non_log_high_limit=args.high_limit) #, draw_peaks_and_gaps=args.draw_peaks_and_gaps)
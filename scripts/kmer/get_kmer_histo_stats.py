@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+__author__ = 'Sergei F. Kliver'
+
+import argparse
+
+from collections import OrderedDict
+
+from Tools.Kmers import Jellyfish
+from CustomCollections.HistogramCollections import KmerHistogramCollection
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-i", "--input", action="store", dest="input", required=True,
+                    type=lambda s: s.split(","),
+                    help="Comma-separated list of histo files produced by jellyfish histo")
+parser.add_argument("-s", "--samples", action="store", dest="samples",
+                    type=lambda s: s.split(","),
+                    help="Comma-separated list of sample ids. Must have same length as list of files."
+                         "If not set names of files without directory and extension will be used as sample ids")
+parser.add_argument("-o", "--output_prefix", action="store", dest="output_prefix", required=True,
+                    help="Output prefix")
+parser.add_argument("-c", "--check_peaks_coef", action="store", dest="check_peaks_coef", type=float, default=10,
+                    help="Histograms are checked for additional peaks in range "
+                         "[first peak, check_peaks_coef * first peak]. Default - 10")
+parser.add_argument("-n", "--no_sample_reports", action="store_false", dest="write_sample_reports",
+                    help="Don't write report for each sample, only table with statistics for all samples")
+parser.add_argument("-d", "--draw", action="store_true", dest="draw",
+                    help="Draw distributions for all samples")
+parser.add_argument("-m", "--kmer_length", action="store", dest="kmer_length", type=int, default=23,
+                    help="Length of kmers. Used for drawing only. Default - 23")
+parser.add_argument("-e", "--output_formats", action="store", dest="output_formats", type=lambda s: s.split(","),
+                    default=["svg", "png"],
+                    help="Comma-separated list of formats (supported by matlotlib) "
+                         "of output figures. Default: svg,png")
+parser.add_argument("-l", "--logbase", action="store", dest="logbase", type=int, default=10,
+                    help="Base of logarithm. Default - 10")
+parser.add_argument("-w", "--low_limit", action="store", dest="low_limit", type=int, default=5,
+                    help="Low limit of histogram without logscale")
+parser.add_argument("-g", "--high_limit", action="store", dest="high_limit", type=int, default=100,
+                    help="High limit of histogram without logscale")
+
+args = parser.parse_args()
+
+if args.samples and (len(args.samples) != len(args.input)):
+    raise ValueError("Numbers of samples and histo files are different")
+
+histo_file_dict = OrderedDict(zip(args.samples, args.input)) if args.samples \
+    else KmerHistogramCollection.get_histo_file_dict(args.input)
+
+Jellyfish.analyze_histo_files(histo_file_dict, args.output_prefix, kmer_length=args.kmer_length,
+                              check_peaks_coef=args.check_peaks_coef, write_sample_reports=args.write_sample_reports,
+                              draw=args.draw, output_formats=args.output_formats, logbase=args.logbase,
+                              non_log_low_limit=args.low_limit, non_log_high_limit=args.high_limit)
@@ -16,8 +16,17 @@ parser.add_argument("-o", "--output", action="store", dest="output", required=Tr
 parser.add_argument("-c", "--coordinates_file", action="store", dest="coords_file", required=True,
                     help="File to write file with coordinates of alignments in merged alignment")
 parser.add_argument("-f", "--format", action="store", dest="format", default="fasta",
-                    help="Format of alignments")
+                    help="Format of input alignments. Merged alignment is always written in FASTA")
+parser.add_argument("-s", "--streaming", action="store_true", dest="streaming",
+                    help="Merge alignments one by one via on-disk buffer. "
+                         "Missing taxa are filled with gaps. Default: False")
+parser.add_argument("-g", "--gap_symbol", action="store", dest="gap_symbol", default="-",
+                    help="Gap symbol used in streaming mode. Default: '-'")
 
 args = parser.parse_args()
 
-MultipleAlignmentRoutines.merge_alignment(args.input, args.output, args.coords_file, format=args.format)
+if args.streaming:
+    MultipleAlignmentRoutines.merge_alignment_streaming(args.input, args.output, args.coords_file, format=args.format,
+                                                        gap_symbol=args.gap_symbol)
+else:
+    MultipleAlignmentRoutines.merge_alignment(args.input, args.output, args.coords_file, format=args.format)
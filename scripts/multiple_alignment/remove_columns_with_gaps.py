@@ -3,7 +3,6 @@ __author__ = 'Sergei F. Kliver'
 import os
 import argparse
 
-from Bio import AlignIO
 from Routines import MultipleAlignmentRoutines
 from Routines.File import check_path, make_list_of_path_to_files, save_mkdir, split_filename
 
@@ -36,8 +35,7 @@ for alignment_file in args.input:
     if args.verbose:
         print ("Handling %s ..." % alignment_file)
     output_filename = "%s%s%s%s" % (args.output, splited_filename[1], args.suffix, splited_filename[2])
-    alignment = AlignIO.read(alignment_file, args.format)
-    filtered_alignment = MultipleAlignmentRoutines.remove_columns_with_gaps(alignment, args.max_gap_number,
-                                                                            gap_symbol=args.gap_symbol)
-    AlignIO.write(filtered_alignment, output_filename, args.format)
+    MultipleAlignmentRoutines.remove_columns_with_gaps_from_file(alignment_file, output_filename,
+                                                                 args.max_gap_number, gap_symbol=args.gap_symbol,
+                                                                 format=args.format)
 
@@ -23,7 +23,11 @@ parser.add_argument("-m", "--format", action="store", dest="format", default="fa
                     help="Format of input and output file. Allowed formats genbank, fasta(default)")
 parser.add_argument("-p", "--parsing_mode", action="store", dest="parsing_mode", default="index_db",
                     help="Parsing mode for input sequence file. "
-                         "Possible variants: 'index_db'(default), 'index', 'parse'")
+                         "Possible variants: 'index_db'(default), 'index', 'parse'. Ignored for fasta and fastq")
+parser.add_argument("-t", "--pairing_mode", action="store", dest="pairing_mode", default="auto",
+                    help="Pairing mode for fasta and fastq files. Possible variants: "
+                         "'ordered' - files are in the same order, 'partition' - files are unordered, "
+                         "'auto'(default) - try 'ordered' and switch to 'partition' if files are unordered")
 
 args = parser.parse_args()
 
@@ -42,6 +46,7 @@ example of usage
 SequenceRoutines.check_pairing_from_file(args.forward, args.reverse, args.output_prefix, args.forward_suffix,
                                          args.reverse_suffix, parsing_mode=args.parsing_mode, format=args.format,
                                          forward_index_file="forward_tmp.idx", reverse_index_file="reverse_tmp.idx",
-                                         retain_index=False, output_file_extension=args.format)
+                                         retain_index=False, output_file_extension=args.format,
+                                         pairing_mode=args.pairing_mode)
 
 
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+__author__ = 'Sergei F. Kliver'
+
+import argparse
+
+from Routines import SequenceRoutines
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-i", "--input_file", action="store", dest="input_file", required=True,
+                    help="Input fasta file with sequences")
+parser.add_argument("-o", "--output_file", action="store", dest="output_file", required=True,
+                    help="Output file with homopolymers")
+parser.add_argument("-f", "--output_format", action="store", dest="output_format", default="bed",
+                    help="Format of output. Allowed: bed(default), gff")
+parser.add_argument("-n", "--nucleotides", action="store", dest="nucleotides", default="ACGT",
+                    help="Nucleotides to search homopolymers for. Default: ACGT")
+parser.add_argument("-m", "--min_size", action="store", dest="min_size", type=int, default=5,
+                    help="Minimum size of homopolymer. Default: 5")
+parser.add_argument("-s", "--search_type", action="store", dest="search_type", default="perfect",
+                    help="Type of search, possible values: 'perfect'(default) or 'non_perfect'")
+parser.add_argument("-x", "--max_single_insert_size", action="store", dest="max_single_insert_size", type=int,
+                    default=1,
+                    help="Maximum allowed size of single insertion. Ignored for 'perfect' search type. Default: 1")
+parser.add_argument("-y", "--max_number_of_insertions", action="store", dest="max_number_of_insertions", type=int,
+                    default=2,
+                    help="Maximum number of inserted nucleotides. Ignored for 'perfect' search type. Default: 2")
+parser.add_argument("-z", "--max_total_insert_length", action="store", dest="max_total_insert_length", type=int,
+                    default=None,
+                    help="Maximum total size of insertions. Ignored for 'perfect' search type")
+parser.add_argument("-t", "--threads", action="store", dest="threads", type=int, default=1,
+                    help="Number of threads(records are processed in parallel). Default: 1")
+
+args = parser.parse_args()
+
+SequenceRoutines.find_homopolymers_from_file(args.input_file, args.output_file, nucleotides=args.nucleotides,
+                                             min_size=args.min_size, search_type=args.search_type,
+                                             max_single_insert_size=args.max_single_insert_size,
+                                             max_total_insert_length=args.max_total_insert_length,
+                                             max_number_of_insertions=args.max_number_of_insertions,
+                                             output_format=args.output_format, threads=args.threads)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Tests of EntrezClient and NCBIRoutines.get_cds_for_proteins against local stand-in for efetch.
+Run from root of repository: python -m unittest discover tests
+"""
+import os
+import time
+import shutil
+import urlparse
+import tempfile
+import unittest
+import threading
+
+from StringIO import StringIO
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.Alphabet import generic_dna, generic_protein
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature, FeatureLocation
+
+from Routines import NCBIRoutines
+from Routines.NCBI import EntrezClient
+
+
+def make_genbank_record(record_id, sequence, alphabet, features):
+    record = SeqRecord(Seq(sequence, alphabet), id=record_id, name=record_id.split(".")[0],
+                       description="test record %s" % record_id, features=features)
+    record.annotations["accessions"] = [record_id.split(".")[0]]
+    handle = StringIO()
+    SeqIO.write(record, handle, format="genbank")
+    return handle.getvalue()
+
+
+class EfetchStandIn(object):
+    # records of stand-in databases, log of requests and number of simultaneously handled requests
+    def __init__(self):
+        self.records = {"protein": {}, "nuccore": {}}
+        self.request_log = []
+        self.request_times = []
+        self.failures_to_emulate = 0
+        self.delay = 0.0
+        self.active_requests = 0
+        self.max_active_requests = 0
+        self.lock = threading.Lock()
+
+    def add_cds_pair(self, protein_id, transcript_id, cds_sequence):
+        protein_sequence = str(Seq(cds_sequence, generic_dna).translate())
+        self.records["protein"][protein_id] = make_genbank_record(
+            protein_id, protein_sequence, generic_protein,
+            [SeqFeature(FeatureLocation(0, len(protein_sequence)), type="CDS",
+                        qualifiers={"coded_by": ["%s:4..%i" % (transcript_id, len(cds_sequence) + 3)]})])
+        self.records["nuccore"][transcript_id] = make_genbank_record(
+            transcript_id, "GGG" + cds_sequence + "TTT", generic_dna,
+            [SeqFeature(FeatureLocation(3, len(cds_sequence) + 3, strand=1), type="CDS",
+                        qualifiers={"protein_id": [protein_id]})])
+
+    def handle(self, parameters):
+        with self.lock:
+            self.active_requests += 1
+            self.max_active_requests = max(self.max_active_requests, self.active_requests)
+            self.request_log.append(parameters)
+            self.request_times.append(time.time())
+            fail = self.failures_to_emulate > 0
+            if fail:
+                self.failures_to_emulate -= 1
+        try:
+            time.sleep(self.delay)
+            if fail:
+                return 503, ""
+            database = self.records[parameters["db"]]
+            # as NCBI, accessions without versions are accepted
+            accessions = dict([(record_id.split(".")[0], record_id) for record_id in database])
+            return 200, "\n".join([database[record_id if record_id in database else accessions[record_id]]
+                                   for record_id in parameters["id"].split(",")
+                                   if (record_id in database) or (record_id in accessions)])
+        finally:
+            with self.lock:
+                self.active_requests -= 1
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class EntrezClientTests(unittest.TestCase):
+    def setUp(self):
+        self.stand_in = EfetchStandIn()
+        stand_in = self.stand_in
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                parameters = dict(urlparse.parse_qsl(body))
+                code, text = stand_in.handle(parameters)
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.base_url = "http://127.0.0.1:%i/" % self.server.server_address[1]
+
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.work_dir, "cache")
+
+        cds = "ATGGCTAAAGGTTGA"
+        for index in range(0, 25):
+            self.stand_in.add_cds_pair("XP_%05i.1" % index, "XM_%05i.1" % index, cds)
+            cds = cds[:3] + "GCT" + cds[3:]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir)
+
+    def get_client(self, **kwargs):
+        parameters = {"base_url": self.base_url, "cache_dir": self.cache_dir, "requests_per_second": 100,
+                      "retry_delay": 0}
+        parameters.update(kwargs)
+        return EntrezClient(**parameters)
+
+    def test_records_are_returned_in_order_and_cached(self):
+        id_list = ["XP_%05i.1" % index for index in range(0, 25)]
+        records = list(self.get_client().fetch_records("protein", id_list, rettype="gb", chunk_size=4))
+        self.assertEqual([record_id for record_id, text in records], id_list)
+        self.assertEqual(records[3][1], self.stand_in.records["protein"]["XP_00003.1"])
+        self.assertEqual(len(self.stand_in.request_log), 7)
+
+        # everything is taken from cache
+        self.assertEqual(list(self.get_client().fetch_records("protein", id_list, rettype="gb", chunk_size=4)),
+                         records)
+        self.assertEqual(len(self.stand_in.request_log), 7)
+
+    def test_partially_downloaded_list_is_resumed(self):
+        self.get_client().fetch("protein", ["XP_00001.1", "XP_00002.1"], os.path.join(self.work_dir, "a.gb"),
+                                rettype="gb")
+        self.stand_in.request_log = []
+        fetched_ids = self.get_client().fetch("protein", ["XP_00000.1", "XP_00001.1", "XP_00002.1", "XP_00003"],
+                                              os.path.join(self.work_dir, "b.gb"), rettype="gb")
+        # accession without version is matched to versioned record
+        self.assertEqual(list(fetched_ids), ["XP_00000.1", "XP_00001.1", "XP_00002.1", "XP_00003"])
+        self.assertEqual(len(self.stand_in.request_log), 1)
+        self.assertEqual(self.stand_in.request_log[0]["id"], "XP_00000.1,XP_00003")
+
+    def test_missing_ids_are_skipped(self):
+        records = list(self.get_client().fetch_records("protein", ["XP_00001.1", "XP_99999.1"], rettype="gb"))
+        self.assertEqual([record_id for record_id, text in records], ["XP_00001.1"])
+
+    def test_concurrency_and_rate_are_limited(self):
+        self.stand_in.delay = 0.1
+        id_list = ["XP_%05i.1" % index for index in range(0, 20)]
+        list(self.get_client(max_concurrent_requests=2, requests_per_second=20).fetch_records("protein", id_list,
+                                                                                             rettype="gb",
+                                                                                             chunk_size=2))
+        self.assertEqual(len(self.stand_in.request_log), 10)
+        self.assertEqual(self.stand_in.max_active_requests, 2)
+
+        self.stand_in.delay = 0.0
+        self.stand_in.request_times = []
+        list(self.get_client(max_concurrent_requests=3, requests_per_second=10, cache_dir=None).fetch_records(
+            "protein", id_list, rettype="gb", chunk_size=2))
+        intervals = [second - first for first, second in zip(sorted(self.stand_in.request_times)[:-1],
+                                                             sorted(self.stand_in.request_times)[1:])]
+        self.assertGreaterEqual(sum(intervals), 0.85)
+
+    def test_server_errors_are_retried(self):
+        self.stand_in.failures_to_emulate = 2
+        records = list(self.get_client(number_of_retries=2).fetch_records("protein", ["XP_00001.1"], rettype="gb"))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(len(self.stand_in.request_log), 3)
+
+        self.stand_in.failures_to_emulate = 3
+        with self.assertRaises(IOError):
+            list(self.get_client(number_of_retries=2).fetch_records("protein", ["XP_00002.1"], rettype="gb"))
+
+    def test_get_cds_for_proteins(self):
+        output_prefix = os.path.join(self.work_dir, "cds")
+        id_list = ["XP_%05i.1" % index for index in range(0, 25)] + ["XP_99999.1"]
+        NCBIRoutines.get_cds_for_proteins(id_list, output_prefix, download_chunk_size=4,
+                                          entrez_client=self.get_client(max_concurrent_requests=3))
+
+        cds_records = list(SeqIO.parse("%s.cds" % output_prefix, format="fasta"))
+        self.assertEqual([record.id for record in cds_records], ["XM_%05i.1" % index for index in range(0, 25)])
+        for record in cds_records:
+            protein_id = record.description.split("protein=")[1]
+            self.assertEqual(str(record.seq.translate()),
+                             str(SeqIO.read(StringIO(self.stand_in.records["protein"][protein_id]),
+                                            format="genbank").seq))
+        with open("%s.not_downloaded.ids" % output_prefix, "r") as in_fd:
+            self.assertEqual(in_fd.read().split(), ["XP_99999.1"])
+        with open("%s.stats" % output_prefix, "r") as in_fd:
+            self.assertIn("Downloaded transcripts\t25", in_fd.read())
+
+        # rerun is served from cache
+        number_of_requests = len(self.stand_in.request_log)
+        NCBIRoutines.get_cds_for_proteins(id_list, output_prefix, download_chunk_size=4,
+                                          entrez_client=self.get_client())
+        self.assertEqual(len(self.stand_in.request_log), number_of_requests + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()